@@ -9,7 +9,9 @@ if [ -e /var/log/awslogs-agent-setup.log ]; then
     cat /var/log/awslogs-agent-setup.log
 fi
 
-/root/bin/registerService.py
+# Queue the registration and the status changes made while booting, they are
+# sent together with the next change made without --queue.
+/root/bin/registerService.py --queue
 
 if [ -e /opt/patches/runContainer.sh ]; then
     echo "Running dynamic update."
@@ -27,7 +29,7 @@ if [ ! -e /opt/mysql/data/mysql ]; then
     /root/bin/serviceStatus.py initialising "Performing initial Db setup."
     /root/bin/initial-setup.sh
     RET=$?
-    /root/bin/serviceStatus.py starting "Post initialisation start up."
+    /root/bin/serviceStatus.py --queue starting "Post initialisation start up."
 else
     RET=0
 fi
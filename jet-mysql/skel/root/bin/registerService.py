@@ -1,12 +1,20 @@
 #!/usr/bin/env python
 """
 Register a new service.
+
+    registerService.py [--queue]
+
+With --queue the registration is queued and sent along with the first status
+change serviceStatus.py sends, in one request.
 """
 
 import requests
 import os
 import netifaces
 import socket
+import sys
+
+import servicequeue
 
 serviceName = os.environ.get('SERVICE_NAME')
 serviceNumber = os.environ.get('SERVICE_NUMBER')
@@ -23,7 +31,10 @@ def getMyInfo(overseerIP):
     if response.status_code == 200:
         return response.json()['info']
 
-def register(overseerIP, info):
+def registration(info):
+    """
+    Return the parameters registering this container.
+    """
     if serviceName == 'jetdb':
         port = '3306/tcp'
     else:
@@ -41,6 +52,9 @@ def register(overseerIP, info):
         'ServiceName': '%s-%s' % (serviceName, sNumber),
         'TaskId': '%s-%s' % (serviceName, info['ShortId']),
     }
+    return params
+
+def register(overseerIP, params):
     response = requests.get('http://%s:3000/services/register' % overseerIP, params=params)
     if response.status_code == 200:
         data = response.json()
@@ -70,15 +84,24 @@ def createProfileD(overseerIP, params):
     fh.close()
 
 def main():
+    queueOnly = '--queue' in sys.argv[1:]
     gateways = netifaces.gateways()['default']
     gwip = gateways[netifaces.AF_INET][0]
     overseerIP = getOverseerIP(gwip)
     if overseerIP:
         info = getMyInfo(overseerIP)
         if info:
-            params = register(overseerIP, info)
+            params = registration(info)
+            if queueOnly:
+                # Anything left from a previous run of the container is stale
+                servicequeue.clear()
+                servicequeue.queue([dict(params, op='register')])
+                print "Service registration queued."
+            else:
+                params = register(overseerIP, params)
+                if params:
+                    print "Service registered successfully."
             if params:
-                print "Service registered successfully."
                 createDotEnv(overseerIP, params)
                 createProfileD(overseerIP, params)
         else:
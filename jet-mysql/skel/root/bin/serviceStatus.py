@@ -1,6 +1,11 @@
 #!/usr/bin/env python
 """
-Register a new service.
+Change the status of this service.
+
+    serviceStatus.py [--queue] status [message]
+
+With --queue the change is queued and sent with the next change made without
+it, in one request along with a registration queued by registerService.py.
 """
 
 import requests
@@ -8,24 +13,39 @@ import os
 import sys
 from dotenv import load_dotenv
 
+import servicequeue
+
 load_dotenv('/etc/.env')
 
-status = sys.argv[1]
-if len(sys.argv) > 2:
-    message = sys.argv[2]
+args = sys.argv[1:]
+queueOnly = '--queue' in args
+if queueOnly:
+    args.remove('--queue')
+status = args[0]
+if len(args) > 1:
+    message = args[1]
 else:
     message = 'No message supplied.'
 TaskId = os.environ.get("TASK_ID")
 OverseerIP = os.environ.get('OVERSEER_IP')
-params = {'Status': status, 'Message': message, 'TaskId': TaskId,}
-response = requests.get('http://%s:3000/services/status' % OverseerIP, params=params)
-if response.status_code == 200:
-    info = response.json()
-    if info['metadata']['status'] == 200:
-        print "Status changed to %s" % status
-    else:
-        print "Failure changing status: %s" % info['metadata']['message']
+operation = {'op': 'status', 'Status': status, 'Message': message, 'TaskId': TaskId,}
+if queueOnly:
+    servicequeue.queue([operation])
+    print "Status change to %s queued" % status
 else:
-    print "Failed to change service status."
-    print response.text
-
+    try:
+        results = servicequeue.send(OverseerIP, [operation])
+    except requests.RequestException, exc:
+        print "Failed to change service status."
+        print exc
+    else:
+        for operation, result in results:
+            if operation['op'] == 'register':
+                if result['status'] == 200:
+                    print "Service registered successfully."
+                else:
+                    print "Failed to register service: %s" % result.get('message')
+            elif result['status'] == 200:
+                print "Status changed to %s" % operation['Status']
+            else:
+                print "Failure changing status: %s" % result.get('message')
@@ -0,0 +1,81 @@
+"""
+Queue the registration and status changes of this service and send them to
+the overseer together, in one /services/batch request.
+"""
+
+import json
+import os
+import time
+
+import requests
+
+QUEUE = '/etc/.service-queue'
+
+
+def queue(operations):
+    """
+    Append the operations, stamped with when they happened, to the queue.
+    """
+    fh = open(QUEUE, 'a')
+    for operation in operations:
+        operation.setdefault('Date', time.strftime('%Y-%m-%d %H:%M:%S'))
+        fh.write(json.dumps(operation) + "\n")
+    fh.flush()
+    fh.close()
+
+
+def queued():
+    """
+    Return the operations in the queue, oldest first.
+    """
+    if not os.path.exists(QUEUE):
+        return []
+    fh = open(QUEUE)
+    operations = [json.loads(line) for line in fh if line.strip()]
+    fh.close()
+    return operations
+
+
+def clear():
+    if os.path.exists(QUEUE):
+        os.remove(QUEUE)
+
+
+def sendOne(overseerIP, operation):
+    """
+    Send an operation to an overseer without /services/batch.
+    """
+    params = dict(operation)
+    op = params.pop('op')
+    params.pop('Date', None)
+    url = 'http://%s:3000/services/%s' % (overseerIP, op == 'register' and 'register' or 'status')
+    response = requests.get(url, params=params)
+    if response.status_code != 200:
+        return {'status': response.status_code, 'message': response.text}
+    return response.json()['metadata']
+
+
+def send(overseerIP, operations):
+    """
+    Send the queued operations and then these, returning each with its
+    result. If the overseer cannot be reached they are all kept in the queue
+    for the next send.
+    """
+    operations = queued() + operations
+    try:
+        response = requests.post(
+            'http://%s:3000/services/batch' % overseerIP,
+            data=json.dumps({'operations': operations}),
+            headers={'Content-Type': 'application/json'},
+        )
+        if response.status_code in (404, 405):
+            results = [sendOne(overseerIP, operation) for operation in operations]
+        else:
+            response.raise_for_status()
+            results = response.json()['results']
+    except requests.RequestException:
+        clear()
+        queue(operations)
+        raise
+    clear()
+    return zip(operations, results)
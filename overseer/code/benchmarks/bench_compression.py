@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Benchmark the compression of the batches forwarded between broadcasters.
+
+Reports the compression ratio and the CPU milliseconds spent per MB of packed
+messages to compress and decompress them, for each codec and batch size. The
+records are the lines of a captured log, eg. from /jLog/query or the files in
+logs/, or a generated mix of access and application lines without --sample.
+
+    python benchmarks/bench_compression.py --sample capture.log --batches 10,100,500
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import logwire
+
+
+def generatedLines(count):
+    """
+    Return count lines that look like what the overseer logs.
+    """
+    random.seed(1)
+    services = ['jetdb-%d' % index for index in xrange(8)] + ['filetracker-db']
+    lines = []
+    for _ in xrange(count):
+        choice = random.random()
+        if choice < 0.7:
+            lines.append(('tornado.access', logging.INFO, '%d GET /services/get?ServiceName=%s (172.17.0.%d) %.2fms' % (
+                random.choice((200, 200, 200, 404)), random.choice(services),
+                random.randint(2, 30), random.uniform(0.5, 40),
+            )))
+        elif choice < 0.95:
+            lines.append(('tornado.general', logging.WARNING, 'Connection to tcp://10.0.%d.%d:13001 lost, retrying in %d seconds' % (
+                random.randint(0, 3), random.randint(1, 254), random.randint(1, 10),
+            )))
+        else:
+            lines.append(('tornado.application', logging.ERROR, 'Service %s failed its health check: %s' % (
+                random.choice(services), random.choice(('timeout', 'refused', 'reset')),
+            )))
+    return lines
+
+
+def sampleLines(path, count):
+    """
+    Return up to count lines from a captured log.
+    """
+    lines = []
+    with open(path) as fh:
+        for line in fh:
+            line = line.rstrip('\n')
+            if line:
+                lines.append(('captured', logging.INFO, line))
+            if len(lines) >= count:
+                break
+    return lines
+
+
+def messages(lines):
+    """
+    Return the LOGRECORD message of each line as the broadcaster relays it.
+    """
+    serializer = logwire.getSerializer('jlb1')
+    result = []
+    for name, level, line in lines:
+        record = logging.LogRecord(name, level, __file__, 1, line, None, None)
+        record.source = 'Node-10.0.0.1'
+        frames = logwire.encodeRecord(record, serializer)
+        frames[0] = logwire.makeTopic('LOGRECORD', name)
+        result.append(frames)
+    return result
+
+
+def run(msgs, name, batch_size):
+    """
+    Return the ratio and the compress and decompress CPU ms per MB.
+    """
+    encoder, decoder = logwire.newCodec(name), logwire.newCodec(name)
+    batches = [msgs[start:start + batch_size] for start in xrange(0, len(msgs), batch_size)]
+    raw = sum(len(logwire.packBatch(batch)) for batch in batches)
+    started = time.clock()
+    encoded = [logwire.encodeBatch('Node-10.0.0.1', batch, encoder) for batch in batches]
+    compress = time.clock() - started
+    started = time.clock()
+    for frames in encoded:
+        decoder.decompress(frames[3])
+    decompress = time.clock() - started
+    sent = sum(len(frames[3]) for frames in encoded)
+    megabytes = raw / 1024.0 / 1024.0
+    return float(raw) / sent, compress * 1000 / megabytes, decompress * 1000 / megabytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sample', default=None, help='A captured log, a line per record.')
+    parser.add_argument('--records', type=int, default=50000)
+    parser.add_argument('--batches', default='10,100,500',
+        help='The batch sizes to compare.')
+    options = parser.parse_args()
+    if options.sample:
+        lines = sampleLines(options.sample, options.records)
+    else:
+        lines = generatedLines(options.records)
+    msgs = messages(lines)
+    print "%d records, %.1f MB packed" % (
+        len(msgs), len(logwire.packBatch(msgs)) / 1024.0 / 1024.0,
+    )
+    print "%-6s %8s %8s %14s %14s" % ('codec', 'batch', 'ratio', 'comp ms/MB', 'decomp ms/MB')
+    for name in sorted(logwire.CODECS):
+        for batch_size in [int(each) for each in options.batches.split(',')]:
+            ratio, compress, decompress = run(msgs, name, batch_size)
+            print "%-6s %8d %8.2f %14.1f %14.1f" % (
+                name, batch_size, ratio, compress, decompress,
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+Benchmark the jLog fan-out to many SockJS clients.
+
+Compares the old path, formatting each record and broadcasting one SockJS
+frame per record to every client, with the ZMQSubscriber formatting each record
+once and flushing the queued records to each client in coalesced frames.
+
+    python benchmarks/bench_jlog_fanout.py --records 5000 --clients 1,10,100,500
+"""
+
+import argparse
+import cStringIO
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sockjs.tornado import proto
+
+import logwire
+from handlers import jLog
+
+
+class FakeSession(object):
+    """
+    Builds the SockJS frames a transport would write and counts them.
+    """
+    send_expects_json = True
+    is_closed = False
+
+    def __init__(self):
+        self.frames = self.bytes = 0
+        self.transport = cStringIO.StringIO()
+
+    def send_jsonified(self, msg, stats=True):
+        frame = 'a[%s]' % msg
+        self.transport.write(frame)
+        self.transport.reset()
+        self.frames += 1
+        self.bytes += len(frame)
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.session = FakeSession()
+
+
+class BenchSubscriber(jLog.ZMQSubscriber):
+    """
+    A subscriber without the ZMQ socket or IOLoop timer, flushed by hand.
+    """
+    def setup(self):
+        pass
+
+
+def messages(count):
+    """
+    Return count published LOGRECORD messages.
+    """
+    serializer = logwire.getSerializer('jlb1')
+    result = []
+    for index in xrange(count):
+        record = logging.LogRecord(
+            'tornado.access', logging.INFO, __file__, 1,
+            '200 GET /services/get?ServiceName=jetdb-%d (172.17.0.5) %.2fms',
+            (index % 16, 1.5), None,
+        )
+        record.source = 'Node-10.0.0.1'
+        frames = logwire.encodeRecord(record, serializer)
+        frames[0] = logwire.makeTopic('LOGRECORD', record.name)
+        result.append(frames)
+    return result
+
+
+def runOld(msgs, clients):
+    """
+    The original fan-out, format then broadcast a frame per record.
+    """
+    backlog = []
+    for msg in msgs:
+        record = logwire.decodeRecord(msg)
+        backlog.append(record)
+        json_msg = proto.json_encode(jLog.formatter.format(record))
+        for conn in clients:
+            conn.session.send_jsonified(json_msg, False)
+
+
+def runNew(msgs, clients, flush_every):
+    """
+    The coalesced fan-out, flushing every flush_every records.
+    """
+    subscriber = BenchSubscriber()
+    for conn in clients:
+        subscriber.add(conn)
+    for index, msg in enumerate(msgs):
+        subscriber.on_recv_sub(msg)
+        if index % flush_every == 0:
+            subscriber.flush()
+    subscriber.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=5000)
+    parser.add_argument('--clients', default='1,10,100,500')
+    parser.add_argument('--flush-every', type=int, default=100,
+        help='Records between flushes, eg. 1000 records/s with coalesce_ms=100.')
+    options = parser.parse_args()
+    msgs = messages(options.records)
+    print "%8s %6s %12s %12s %12s" % ('clients', 'path', 'us/record', 'frames', 'KB sent')
+    for count in [int(each) for each in options.clients.split(',')]:
+        for name in ('old', 'new'):
+            clients = [FakeConnection() for _ in xrange(count)]
+            started = time.time()
+            if name == 'old':
+                runOld(msgs, clients)
+            else:
+                runNew(msgs, clients, options.flush_every)
+            elapsed = time.time() - started
+            print "%8d %6s %12.1f %12d %12.0f" % (
+                count, name, elapsed / len(msgs) * 1e6,
+                sum(conn.session.frames for conn in clients),
+                sum(conn.session.bytes for conn in clients) / 1024.0,
+            )
+
+
+if __name__ == '__main__':
+    main()
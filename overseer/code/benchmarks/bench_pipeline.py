@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""
+Benchmark the jLog pipeline end to end.
+
+Starts the broadcaster, in a thread of this process or a process of its own,
+M subscriber processes decoding and formatting each record as the jLog
+ZMQSubscriber does, and K producer processes logging through a PUSHHandler at
+the given rate. Reports the throughput, the latency from each record being
+created to it being formatted by a subscriber, the records each subscriber
+missed and the resident memory of every stage.
+
+Everything runs on this machine over loopback TCP or ipc:// sockets:
+
+    python benchmarks/bench_pipeline.py --producers 4 --rate 5000 --subscribers 2
+    python benchmarks/bench_pipeline.py --transport ipc --handler queued --codec zdict
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import broadcaster
+import loghandler
+import logwire
+
+
+# The format of the jLog viewer, see handlers.jLog.formatter
+formatter = logging.Formatter(
+    '%(asctime)s [%(source)s %(name)s %(levelname)s]: %(message)s',
+    '%d/%m/%Y %H:%M:%S',
+)
+
+
+def memory(pid='self'):
+    """
+    Return the (current, peak) resident memory of the process in MB.
+    """
+    values = {}
+    try:
+        with open('/proc/%s/status' % pid) as fh:
+            for line in fh:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    values[line[:5]] = int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    return values.get('VmRSS', 0), values.get('VmHWM', 0)
+
+
+def endpoints(transport):
+    """
+    Return the (frontend, backend) endpoints the producers and subscribers use.
+    """
+    if transport == 'ipc':
+        base = os.path.join(tempfile.gettempdir(), 'jlog-bench-%d' % os.getpid())
+        return 'ipc://%s-pull' % base, 'ipc://%s-pub' % base
+    return 'tcp://127.0.0.1:13001', 'tcp://127.0.0.1:13002'
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def produce(index, uri, options, results):
+    """
+    Log at options.rate records a second for options.duration seconds.
+    """
+    # The handlers print their connection progress
+    sys.stdout = open(os.devnull, 'w')
+    if options.handler == 'queued':
+        handler = loghandler.QueuedPUSHHandler(
+            uri, None, None, options.serializer, codec=options.codec,
+        )
+    else:
+        handler = loghandler.PUSHHandler(uri, serializer=options.serializer)
+    logger = logging.getLogger('bench.pipeline.%d' % index)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    message = 'x' * options.size
+    emitted = 0
+    started = time.time()
+    deadline = started + options.duration
+    while True:
+        now = time.time()
+        if now >= deadline:
+            break
+        due = options.rate and int((now - started) * options.rate) - emitted or 100
+        for _ in xrange(due):
+            logger.info('%d %s', emitted, message)
+            emitted += 1
+        if options.rate:
+            time.sleep(0.005)
+    stats = handler.stats()
+    handler.close()
+    results.put(('producer', index, {
+        'emitted': emitted,
+        'dropped': stats.get('dropped', 0) + stats['backlog_dropped'],
+        'backlog': stats['backlog'],
+        'memory': memory(),
+    }))
+
+
+def subscribe(index, uri, options, ready, done, results):
+    """
+    Receive, decode and format every record until done is set and nothing has
+    arrived for a second.
+    """
+    context = zmq.Context()
+    socket = context.socket(zmq.SUB)
+    socket.setsockopt(zmq.RCVHWM, options.hwm)
+    socket.connect(uri)
+    socket.setsockopt(zmq.SUBSCRIBE, '')
+    time.sleep(0.5)
+    ready.set()
+    latencies = []
+    first = last = None
+    while True:
+        if not socket.poll(1000):
+            if done.is_set():
+                break
+            continue
+        msg = socket.recv_multipart()
+        messages = [msg]
+        if msg[0] == 'BATCH':
+            messages = logwire.decodeBatch(msg)[1]
+        for frames in messages:
+            if logwire.splitTopic(frames[0])[0] != 'LOGRECORD':
+                continue
+            record = logwire.decodeRecord(frames)
+            json.dumps(formatter.format(record))
+            last = time.time()
+            first = first or last
+            latencies.append(last - record.created)
+    socket.close(linger=0)
+    context.term()
+    latencies.sort()
+    results.put(('subscriber', index, {
+        'received': len(latencies),
+        'elapsed': first and last - first or 0,
+        'p50': percentile(latencies, 0.5),
+        'p90': percentile(latencies, 0.9),
+        'p99': percentile(latencies, 0.99),
+        'max': latencies and latencies[-1] or 0,
+        'memory': memory(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--producers', type=int, default=2)
+    parser.add_argument('--subscribers', type=int, default=1)
+    parser.add_argument('--rate', type=int, default=2000,
+        help='Records per second from each producer, 0 for as fast as possible.')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds to produce for.')
+    parser.add_argument('--size', type=int, default=100, help='Message bytes.')
+    parser.add_argument('--handler', choices=('push', 'queued'), default='push')
+    parser.add_argument('--serializer', choices=sorted(logwire.SERIALIZERS), default='jlb1')
+    parser.add_argument('--codec', choices=sorted(logwire.CODECS), default=None,
+        help='Send batches with this codec, queued handler only.')
+    parser.add_argument('--transport', choices=('tcp', 'ipc'), default='tcp')
+    parser.add_argument('--broadcaster', choices=('thread', 'process'), default='process')
+    parser.add_argument('--mode', choices=('simple', 'batch', 'proxy'), default='batch')
+    parser.add_argument('--hwm', type=int, default=1000, help='Subscriber RCVHWM.')
+    options = parser.parse_args()
+    frontend, backend = endpoints(options.transport)
+    kwargs = {
+        'mode': options.mode, 'stats_interval': 0,
+        'frontend_uri': frontend.replace('127.0.0.1', '*'),
+        'backend_uri': backend.replace('127.0.0.1', '*'),
+    }
+    if options.broadcaster == 'thread':
+        relay = threading.Thread(target=broadcaster.main, kwargs=kwargs)
+    else:
+        relay = multiprocessing.Process(target=broadcaster.main, kwargs=kwargs)
+    relay.start()
+    time.sleep(0.5)
+    results = multiprocessing.Queue()
+    done = multiprocessing.Event()
+    subscribers = []
+    for index in xrange(options.subscribers):
+        ready = multiprocessing.Event()
+        process = multiprocessing.Process(
+            target=subscribe, args=(index, backend, options, ready, done, results),
+        )
+        process.start()
+        ready.wait()
+        subscribers.append(process)
+    producers = [
+        multiprocessing.Process(target=produce, args=(index, frontend, options, results))
+        for index in xrange(options.producers)
+    ]
+    for process in producers:
+        process.start()
+    reports = {'producer': {}, 'subscriber': {}}
+    while len(reports['producer']) < len(producers):
+        kind, index, report = results.get()
+        reports[kind][index] = report
+    relayMemory = memory(options.broadcaster == 'process' and relay.pid or 'self')
+    done.set()
+    while len(reports['subscriber']) < len(subscribers):
+        kind, index, report = results.get()
+        reports[kind][index] = report
+    for process in producers + subscribers:
+        process.join()
+    broadcaster.shutdown()
+    relay.join()
+
+    emitted = sum(report['emitted'] for report in reports['producer'].values())
+    print "%d producers emitted %d records in %.1fs (%s, %s, %s handler%s)" % (
+        len(producers), emitted, options.duration, options.transport,
+        options.serializer, options.handler,
+        options.codec and ', %s batches' % options.codec or '',
+    )
+    print
+    print "%-12s %10s %10s %10s %10s" % ('stage', 'records', 'dropped', 'rss MB', 'peak MB')
+    for index, report in sorted(reports['producer'].items()):
+        print "%-12s %10d %10d %10.1f %10.1f" % (
+            'producer-%d' % index, report['emitted'], report['dropped'],
+            report['memory'][0], report['memory'][1],
+        )
+    print "%-12s %10s %10s %10.1f %10.1f" % (
+        'broadcaster', '', '', relayMemory[0], relayMemory[1],
+    )
+    for index, report in sorted(reports['subscriber'].items()):
+        print "%-12s %10d %10d %10.1f %10.1f" % (
+            'subscriber-%d' % index, report['received'], emitted - report['received'],
+            report['memory'][0], report['memory'][1],
+        )
+    print
+    print "%-12s %10s %10s %10s %10s %10s" % (
+        'subscriber', 'rec/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms',
+    )
+    for index, report in sorted(reports['subscriber'].items()):
+        print "%-12s %10.0f %10.2f %10.2f %10.2f %10.2f" % (
+            'subscriber-%d' % index,
+            report['elapsed'] and report['received'] / report['elapsed'] or 0,
+            report['p50'] * 1000, report['p90'] * 1000, report['p99'] * 1000,
+            report['max'] * 1000,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+Load test the service registry of a running overseer.
+
+Attaches --clients websockets to /jLog, then registers --count services
+through /services/register, --concurrency at a time, while timing a request
+to /whatsmyip every --probe seconds. The probe never touches DynamoDB, so its
+latency shows whether the registrations are holding up the IOLoop: it should
+stay as flat under load as it is beforehand, and every /jLog client should
+still be attached at the end.
+
+The services registered are named bench and left in the table, so point it at
+an overseer using dynamodb-local (AWS_DYNAMODB_ENDPOINT):
+
+    python benchmarks/bench_registry.py --url http://127.0.0.1:3000 --clients 50 --count 2000
+"""
+
+import argparse
+import json
+import os
+import time
+import urllib
+
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+from tornado.ioloop import IOLoop
+from tornado.websocket import websocket_connect
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class JLogClient(object):
+    """
+    A raw SockJS websocket to /jLog counting the frames it is sent.
+    """
+    def __init__(self, url):
+        self.url = url.replace('http', 'ws', 1) + '/jLog/websocket'
+        self.connection = None
+        self.frames = 0
+        self.closed = False
+
+    @gen.coroutine
+    def connect(self):
+        self.connection = yield websocket_connect(self.url, on_message_callback=self.on_message)
+
+    def on_message(self, message):
+        if message is None:
+            self.closed = True
+        else:
+            self.frames += 1
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+class Probe(object):
+    """
+    Time a cheap request every interval seconds.
+    """
+    def __init__(self, url, interval):
+        self.url = url + '/whatsmyip'
+        self.interval = interval
+        self.latencies = []
+        self.running = False
+
+    @gen.coroutine
+    def run(self):
+        client = AsyncHTTPClient()
+        self.running = True
+        while self.running:
+            started = time.time()
+            yield client.fetch(self.url, raise_error=False)
+            self.latencies.append(time.time() - started)
+            yield gen.sleep(self.interval)
+
+    def take(self):
+        latencies, self.latencies = sorted(self.latencies), []
+        return latencies
+
+
+@gen.coroutine
+def register(url, index, latencies, codes):
+    query = urllib.urlencode({
+        'ContainerId': 'bench-%d-%d' % (os.getpid(), index),
+        'ContainerName': 'bench-%d' % index,
+        'Hostname': 'bench-%d' % index,
+        'IP': '127.0.0.1',
+        'Port': 3306,
+        'ServiceName': 'bench',
+        'TaskId': 'bench-%d-%d' % (os.getpid(), index),
+    })
+    started = time.time()
+    response = yield AsyncHTTPClient().fetch(
+        url + '/services/register?' + query, raise_error=False, request_timeout=60,
+    )
+    latencies.append(time.time() - started)
+    codes[response.code] = codes.get(response.code, 0) + 1
+
+
+@gen.coroutine
+def worker(url, indexes, latencies, codes):
+    for index in indexes:
+        yield register(url, index, latencies, codes)
+
+
+def report(label, latencies):
+    print "%-14s %8d %10.1f %10.1f %10.1f %10.1f" % (
+        label, len(latencies),
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.9) * 1000,
+        percentile(latencies, 0.99) * 1000, latencies and latencies[-1] * 1000 or 0,
+    )
+
+
+@gen.coroutine
+def run(options):
+    AsyncHTTPClient.configure(None, max_clients=options.concurrency + 1)
+    clients = [JLogClient(options.url) for _ in xrange(options.clients)]
+    yield [client.connect() for client in clients]
+    probe = Probe(options.url, options.probe)
+    probe.run()
+    yield gen.sleep(options.settle)
+    baseline = probe.take()
+
+    latencies, codes = [], {}
+    indexes = iter(xrange(options.count))
+    started = time.time()
+    yield [
+        worker(options.url, indexes, latencies, codes)
+        for _ in xrange(options.concurrency)
+    ]
+    elapsed = time.time() - started
+    loaded = probe.take()
+    probe.running = False
+    stats = yield AsyncHTTPClient().fetch(options.url + '/services/stats', raise_error=False)
+    for client in clients:
+        client.close()
+
+    print "%d registrations in %.1fs, %.0f/s, %d at a time, responses %s" % (
+        len(latencies), elapsed, len(latencies) / elapsed, options.concurrency,
+        ', '.join('%s: %d' % each for each in sorted(codes.items())),
+    )
+    if stats.code == 200:
+        print "registry pool: %s" % json.loads(stats.body)['stats']
+    print "jLog clients attached %d/%d, %d frames received" % (
+        sum(1 for client in clients if not client.closed), len(clients),
+        sum(client.frames for client in clients),
+    )
+    print
+    print "%-14s %8s %10s %10s %10s %10s" % ('', 'requests', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms')
+    report('probe idle', baseline)
+    report('probe loaded', loaded)
+    report('register', sorted(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:3000', help='The overseer.')
+    parser.add_argument('--clients', type=int, default=20, help='/jLog websockets to attach.')
+    parser.add_argument('--count', type=int, default=1000, help='Services to register.')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--probe', type=float, default=0.05, help='Seconds between probes.')
+    parser.add_argument('--settle', type=float, default=2,
+        help='Seconds to probe before the registrations start.')
+    options = parser.parse_args()
+    options.url = options.url.rstrip('/')
+    IOLoop.current().run_sync(lambda: run(options))
+
+
+if __name__ == '__main__':
+    main()
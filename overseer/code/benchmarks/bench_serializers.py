@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark the logwire serializers.
+
+Reports the encode and decode cost and the bytes per record for a mix of
+short access log lines, messages with args and records with a traceback.
+
+    python benchmarks/bench_serializers.py --count 20000
+"""
+
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import logwire
+
+
+def sampleRecords():
+    """
+    Return a representative set of LogRecords.
+    """
+    records = [
+        logging.LogRecord(
+            'tornado.access', logging.INFO, __file__, 10,
+            '%d %s %.2fms', (200, 'GET /services/get?ServiceName=jetdb-1 (172.17.0.5)', 3.21),
+            None,
+        ),
+        logging.LogRecord(
+            'tornado.general', logging.WARNING, __file__, 20,
+            'Connection to %s lost, retrying in %d seconds', ('tcp://10.0.0.1:13001', 5),
+            None,
+        ),
+    ]
+    try:
+        raise ValueError('Service not registered.')
+    except ValueError:
+        records.append(logging.LogRecord(
+            'tornado.application', logging.ERROR, __file__, 30,
+            'Uncaught exception', None, sys.exc_info(),
+        ))
+    for record in records:
+        record.source = 'Node-10.0.0.1'
+    # Pickle cannot send the traceback, the handler formats it first.
+    records[-1].exc_text = logging.Formatter().formatException(records[-1].exc_info)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=20000,
+        help='Records encoded and decoded per serializer.')
+    options = parser.parse_args()
+    records = sampleRecords()
+    print "%-8s %12s %12s %12s" % ('format', 'encode us', 'decode us', 'bytes/rec')
+    for name, serializer in sorted(logwire.SERIALIZERS.items()):
+        pickleable = []
+        for record in records:
+            if name == logwire.PickleSerializer.header:
+                record = logging.makeLogRecord(dict(record.__dict__, exc_info=None))
+            pickleable.append(record)
+        payloads = [serializer.dumps(record) for record in pickleable]
+        rounds = max(1, options.count / len(pickleable))
+        encode = timeit.timeit(
+            lambda: [serializer.dumps(record) for record in pickleable], number=rounds,
+        )
+        decode = timeit.timeit(
+            lambda: [serializer.loads(payload) for payload in payloads], number=rounds,
+        )
+        total = rounds * len(pickleable)
+        print "%-8s %12.2f %12.2f %12.1f" % (
+            name, encode / total * 1e6, decode / total * 1e6,
+            float(sum(map(len, payloads))) / len(payloads),
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Benchmark the sharded broadcaster.
+
+For each worker count we start the supervisor, spread the messages of several
+producer processes across the shards and count them arriving at a subscriber
+on 13002. The throughput should scale with the number of workers up to the
+number of cores on the host.
+
+    python benchmarks/bench_sharding.py --max-workers 4 --producers 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import broadcaster
+
+
+def produce(uris, count, size):
+    """
+    Push count LOGRECORD messages across the shard endpoints.
+    """
+    context = zmq.Context()
+    socket = context.socket(zmq.PUSH)
+    socket.setsockopt(zmq.IMMEDIATE, 1)
+    for uri in uris:
+        socket.connect(uri)
+    # Wait for every shard to be connected before we start.
+    time.sleep(1)
+    payload = 'x' * size
+    for _ in xrange(count):
+        socket.send_multipart(['LOGRECORD', 'bench.sharding', payload])
+    socket.close(linger=-1)
+    context.term()
+
+
+def run(workers, producers, count, size):
+    """
+    Return the messages per second relayed by the given number of workers.
+    """
+    supervisor = multiprocessing.Process(
+        target=broadcaster.supervise, args=(workers,), kwargs={'stats_interval': 0},
+    )
+    supervisor.start()
+    context = zmq.Context()
+    subscriber = context.socket(zmq.SUB)
+    subscriber.setsockopt(zmq.RCVHWM, 0)
+    subscriber.connect('tcp://127.0.0.1:13002')
+    subscriber.setsockopt(zmq.SUBSCRIBE, '')
+    time.sleep(1)
+    uris = broadcaster.shardUris(workers, '127.0.0.1')
+    clients = [
+        multiprocessing.Process(target=produce, args=(uris, count, size))
+        for _ in xrange(producers)
+    ]
+    for client in clients:
+        client.start()
+    expected = producers * count
+    received, started = 0, None
+    while received < expected and subscriber.poll(5000):
+        subscriber.recv_multipart(copy=False)
+        if started is None:
+            started = time.time()
+        received += 1
+    elapsed = time.time() - (started or time.time())
+    for client in clients:
+        client.join()
+    broadcaster.shutdown()
+    supervisor.join()
+    subscriber.close(linger=0)
+    context.term()
+    return received, expected, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--max-workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--producers', type=int, default=4)
+    parser.add_argument('--count', type=int, default=50000,
+        help='Messages sent by each producer.')
+    parser.add_argument('--size', type=int, default=200, help='Payload bytes.')
+    options = parser.parse_args()
+    print "%8s %10s %10s %12s" % ('workers', 'received', 'seconds', 'msgs/sec')
+    for workers in xrange(1, options.max_workers + 1):
+        received, expected, elapsed = run(
+            workers, options.producers, options.count, options.size,
+        )
+        rate = elapsed and received / elapsed or 0
+        print "%8d %10d %10.2f %12.0f%s" % (
+            workers, received, elapsed, rate,
+            received < expected and ' (dropped %d)' % (expected - received) or '',
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Compare the latency of the tcp, ipc and inproc transports to the broadcaster.
+
+Runs the broadcaster in a thread of this process with the shared
+zmq.Context.instance(), so it binds all three transports, and for each one
+sends messages through it one at a time, timing each round trip from the PUSH
+to the SUB socket, then a burst to measure the throughput.
+
+    python benchmarks/bench_transports.py --count 5000
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import zmq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import broadcaster
+import endpoints
+
+
+def run(context, transport, count, size):
+    """
+    Return the sorted latencies and the burst rate for the transport.
+    """
+    push = context.socket(zmq.PUSH)
+    push.connect(endpoints.connectUri('pull', choice=transport))
+    sub = context.socket(zmq.SUB)
+    sub.setsockopt(zmq.RCVHWM, 0)
+    sub.connect(endpoints.connectUri('pub', choice=transport))
+    sub.setsockopt(zmq.SUBSCRIBE, '')
+    payload = 'x' * size
+    # Wait for the subscription to reach the broadcaster
+    while True:
+        push.send_multipart(['MESSAGE', 'bench', payload])
+        if sub.poll(100):
+            sub.recv_multipart()
+            break
+    while sub.poll(100):
+        sub.recv_multipart()
+    latencies = []
+    for _ in xrange(count):
+        started = time.time()
+        push.send_multipart(['MESSAGE', 'bench', payload])
+        sub.recv_multipart()
+        latencies.append(time.time() - started)
+    started = time.time()
+    for _ in xrange(count):
+        push.send_multipart(['MESSAGE', 'bench', payload])
+    for _ in xrange(count):
+        sub.recv_multipart()
+    rate = count / (time.time() - started)
+    push.close(linger=0)
+    sub.close(linger=0)
+    latencies.sort()
+    return latencies, rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=5000, help='Messages per transport.')
+    parser.add_argument('--size', type=int, default=200, help='Payload bytes.')
+    parser.add_argument('--mode', choices=('simple', 'batch'), default='batch')
+    options = parser.parse_args()
+    context = zmq.Context.instance()
+    relay = threading.Thread(target=broadcaster.main, kwargs={
+        'mode': options.mode, 'stats_interval': 0, 'context': context,
+    })
+    relay.start()
+    while not endpoints.local:
+        time.sleep(0.1)
+    transports = ['tcp', 'inproc']
+    if endpoints.hasIpc():
+        transports.insert(1, 'ipc')
+    print "%-8s %10s %10s %10s %10s %12s" % (
+        'transport', 'p50 us', 'p90 us', 'p99 us', 'max us', 'burst msg/s',
+    )
+    try:
+        for transport in transports:
+            latencies, rate = run(context, transport, options.count, options.size)
+            print "%-8s %10.1f %10.1f %10.1f %10.1f %12.0f" % (
+                transport,
+                latencies[len(latencies) / 2] * 1e6,
+                latencies[int(len(latencies) * 0.9)] * 1e6,
+                latencies[int(len(latencies) * 0.99)] * 1e6,
+                latencies[-1] * 1e6, rate,
+            )
+    finally:
+        broadcaster.shutdown()
+        relay.join()
+
+
+if __name__ == '__main__':
+    main()
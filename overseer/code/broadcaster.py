@@ -5,71 +5,881 @@ This is a broadcaster.
 We take clients sending us messages as PUSH messages and we publish those messages
 to any SUBSCRIBERS that are interested.
 
-This is the basis of the jLogger service. Each worker and service connects to a 
+This is the basis of the jLogger service. Each worker and service connects to a
 local broadcaster and sends its log messages. These messages are then passed on
 to any clients listening. We may have a default client that listens to specific
 messages and logs them to a file.
+
+There are three relay modes:
+
+    - simple
+      The original relay, one message per poll and every message is printed.
+
+    - batch
+      The high-throughput relay. Every message waiting on the frontend is
+      drained on each wakeup and the frames are forwarded without being copied
+      into python strings. Printing each message is turned on with --debug and
+      the message and byte rates are reported every --stats-interval seconds.
+
+    - proxy
+      Well formed (type:topic, topic, msg) messages are relayed by libzmq
+      using zmq.proxy_steerable so python never sees them. Clients still
+      sending the old 1 and 2 frame messages must send them to the raw port
+      (13003) where they are normalised by a python thread and fed back into
+      the proxy. Anything else sent to the frontend is published as it is,
+      the subscribers drop what they cannot decode. Everything relayed can be
+      tapped from the optional --capture socket.
+
+The broadcaster can also run sharded with --workers N. The supervisor starts N
+relay processes each owning a PULL socket on its own port (13010, 13011, ...,
+shard 0 also takes 13001) and they all publish into one XPUB socket on 13002.
+Shard 0 also answers on the interest socket (13006) with the subscriptions the
+supervisor passes to every shard.
+
+The frontend (13001), backend (13002) and interest (13006) sockets also bind
+ipc:// sockets for the producers and subscribers on this host, and inproc://
+endpoints when the broadcaster runs in the overseer process, see endpoints.
+Producers spread their messages by connecting to every shard port, see
+shardUris() and loghandler.PUSHHandler.
+
+The published topic is the type and topic of the message, eg.
+LOGRECORD:tornado.access, see logwire.makeTopic. Producers send it as the
+first frame, see logwire.encodeRecord, so the proxy mode publishes the same
+topics as the other modes, which also set it on messages sent with a bare
+type. The backend is an XPUB socket so the broadcaster knows what is
+subscribed to, and it answers SUBSCRIPTIONS requests on the interest socket
+(13006) so producers can skip records nobody is listening for, see
+loghandler.Interest.
+
+A node's broadcaster can forward everything it relays to an aggregating
+broadcaster upstream with --upstream, eg. tcp://overseer:13001. The messages
+are sent in compressed batches (see Forwarder and logwire.encodeBatch) and
+the aggregator, a broadcaster like any other in simple or batch mode, publishes
+them with the node they came from as a topic prefix, eg.
+
+    Node-10.0.0.1/LOGRECORD:tornado.access
+
+so the whole cluster can be tailed from the aggregator's jLog. Forwarding is
+not available in proxy mode where python never sees the messages.
+
+The overseer can run the relay on its own IOLoop with --relay, see StreamRelay,
+so its jLog handlers take the records over inproc. Run this script on nodes
+without the web UI.
+
+In all modes the broadcaster listens on a control socket (127.0.0.1:13005) for
+the TERMINATE command, and PAUSE and RESUME which stop and restart relaying
+while the messages wait in the frontend, see shutdown(). The in-band SHUTDOWN
+message is only honoured by the simple and batch relays.
 """
 
+import argparse
+import multiprocessing
+import threading
+import time
+import zlib
+
 import zmq
+from zmq.eventloop.ioloop import PeriodicCallback
+from zmq.eventloop.zmqstream import ZMQStream
+
+import endpoints
+import logwire
+
+
+# The message types we publish with a (type, topic, msg) format.
+MESSAGE_TYPES = ('LOGRECORD', 'MESSAGE', 'METRIC')
+
+# The control socket taking the PAUSE, RESUME and TERMINATE commands.
+CONTROL_URI = 'tcp://127.0.0.1:13005'
+
+# The side channel for messages the proxy cannot relay as they are.
+RAW_URI = 'tcp://*:13003'
+
+# Where normalised side channel messages rejoin the proxy frontend.
+NORMALISED_URI = 'inproc://broadcaster-normalised'
+
+# The shards listen on consecutive ports from here.
+SHARD_BASE_PORT = 13010
+
+# The shards publish into the supervisor on this endpoint.
+FANIN_URI = 'tcp://127.0.0.1:13008'
+
+# The supervisor tells the shards to terminate on this endpoint.
+SHARD_CONTROL_URI = 'tcp://127.0.0.1:13009'
+
+
+class RelayStats(object):
+    """
+    Count the messages and bytes relayed and report the rates periodically,
+    and the malformed messages dropped.
+    """
+    def __init__(self, interval=10):
+        self.interval = interval
+        self.messages = self.bytes = 0
+        self.dropped = 0
+        self.total_messages = self.total_bytes = 0
+        self.started = self.last = time.time()
+
+    def add(self, frames):
+        """
+        Count a relayed message.
+        """
+        self.messages += 1
+        self.bytes += sum(len(frame) for frame in frames)
+
+    def drop(self, frames):
+        """
+        Count a malformed message we could not relay.
+        """
+        self.dropped += 1
+        print "Dropping a malformed message:", [frameBytes(frame)[:80] for frame in frames]
+
+    def report(self, now=None):
+        """
+        Print the rates since the last report if the interval has passed.
+        """
+        now = now or time.time()
+        elapsed = now - self.last
+        if not self.interval or elapsed < self.interval:
+            return
+        if self.messages:
+            print "Relayed %d msgs (%.1f msg/s, %.1f KB/s)" % (
+                self.messages, self.messages / elapsed, self.bytes / elapsed / 1024,
+            )
+        if self.dropped:
+            print "Dropped %d malformed msgs so far" % self.dropped
+        self.total_messages += self.messages
+        self.total_bytes += self.bytes
+        self.messages = self.bytes = 0
+        self.last = now
+
+
+class Subscriptions(object):
+    """
+    Track the topics subscribed to on an XPUB socket.
+
+    The XPUB passes on the first subscription to a topic and the last
+    unsubscription from it, so a set is all we need.
+
+    A broadcaster forwarding upstream wants everything, whoever is subscribed
+    locally, so it answers with the '' topic.
+    """
+    def __init__(self, forwarding=False):
+        self.topics = set()
+        self.forwarding = forwarding
+
+    def __contains__(self, topic):
+        return topic in self.topics
+
+    def update(self, backend):
+        """
+        Read the subscription messages waiting on the backend.
+        """
+        while True:
+            try:
+                event = backend.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            self.handle(event)
+
+    def handle(self, event):
+        """
+        Apply a subscribe or unsubscribe event from the backend.
+        """
+        if event[:1] == '\x01':
+            self.topics.add(event[1:])
+        elif event[:1] == '\x00':
+            self.topics.discard(event[1:])
+
+    def answer(self, interest):
+        """
+        Reply to the SUBSCRIPTIONS requests waiting on the interest socket.
+        """
+        while True:
+            try:
+                request = interest.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            self.reply(interest, request)
+
+    def reply(self, interest, request):
+        """
+        Answer a (identity, SUBSCRIPTIONS) request with the topics.
+        """
+        if request[1:2] == ['SUBSCRIPTIONS']:
+            topics = self.forwarding and [''] or sorted(self.topics)
+            interest.send_multipart(request[:2] + topics)
+
+
+class Forwarder(object):
+    """
+    Forward the relayed messages upstream in compressed batches.
+
+    A batch is sent when it has batch_size messages or interval seconds after
+    its first message. The PUSH socket only queues hwm batches for an upstream
+    that is slow or away, beyond that the batches are dropped and counted.
+    """
+    def __init__(self, context, uri, node, batch_size=500, interval=0.2,
+            codec='zlib', hwm=100):
+        self.uri = uri
+        self.node = node
+        self.batch_size = batch_size
+        self.interval = interval
+        self.codec = logwire.newCodec(codec)
+        self.pending = []
+        self.started = None
+        self.sent = self.dropped = 0
+        self.socket = context.socket(zmq.PUSH)
+        self.socket.setsockopt(zmq.IMMEDIATE, 1)
+        self.socket.setsockopt(zmq.SNDHWM, hwm)
+        self.socket.connect(uri)
+
+    def add(self, frames):
+        """
+        Queue a message for the next batch.
+        """
+        if not self.pending:
+            self.started = time.time()
+        self.pending.append([frameBytes(frame) for frame in frames])
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def timeout(self, default):
+        """
+        Return the milliseconds to poll for before the batch is due.
+        """
+        if not self.pending:
+            return default
+        due = self.started + self.interval - time.time()
+        return max(0, min(default, int(due * 1000)))
+
+    def poll(self, now=None):
+        """
+        Send the batch if it is due.
+        """
+        if self.pending and (now or time.time()) - self.started >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Send the pending messages as one batch.
+        """
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        try:
+            self.socket.send_multipart(
+                logwire.encodeBatch(self.node, pending, self.codec), zmq.NOBLOCK,
+            )
+            self.sent += len(pending)
+        except zmq.Again:
+            if not self.dropped:
+                print "Upstream %s is not taking messages, dropping." % self.uri
+            self.dropped += len(pending)
+
+    def close(self):
+        self.flush()
+        self.socket.close(linger=1000)
+
+
+def frameBytes(frame):
+    """
+    Return the bytes of a string or zmq.Frame.
+    """
+    if isinstance(frame, zmq.Frame):
+        return frame.bytes
+    return frame
+
+
+def normalise(frames, kind):
+    """
+    Return the frames as a properly formed (type:topic, topic, msg) message,
+    or None if the message cannot be relayed.
+
+    The frames may be strings or zmq.Frame objects, the kind is the first frame
+    as a string so the payload frames never need to be copied.
+    """
+    kind = logwire.splitTopic(kind)[0]
+    # A properly formed message gives type, topic, msg
+    if kind in MESSAGE_TYPES:
+        # A type alone has nothing to relay
+        if len(frames) < 2:
+            return None
+        if len(frames) == 2:
+            frames.insert(1, 'all')
+    # A simple text message, then add the 'all' topic
+    elif len(frames) == 1:
+        kind, frames = 'MESSAGE', ['MESSAGE', 'all', frames[0]]
+    # If the length is 2 we expect a topic, message
+    elif len(frames) == 2:
+        kind = 'MESSAGE'
+        frames.insert(0, kind)
+    else:
+        return None
+    frames[0] = logwire.makeTopic(kind, frameBytes(frames[1]))
+    return frames
+
+
+def relayForwarded(frames, backend, stats, forwarder=None):
+    """
+    Publish the messages in a batch forwarded from a node, prefixing their
+    topics with the node. Messages already prefixed by an earlier aggregator
+    keep the node they came from, and batches from producers have no node.
+    """
+    try:
+        node, messages = logwire.decodeBatch([frameBytes(frame) for frame in frames])
+    except (ValueError, zlib.error), exc:
+        print "Dropping a batch we cannot decode: %s" % exc
+        return
+    for message in messages:
+        prefix = logwire.splitNode(message[0]) or node
+        normalised = normalise(message, message[0])
+        if normalised is None:
+            stats.drop(message)
+            continue
+        message = normalised
+        if prefix:
+            message[0] = logwire.addNode(prefix, message[0])
+        backend.send_multipart(message)
+        stats.add(message)
+        if forwarder:
+            forwarder.add(message)
+
 
+def relayBatch(frontend, backend, stats, debug=False, batch_size=1000,
+        allow_shutdown=True, forwarder=None):
+    """
+    Drain up to batch_size messages waiting on the frontend and publish them,
+    and forward them upstream if we have a forwarder.
 
-def main(timeout=500, port=13001):
+    Frames are received and sent with copy=False so the payload stays in the
+    zmq.Frame buffers. Returns False when we have been told to shutdown.
+    """
+    for _ in xrange(batch_size):
+        try:
+            frames = frontend.recv_multipart(zmq.NOBLOCK, copy=False)
+        except zmq.Again:
+            break
+        kind = frames[0].bytes
+        if debug:
+            print "GOT:", [frame.bytes for frame in frames]
+        if kind == 'SHUTDOWN' and allow_shutdown:
+            print "We have been told to shutdown."
+            return False
+        relayMessage(frames, kind, backend, stats, forwarder)
+    return True
+
+
+def relayMessage(frames, kind, backend, stats, forwarder=None):
+    """
+    Publish a message received as zmq.Frames, and forward it upstream if we
+    have a forwarder. The kind is the first frame as a string.
+    """
+    if kind == 'BATCH':
+        relayForwarded(frames, backend, stats, forwarder)
+        return
+    message = normalise(frames, kind)
+    if message is None:
+        stats.drop(frames)
+        return
+    if forwarder:
+        forwarder.add(message)
+    backend.send_multipart(message, copy=False)
+    stats.add(frames)
+
+
+def relaySimple(frontend, backend, forwarder=None):
+    """
+    Relay a single message, returns False when we have been told to shutdown.
+    """
+    frames = [frontend.recv(),]
+    while frontend.getsockopt(zmq.RCVMORE):
+        frames.append(frontend.recv())
+    print "GOT:", frames
+    if frames[0] == 'SHUTDOWN':
+        print "We have been told to shutdown."
+        return False
+    if frames[0] == 'BATCH':
+        relayForwarded(frames, backend, RelayStats(0), forwarder)
+        return True
+    message = normalise(frames, frames[0])
+    if message is None:
+        print "wierd", frames
+    else:
+        backend.send_multipart(message)
+        if forwarder:
+            forwarder.add(message)
+    return True
+
+
+def normaliser(context, stop, raw_uri=RAW_URI, timeout=500, debug=False):
+    """
+    Normalise the messages sent to the raw side channel and push them back
+    into the proxy frontend. Runs in its own thread until stop is set.
+    """
+    raw = context.socket(zmq.PULL)
+    raw.bind(raw_uri)
+    normalised = context.socket(zmq.PUSH)
+    normalised.connect(NORMALISED_URI)
+    stats = RelayStats(0)
+    try:
+        while not stop.is_set():
+            if raw.poll(timeout):
+                relayBatch(raw, normalised, stats, debug, allow_shutdown=False)
+    finally:
+        raw.close(linger=0)
+        normalised.close(linger=0)
+
+
+def runProxy(context, frontend, backend, control, capture_uri=None,
+        raw_uri=RAW_URI, debug=False):
+    """
+    Relay the frontend to the backend with zmq.proxy_steerable until the
+    TERMINATE command arrives on the control socket.
+    """
+    capture = None
+    stop = threading.Event()
+    frontend.bind(NORMALISED_URI)
+    thread = threading.Thread(
+        target=normaliser, args=(context, stop, raw_uri), kwargs={'debug': debug},
+    )
+    thread.daemon = True
+    thread.start()
+    try:
+        if capture_uri:
+            capture = context.socket(zmq.PUB)
+            capture.bind(capture_uri)
+        zmq.proxy_steerable(frontend, backend, capture, control)
+        print "We have been told to terminate."
+    finally:
+        stop.set()
+        thread.join()
+        if capture:
+            capture.close()
+
+
+def relayLoop(frontend, backend, control, mode='batch', timeout=500, debug=False,
+        stats=None, batch_size=1000, allow_shutdown=True, interest=None,
+        forwarder=None):
+    """
+    Relay messages from the frontend to the backend until we are told to
+    shutdown or the TERMINATE command arrives on the control socket, pausing
+    between the PAUSE and RESUME commands.
+
+    When the backend is an XPUB socket the subscriptions are tracked and
+    requests for them on the interest socket are answered. With a forwarder
+    the messages are also forwarded upstream.
+    """
+    stats = stats or RelayStats()
+    subscriptions = Subscriptions(forwarding=forwarder is not None)
+    poller = zmq.Poller()
+    poller.register(frontend, zmq.POLLIN)
+    poller.register(control, zmq.POLLIN)
+    if backend.socket_type == zmq.XPUB:
+        poller.register(backend, zmq.POLLIN)
+    if interest is not None:
+        poller.register(interest, zmq.POLLIN)
+    running = True
+    paused = False
+    while running:
+        events = {}
+        try:
+            wait = forwarder and forwarder.timeout(timeout)
+            events = dict(poller.poll(timeout if forwarder is None else wait))
+        except zmq.ZMQError:
+            print "We have been interrupted."
+        #
+        if frontend in events:
+            if mode == 'batch':
+                running = relayBatch(
+                    frontend, backend, stats, debug, batch_size, allow_shutdown,
+                    forwarder,
+                )
+            else:
+                running = relaySimple(frontend, backend, forwarder)
+        if backend in events:
+            subscriptions.update(backend)
+        if interest in events:
+            subscriptions.answer(interest)
+        if control in events:
+            command = control.recv()
+            if command == 'TERMINATE':
+                print "We have been told to terminate."
+                running = False
+            # Paused, the messages wait in the frontend up to its HWM
+            elif command == 'PAUSE' and not paused:
+                print "We have been told to pause."
+                poller.unregister(frontend)
+                paused = True
+            elif command == 'RESUME' and paused:
+                print "We have been told to resume."
+                poller.register(frontend, zmq.POLLIN)
+                paused = False
+        if forwarder:
+            forwarder.poll()
+        if mode == 'batch':
+            stats.report()
+
+
+class StreamRelay(object):
+    """
+    The relay run on the IOLoop of the process it is in, eg. the overseer with
+    --relay, rather than a process of its own.
+
+    The frontend, backend and interest sockets are ZMQStreams in the shared
+    zmq.Context.instance() and bind the inproc endpoints too, so the jLog
+    handlers and the logging handlers of the process reach the relay without
+    a trip through the TCP stack. It relays like the batch mode.
+    """
+    def __init__(self, io_loop=None, stats_interval=10, upstream=None, node=None,
+            codec='zlib', frontend_uri=None, backend_uri=None, interest_uri=None):
+        self.io_loop = io_loop
+        self.stats = RelayStats(stats_interval)
+        self.upstream = upstream
+        self.node = node
+        self.codec = codec
+        self.frontend_uri = frontend_uri
+        self.backend_uri = backend_uri
+        self.interest_uri = interest_uri
+        self.subscriptions = Subscriptions()
+        self.streams = []
+        self.timers = []
+        self.bound = []
+        self.forwarder = None
+
+    def stream(self, kind, uris, name, callback):
+        """
+        Return a ZMQStream for a new socket bound to the endpoints.
+        """
+        socket = zmq.Context.instance().socket(kind)
+        self.bound += bindAll(socket, uris or endpoints.bindUris(name, inproc=True))
+        stream = ZMQStream(socket, self.io_loop)
+        stream.on_recv(callback, copy=False)
+        self.streams.append(stream)
+        return stream
+
+    def start(self):
+        """
+        Bind the sockets and start relaying.
+        """
+        self.backend = self.stream(
+            zmq.XPUB, self.backend_uri, 'pub',
+            lambda frames: self.subscriptions.handle(frames[0].bytes),
+        )
+        self.frontend = self.stream(zmq.PULL, self.frontend_uri, 'pull', self.on_recv)
+        self.interest = self.stream(
+            zmq.ROUTER, self.interest_uri, 'interest',
+            lambda frames: self.subscriptions.reply(
+                self.interest.socket, [frame.bytes for frame in frames],
+            ),
+        )
+        if self.upstream:
+            print "Forwarding to %s" % self.upstream
+            self.forwarder = Forwarder(
+                zmq.Context.instance(), self.upstream, self.node or defaultNode(),
+                codec=self.codec,
+            )
+            self.subscriptions.forwarding = True
+            self.timers.append(PeriodicCallback(
+                self.forwarder.poll, self.forwarder.interval * 1000,
+            ))
+        if self.stats.interval:
+            self.timers.append(PeriodicCallback(self.stats.report, 1000))
+        for timer in self.timers:
+            timer.start()
+        endpoints.register(self.bound)
+        print "Relaying messages on %s" % ', '.join(self.bound)
+
+    def on_recv(self, frames):
+        # An exception escaping a ZMQStream callback stops the stream, and
+        # with it the relay, so drop the message instead
+        try:
+            relayMessage(frames, frames[0].bytes, self.backend.socket, self.stats, self.forwarder)
+        except Exception, exc:
+            print "Failed to relay a message: %s" % exc
+            self.stats.drop(frames)
+
+    def stop(self):
+        """
+        Stop relaying and close the sockets.
+        """
+        endpoints.unregister(self.bound)
+        for timer in self.timers:
+            timer.stop()
+        if self.forwarder:
+            self.forwarder.close()
+        for stream in self.streams:
+            stream.close(linger=0)
+        self.streams = self.timers = []
+
+
+def shardUris(workers, host='*', base_port=SHARD_BASE_PORT):
+    """
+    Return the PULL endpoint of each shard. Producers connect to all of them,
+    eg. ','.join(shardUris(4, myip)) as the PUSHHandler uri.
+    """
+    return ['tcp://%s:%d' % (host, base_port + index) for index in xrange(workers)]
+
+
+def runShard(index, uri, mode='batch', timeout=500, debug=False, stats_interval=10,
+        batch_size=1000, upstream=None, node=None, codec='zlib'):
+    """
+    Run a single relay worker publishing into the supervisor, each forwarding
+    its own share of the messages upstream.
+
+    The shards publish on XPUB sockets so the supervisor's XSUB passes each of
+    them what is subscribed to, and shard 0 answers the SUBSCRIPTIONS requests
+    on the interest endpoints for them all.
+    """
+    frontend = backend = control = interest = forwarder = None
+    context = zmq.Context()
+    try:
+        frontend = context.socket(zmq.PULL)
+        frontend.bind(uri)
+        # Shard 0 takes over the original port for producers not sharding.
+        if index == 0:
+            bindAll(frontend, endpoints.bindUris('pull'))
+            interest = context.socket(zmq.ROUTER)
+            bindAll(interest, endpoints.bindUris('interest'))
+        backend = context.socket(zmq.XPUB)
+        backend.connect(FANIN_URI)
+        control = context.socket(zmq.SUB)
+        control.connect(SHARD_CONTROL_URI)
+        control.setsockopt(zmq.SUBSCRIBE, '')
+        if upstream:
+            forwarder = Forwarder(context, upstream, node or defaultNode(), codec=codec)
+        print "Shard %d waiting for messages on %s" % (index, uri)
+        relayLoop(
+            frontend, backend, control, mode, timeout, debug,
+            RelayStats(stats_interval), batch_size, allow_shutdown=False,
+            interest=interest, forwarder=forwarder,
+        )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if forwarder:
+            forwarder.close()
+        for sock in (frontend, backend, control, interest):
+            if sock:
+                sock.close()
+        context.term()
+
+
+def supervise(workers, mode='batch', timeout=500, debug=False, stats_interval=10,
+        batch_size=1000, control_uri=CONTROL_URI, base_port=SHARD_BASE_PORT,
+        upstream=None, node=None, codec='zlib'):
+    """
+    Run the relay shards and fan their messages into one XPUB socket until
+    the TERMINATE command arrives on the control socket.
+    """
+    print "Starting broadcaster with %d shards." % workers
+    processes = []
+    # Start the shards before we have a context of our own to fork.
+    for index, uri in enumerate(shardUris(workers, base_port=base_port)):
+        process = multiprocessing.Process(
+            target=runShard,
+            args=(index, uri, mode, timeout, debug, stats_interval, batch_size,
+                upstream, node, codec),
+            name='broadcaster-shard-%d' % index,
+        )
+        process.daemon = True
+        process.start()
+        processes.append(process)
+    fanin = backend = control = shardControl = None
+    context = zmq.Context()
+    try:
+        fanin = context.socket(zmq.XSUB)
+        fanin.bind(FANIN_URI)
+        backend = context.socket(zmq.XPUB)
+        bindAll(backend, endpoints.bindUris('pub'))
+        control = context.socket(zmq.PULL)
+        control.bind(control_uri)
+        shardControl = context.socket(zmq.PUB)
+        shardControl.bind(SHARD_CONTROL_URI)
+        zmq.proxy_steerable(fanin, backend, None, control)
+        print "We have been told to terminate."
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print "Exiting."
+        if shardControl:
+            shardControl.send('TERMINATE')
+        for process in processes:
+            process.join(timeout / 100.0)
+            if process.is_alive():
+                process.terminate()
+        for sock in (fanin, backend, control, shardControl):
+            if sock:
+                sock.close(linger=0)
+        context.term()
+
+
+def defaultNode():
+    """
+    Return the name of this node, as used for the source of its log records.
+    """
+    import socket
+    return 'Node-%s' % socket.gethostbyname(socket.gethostname())
+
+
+def shutdown(uri=CONTROL_URI, command='TERMINATE'):
+    """
+    Send a command to the control socket of a running broadcaster.
+    """
+    context = zmq.Context.instance()
+    control = context.socket(zmq.PUSH)
+    control.connect(uri)
+    control.send(command)
+    control.close(linger=1000)
+
+
+def bindAll(socket, uris):
+    """
+    Bind the socket to each of a list or comma separated string of endpoints.
+    """
+    if isinstance(uris, basestring):
+        uris = [uri.strip() for uri in uris.split(',') if uri.strip()]
+    for uri in uris:
+        socket.bind(uri)
+    return list(uris)
+
+
+def main(timeout=500, port=13001, mode='simple', debug=False, stats_interval=10,
+        batch_size=1000, capture_uri=None, control_uri=CONTROL_URI, raw_uri=RAW_URI,
+        interest_uri=None, upstream=None, node=None, codec='zlib',
+        frontend_uri=None, backend_uri=None, context=None):
+    """
+    Run the broadcaster until it is told to terminate.
+
+    The frontend, backend and interest sockets bind the endpoints given, by
+    default their TCP port and ipc socket, see endpoints.bindUris. Given the
+    context of the process it runs in, eg. the overseer's
+    zmq.Context.instance(), the broadcaster also binds the inproc endpoints
+    and registers them so producers in the process connect to those.
+    """
     print "Starting broadcaster."
-    frontend = backend = context = None
+    frontend = backend = control = interest = forwarder = None
+    stats = RelayStats(stats_interval)
+    inproc = context is not None
+    bound = []
     try:
-        context = zmq.Context()
-        poller = zmq.Poller()
+        context = context or zmq.Context()
         # The frontend is a PULL/PUSH socket taking messages
         frontend = context.socket(zmq.PULL)
-        frontend.bind('tcp://*:13001')
-        poller.register(frontend, zmq.POLLIN)
-        # The backend is a PUBLISHER sending the messages to any client listening
-        backend = context.socket(zmq.PUB)
-        backend.bind('tcp://*:13002')
+        bound += bindAll(frontend, frontend_uri or endpoints.bindUris('pull', inproc, port))
+        # The backend is a PUBLISHER sending the messages to any client listening,
+        # libzmq cannot proxy into an XPUB from a PULL.
+        backend = context.socket(mode == 'proxy' and zmq.PUB or zmq.XPUB)
+        bound += bindAll(backend, backend_uri or endpoints.bindUris('pub', inproc))
+        # The control socket replaces sending SHUTDOWN through the frontend
+        control = context.socket(zmq.PULL)
+        control.bind(control_uri)
         #
-        print "Waiting for messages.."
-        while True:
-            try:
-                events = dict(poller.poll(timeout))
-            except zmq.ZMQError:
-                print "We have been interrupted."
-            #
-            if frontend in events:
-                frames = [frontend.recv(),]
-                while frontend.getsockopt(zmq.RCVMORE):
-                    frames.append(frontend.recv())
-                print "GOT:", frames
-                if frames[0] == 'SHUTDOWN':
-                    print "We have been told to shutdown."
-                    break
-                # A properly formed message gives type, topic, msg
-                elif frames[0] in ('LOGRECORD', 'MESSAGE'):
-                    if len(frames) == 2:
-                        frames.insert(1, 'all')
-                    backend.send_multipart(frames)
-                # A simple text message, then add the 'all' topic
-                elif len(frames) == 1:
-                    backend.send_multipart(['MESSAGE', 'all', frames[0]])
-                # If the length is 2 we expect a topic, message
-                elif len(frames) == 2:
-                    frames.insert(0, 'MESSAGE')
-                    backend.send_multipart(frames)
-                else:
-                    print "wierd", frames
+        if mode != 'proxy':
+            # Producers ask the interest socket what is subscribed to
+            interest = context.socket(zmq.ROUTER)
+            bound += bindAll(interest, interest_uri or endpoints.bindUris('interest', inproc))
+        print "Waiting for messages on %s (%s mode)" % (', '.join(bound), mode)
+        endpoints.register(bound)
+        if mode == 'proxy':
+            runProxy(context, frontend, backend, control, capture_uri, raw_uri, debug)
+            return
+        if upstream:
+            print "Forwarding to %s" % upstream
+            forwarder = Forwarder(context, upstream, node or defaultNode(), codec=codec)
+        relayLoop(
+            frontend, backend, control, mode, timeout, debug, stats, batch_size,
+            interest=interest, forwarder=forwarder,
+        )
     except KeyboardInterrupt:
         pass
     except Exception, exc:
         print exc
     finally:
         print "Exiting."
-        if frontend:
-            frontend.close()
-        if backend:
-            backend.close()
-        context.term()
+        endpoints.unregister(bound)
+        if forwarder:
+            forwarder.close()
+        for sock in (frontend, backend, control, interest):
+            if sock:
+                sock.close()
+        if not inproc:
+            context.term()
 
 
-if __name__ == '__main__':
-    main()
+def parseArgs(args=None):
+    """
+    Parse the command line options for running the broadcaster.
+    """
+    parser = argparse.ArgumentParser(description='Run the jLog broadcaster.')
+    parser.add_argument('--mode', choices=('simple', 'batch', 'proxy'),
+        default='batch', help='The relay mode to run.')
+    parser.add_argument('--debug', action='store_true', default=False,
+        help='Print every message relayed.')
+    parser.add_argument('--stats-interval', type=int, default=10,
+        help='Seconds between throughput reports, 0 turns them off.')
+    parser.add_argument('--batch-size', type=int, default=1000,
+        help='Maximum messages drained on each wakeup.')
+    parser.add_argument('--capture', default=None,
+        help='Publish everything relayed in proxy mode on this endpoint.')
+    parser.add_argument('--control', default=CONTROL_URI,
+        help='The endpoint taking PAUSE, RESUME and TERMINATE commands.')
+    parser.add_argument('--raw', default=RAW_URI,
+        help='The endpoint for messages needing normalising in proxy mode.')
+    parser.add_argument('--frontend', default=None,
+        help='The endpoints taking messages, defaults to port 13001 and ipc.')
+    parser.add_argument('--backend', default=None,
+        help='The endpoints publishing messages, defaults to port 13002 and ipc.')
+    parser.add_argument('--interest', default=None,
+        help='The endpoints producers ask what is subscribed to, defaults to '
+            'port 13006 and ipc.')
+    parser.add_argument('--upstream', default=None,
+        help='Forward everything relayed to the aggregating broadcaster here.')
+    parser.add_argument('--node', default=None,
+        help='The name of this node when forwarding, defaults to Node-<ip>.')
+    parser.add_argument('--codec', choices=sorted(logwire.CODECS), default='zlib',
+        help='How the batches forwarded upstream are compressed.')
+    parser.add_argument('--workers', type=int, default=0,
+        help='Run this many relay shards under a supervisor.')
+    parser.add_argument('--shutdown', action='store_true', default=False,
+        help='Tell the broadcaster listening on --control to terminate.')
+    return parser.parse_args(args)
+
 
+if __name__ == '__main__':
+    options = parseArgs()
+    if options.shutdown:
+        shutdown(options.control)
+        raise SystemExit(0)
+    if options.upstream and options.mode == 'proxy':
+        raise SystemExit("The proxy mode cannot forward upstream.")
+    if options.workers:
+        if options.mode == 'proxy':
+            raise SystemExit("The shards cannot run in proxy mode.")
+        supervise(
+            options.workers,
+            mode=options.mode,
+            debug=options.debug,
+            stats_interval=options.stats_interval,
+            batch_size=options.batch_size,
+            control_uri=options.control,
+            upstream=options.upstream,
+            node=options.node,
+            codec=options.codec,
+        )
+        raise SystemExit(0)
+    main(
+        mode=options.mode,
+        debug=options.debug,
+        stats_interval=options.stats_interval,
+        batch_size=options.batch_size,
+        capture_uri=options.capture,
+        control_uri=options.control,
+        raw_uri=options.raw,
+        interest_uri=options.interest,
+        frontend_uri=options.frontend,
+        backend_uri=options.backend,
+        upstream=options.upstream,
+        node=options.node,
+        codec=options.codec,
+    )
@@ -16,7 +16,6 @@ socket.identity = 'TestClient'
 print "Connecting to %s" % ip
 socket.connect('tcp://%s:13001' % ip)
 print "Sending message...."
-socket.send_multipart(['MESSAGE', msg])
+socket.send_multipart(['MESSAGE', 'all', msg])
 print "Done"
 socket.close()
-
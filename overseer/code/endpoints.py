@@ -0,0 +1,118 @@
+"""
+The endpoints of the jLog broadcaster and how to reach them.
+
+The broadcaster always binds its TCP ports so other nodes and containers can
+reach it, and also binds:
+
+    - ipc://<ipc_dir>/<name>
+      Unix sockets for the producers and subscribers on the same host, if
+      libzmq was built with ipc support.
+
+    - inproc://jlog-<name>
+      When it runs inside the overseer process with the shared
+      zmq.Context.instance(), see register().
+
+Producers and subscribers ask for an endpoint by name with connectUri() which
+picks the fastest transport available: inproc if the broadcaster is in this
+process, then ipc if its socket exists, otherwise tcp. The JLOG_TRANSPORT
+environment variable forces one of tcp, ipc or inproc, and JLOG_IPC_DIR moves
+the Unix sockets from /tmp/jlog.
+
+The PUSHHandler takes the uri 'auto' to mean connectUri('pull'), and the
+interest_uri 'auto' to mean connectUri('interest'), see resolve().
+"""
+
+import os
+
+import zmq
+
+
+PORTS = {
+    'pull': 13001,
+    'pub': 13002,
+    'interest': 13006,
+}
+
+TRANSPORTS = ('tcp', 'ipc', 'inproc')
+
+# The endpoints bound by a broadcaster running in this process.
+local = set()
+
+
+def transport():
+    """
+    Return the transport forced by JLOG_TRANSPORT, or auto.
+    """
+    return os.environ.get('JLOG_TRANSPORT', 'auto')
+
+
+def ipcDir():
+    return os.environ.get('JLOG_IPC_DIR', '/tmp/jlog')
+
+
+def tcpUri(name, host='*'):
+    return 'tcp://%s:%d' % (host, PORTS[name])
+
+
+def ipcUri(name):
+    return 'ipc://%s' % os.path.join(ipcDir(), name)
+
+
+def inprocUri(name):
+    return 'inproc://jlog-%s' % name
+
+
+def hasIpc():
+    """
+    Return True if libzmq can use Unix sockets here.
+    """
+    return zmq.has('ipc')
+
+
+def bindUris(name, inproc=False, port=None):
+    """
+    Return the endpoints the broadcaster binds for the name, inproc only if
+    it is running in the overseer process.
+    """
+    uris = [port and 'tcp://*:%d' % port or tcpUri(name)]
+    if hasIpc() and transport() in ('auto', 'ipc'):
+        if not os.path.isdir(ipcDir()):
+            os.makedirs(ipcDir())
+        uris.append(ipcUri(name))
+    if inproc:
+        uris.append(inprocUri(name))
+    return uris
+
+
+def register(uris):
+    """
+    Record the inproc endpoints a broadcaster in this process has bound.
+    """
+    local.update(uri for uri in uris if uri.startswith('inproc://'))
+
+
+def unregister(uris):
+    local.difference_update(uris)
+
+
+def connectUri(name, host='127.0.0.1', choice=None):
+    """
+    Return the endpoint to connect to for the name, using the fastest
+    transport available unless choice, or JLOG_TRANSPORT, says otherwise.
+    """
+    choice = choice or transport()
+    if choice == 'inproc' or choice == 'auto' and inprocUri(name) in local:
+        return inprocUri(name)
+    path = os.path.join(ipcDir(), name)
+    if choice == 'ipc' or choice == 'auto' and hasIpc() and os.path.exists(path):
+        return ipcUri(name)
+    return tcpUri(name, host)
+
+
+def resolve(uri, name, host='127.0.0.1'):
+    """
+    Return the uri, or connectUri(name, host) if it is 'auto'.
+    """
+    if uri == 'auto':
+        return connectUri(name, host)
+    return uri
@@ -14,10 +14,22 @@ The following handlers exist:
     - /docker/containers.html
       Present a list of existing containers
 
-    - /jLog?qualname={}&source={}
+    - /jLog?qualname={}&source={}&level={}&since={}
       This provides access to a subscriber websocket to view all logs going
-      through this node. Filter optionally by qualname of the handler and/or
-      the source of the logs.
+      through this node. Filter optionally by qualname prefix of the logger,
+      the source node of the logs and/or the minimum level, and choose how far
+      back the backlog goes with since (epoch seconds).
+
+    - /jLog/query?since={}&until={}&qualname={}&source={}&level={}
+      Stream the archived log lines between since and until (epoch seconds)
+      as text/plain, with the same filters as /jLog.
+
+    - /jLog/clients
+      The queue depth and lag of each connected /jLog client as JSON.
+
+    - /metrics?name={}&source={}&window={}
+      The 1, 5 and 15 minute windows of the metrics sent through jLog as JSON.
+      Filter optionally by name prefix and source, or ask for one window.
 
     - /aws/
       Proposed interface to the AWS CLI
@@ -39,16 +51,29 @@ The following handlers exist:
 
     - /services
 
+    - /services/batch
+      POST many registrations and status changes as JSON in one request, and
+      get the result of each.
+
+    - /services/list?status={}&InstanceId={}&limit={}&cursor={}&stream={}
+      Return a JSON list of the services, every one of them, a page of limit
+      and the cursor of the next page, or streamed a page at a time.
+
+    - /services/stats
+      The DynamoDB calls made, rejected and timed out by the thread pool and
+      the hits and misses of the query cache.
+
 
 """
 # TODO: make this a registry
 
 import dockerhandler
 import jLog
+import metricshandler
 import site
 import services
 
 
 def getHandlers():
-    return site.getHandlers() + dockerhandler.getHandlers() + jLog.getHandlers() + services.getHandlers()
+    return site.getHandlers() + dockerhandler.getHandlers() + jLog.getHandlers() + metricshandler.getHandlers() + services.getHandlers()
 
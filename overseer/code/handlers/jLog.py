@@ -14,23 +14,396 @@ and this nodes overseer service is available at overseer.<node>.<cluster>
 
 As the Service Discovery contains name:port specification, the port (def 3000)
 is available in the SD entry.
+
+Each record is formatted and JSON encoded once, as the SockJS payload, and
+those bytes are shared by the backlog and every client. Clients are sent their
+records in batches every coalesce_ms rather than a SockJS frame per line.
+
+Clients may filter the records they are sent:
+
+    /jLog?qualname=tornado.&source=10.0.0.1&level=WARNING&since=1540000000
+
+Clients with the same filter share it so each record is matched once per
+distinct filter. Records no filter wants by their qualname are kept in the
+backlog undecoded and only formatted if a later client asks for them.
+
+Each client has a bounded queue. A client that stops taking what it is sent,
+eg. a tab on a slow link, is not sent more until it catches up and is then told
+how many records it skipped. The depth and lag of each client's queue is at:
+
+    /jLog/clients
+
+Every record is also written to the on-disk archive (see logarchive) which
+outlives the in memory backlog and the process. Query it with:
+
+    /jLog/query?since=1540000000&until=1540003600&qualname=tornado.&level=WARNING
+
+which streams the matching lines as text/plain, oldest first.
+
+The backlog and the archive subscribe to every record, so the producers never
+skip any (see loghandler.Interest), unless --jlog_topics limits them to some
+topics, eg. LOGRECORD:jet.
 """
 
-import zmq
-from tornado import web
+from tornado import gen, web
+from tornado.ioloop import PeriodicCallback
+from tornado.options import define, options
 from tornado.log import app_log
-from sockjs.tornado import SockJSRouter, SockJSConnection
-from zmq.eventloop.zmqstream import ZMQStream
-import cPickle as pickle
+from sockjs.tornado import SockJSRouter, SockJSConnection, proto
+import collections
+import itertools
+import json
 import logging
+import os
 import time
 
+import endpoints
+import logarchive
+import logwire
+import subscribers
+
+
+define('jlog_archive', help='Directory of the jLog archive, empty to disable.',
+    default=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'archive'))
+define('jlog_archive_hours', default=7 * 24, type=int,
+    help='Hours of records kept in the jLog archive.')
+define('jlog_topics', default='',
+    help='Comma separated topics jLog keeps, eg. LOGRECORD:jet.,MESSAGE:, '
+        'empty for everything. Producers skip the records none of them match.')
 
 formatter = logging.Formatter(
     '%(asctime)s [%(source)s %(name)s %(levelname)s]: %(message)s',
     '%d/%m/%Y %H:%M:%S',
 )
 
+# Raised decoding a record, see logwire.decodeRecord, or formatting one with
+# bad args or missing attributes.
+DECODE_ERRORS = (ValueError, TypeError, KeyError, IndexError)
+
+
+class Undecodable(object):
+    """
+    Count the messages dropped as we cannot decode them, warning about them at
+    most once every interval seconds.
+    """
+    def __init__(self, interval=60):
+        self.interval = interval
+        self.count = 0
+        self.warned = 0
+
+    def drop(self, msg, exc):
+        self.count += 1
+        now = time.time()
+        if now - self.warned >= self.interval:
+            self.warned = now
+            app_log.warn(
+                "Dropping a message we cannot decode, %d so far: %s %r",
+                self.count, exc, [frame[:80] for frame in msg],
+            )
+
+
+class LogEntry(collections.namedtuple('LogEntry', 'levelno name source payload')):
+    """
+    A log line formatted and JSON encoded for SockJS, with what is needed to
+    filter it.
+    """
+    __slots__ = ()
+
+    @property
+    def size(self):
+        return len(self.payload) + len(self.name) + len(self.source)
+
+
+class RawEntry(collections.namedtuple('RawEntry', 'name frames')):
+    """
+    A message no client wanted when it arrived, kept as it was received.
+    """
+    __slots__ = ()
+
+    @property
+    def size(self):
+        return sum(len(frame) for frame in self.frames)
+
+
+class LogFilter(object):
+    """
+    The records a client wants: a qualname prefix, the source node and the
+    minimum level. Filters with the same arguments are equal so the clients
+    using them can be grouped.
+    """
+    def __init__(self, qualname=None, source=None, level=None):
+        self.qualname = qualname or ''
+        self.source = source or ''
+        if self.source and not self.source.startswith('Node-'):
+            self.source = 'Node-%s' % self.source
+        self.levelno = 0
+        if level and level.isdigit():
+            self.levelno = int(level)
+        elif level:
+            self.levelno = logging.getLevelName(level.upper())
+            if not isinstance(self.levelno, int):
+                raise ValueError("Unknown log level: %s" % level)
+        self.key = (self.qualname, self.source, self.levelno)
+
+    @classmethod
+    def fromInfo(cls, info):
+        """
+        Compile the filter from the connection arguments.
+        """
+        return cls(
+            info.get_argument('qualname'),
+            info.get_argument('source'),
+            info.get_argument('level'),
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, LogFilter) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def wantsName(self, name):
+        """
+        Return True if records from the qualname may be wanted.
+        """
+        return name.startswith(self.qualname)
+
+    def matches(self, entry):
+        """
+        Return True if the LogEntry is wanted.
+        """
+        return (
+            entry.levelno >= self.levelno
+            and entry.name.startswith(self.qualname)
+            and (not self.source or entry.source == self.source)
+        )
+
+
+def bufferedBytes(session):
+    """
+    Return the bytes written to the session that the client has not taken yet,
+    those queued by SockJS for the next poll and those in the transport's
+    IOStream write buffer.
+    """
+    size = len(getattr(session, 'send_queue', '') or '')
+    handler = getattr(session, 'handler', None)
+    if handler is None:
+        return size
+    stream = None
+    if getattr(handler, 'ws_connection', None) is not None:
+        stream = handler.ws_connection.stream
+    elif getattr(handler.request, 'connection', None) is not None:
+        stream = getattr(handler.request.connection, 'stream', None)
+    # IOStream has no public accessor for its pending writes.
+    if stream is not None and getattr(stream, '_write_buffer', None) is not None:
+        size += len(stream._write_buffer)
+    return size
+
+
+class ClientQueue(object):
+    """
+    The payloads waiting to be sent to a client on the next flush.
+
+    The queue is bounded. A client that is slow to take what it has been sent,
+    with more than max_buffered bytes still waiting in its session, is not
+    sent anything more until it catches up. Meanwhile its queue keeps the
+    newest max_pending payloads and the client is sent a line saying how many
+    records it skipped once it is sent to again.
+
+    The backlog a client is sent when it joins is not part of the queue: it
+    is sent a page of max_batch payloads per flush, ahead of what is queued
+    meanwhile, so a long backlog is never skipped.
+
+    The lag is how many records the subscriber has received, its head, since
+    the last record delivered to the client.
+    """
+    # The most payloads sent in one SockJS frame.
+    max_batch = 1000
+    # The most payloads queued for a client.
+    max_pending = 5000
+    # The unsent bytes in the session beyond which the client is stalled.
+    max_buffered = 1024 * 1024
+
+    def __init__(self, conn, logfilter=None):
+        self.conn = conn
+        self.filter = logfilter or LogFilter()
+        self.pending = collections.deque(maxlen=self.max_pending)
+        # The iterator of the backlog payloads still to send
+        self.history = None
+        self.position = self.tail = 0
+        self.sent = self.skipped = self.total_skipped = 0
+        self.buffered = 0
+        self.stalled_since = None
+
+    def put(self, payload, seq=0):
+        if len(self.pending) == self.max_pending:
+            self.skipped += 1
+            self.total_skipped += 1
+        self.pending.append(payload)
+        self.tail = seq
+
+    def lag(self, head):
+        """
+        Return the records received by the subscriber since the last one sent.
+        """
+        if not self.pending and not self.skipped:
+            return 0
+        return max(0, head - self.position)
+
+    def replay(self, payloads):
+        """
+        Send the payloads, eg. of the backlog, ahead of what is queued.
+        """
+        self.history = iter(payloads)
+
+    def stats(self, head):
+        return {
+            'filter': dict(zip(('qualname', 'source', 'level'), self.filter.key)),
+            'pending': len(self.pending),
+            'replaying': self.history is not None,
+            'lag': self.lag(head),
+            'buffered': self.buffered,
+            'sent': self.sent,
+            'skipped': self.total_skipped,
+            'stalled': self.stalled_since and time.time() - self.stalled_since or 0,
+        }
+
+    def flush(self):
+        """
+        Send the pending payloads as SockJS frames of up to max_batch each,
+        unless the client is stalled. While there is backlog to replay only a
+        page of it is sent.
+        """
+        if not self.pending and self.history is None:
+            return
+        session = self.conn.session
+        if session.is_closed:
+            self.pending.clear()
+            self.history = None
+            return
+        self.buffered = bufferedBytes(session)
+        if self.buffered > self.max_buffered:
+            if self.stalled_since is None:
+                self.stalled_since = time.time()
+            return
+        self.stalled_since = None
+        if self.history is not None:
+            page = list(itertools.islice(self.history, self.max_batch))
+            if len(page) == self.max_batch:
+                self.send(session, page)
+                return
+            self.history = None
+            self.send(session, page)
+        pending = list(self.pending)
+        self.pending.clear()
+        if self.skipped:
+            pending.insert(0, proto.json_encode(
+                '... %d records skipped, the client fell behind ...' % self.skipped
+            ))
+            self.skipped = 0
+        self.send(session, pending)
+        self.position = self.tail
+
+    def send(self, session, pending):
+        """
+        Send the payloads as SockJS frames of up to max_batch each.
+        """
+        self.sent += len(pending)
+        for start in xrange(0, len(pending), self.max_batch):
+            batch = pending[start:start + self.max_batch]
+            if session.send_expects_json:
+                session.send_jsonified(','.join(batch), False)
+            else:
+                for payload in batch:
+                    session.send_message(json.loads(payload), stats=False)
+
+
+class RingBacklog(object):
+    """
+    A fixed capacity ring of LogEntry in the order they arrived, bounded by
+    both the number of entries and their bytes.
+
+    Each entry is indexed by its arrival time, kept monotonic even if the clock
+    steps back, so trimming by age only ever looks at the oldest entry and
+    since() can binary search for a start time.
+    """
+    # Rough bytes per entry on top of the text.
+    __overhead__ = 128
+
+    def __init__(self, capacity=50000, max_bytes=32 * 1024 * 1024, max_age=3600):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.entries = [None] * capacity
+        self.times = [0.0] * capacity
+        self.sizes = [0] * capacity
+        self.head = self.count = self.bytes = 0
+        self.last = 0.0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return self.since(None)
+
+    def append(self, entry, now=None):
+        """
+        Add an entry, dropping the oldest entries to make room.
+        """
+        now = self.last = max(now or time.time(), self.last)
+        size = entry.size + self.__overhead__
+        if self.count == self.capacity:
+            self.popleft()
+        while self.count and self.bytes + size > self.max_bytes:
+            self.popleft()
+        index = (self.head + self.count) % self.capacity
+        self.entries[index] = entry
+        self.times[index] = now
+        self.sizes[index] = size
+        self.count += 1
+        self.bytes += size
+
+    def popleft(self):
+        """
+        Drop the oldest entry.
+        """
+        self.bytes -= self.sizes[self.head]
+        self.entries[self.head] = None
+        self.head = (self.head + 1) % self.capacity
+        self.count -= 1
+
+    def trim(self, now=None):
+        """
+        Drop the entries older than max_age seconds.
+        """
+        cutoff = (now or time.time()) - self.max_age
+        while self.count and self.times[self.head] < cutoff:
+            self.popleft()
+
+    def bisect(self, since):
+        """
+        Return the position of the first entry that arrived at or after since.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[(self.head + middle) % self.capacity] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def since(self, since=None):
+        """
+        Yield the entries that arrived at or after since, oldest first.
+        """
+        start = since and self.bisect(since) or 0
+        for position in xrange(start, self.count):
+            yield self.entries[(self.head + position) % self.capacity]
+
 
 class ZMQSubscriber(object):
     """
@@ -46,85 +419,193 @@ class ZMQSubscriber(object):
         > conn.session.server.zmq_subscriber
 
     """
-    # List of currently listening client connections
-    clients = set()
-
-    # The stream is the ZMQ socket listening for messages
-    stream = None
-
-    # How long to keep messages in the backlog.
-    backlog_mins = 60
-
-    # The backlog.. Should be a Redis Server with timeout.
-    __backlog = []
-
-    def __init__(self, uri='tcp://127.0.0.1:13002', backlog_mins=60, topics=None):
+    def __init__(self, uri='tcp://127.0.0.1:13002', backlog_mins=60, topics=None,
+            backlog_size=50000, backlog_bytes=32 * 1024 * 1024, coalesce_ms=100):
         """
         Constructor:
         """
         self.uri = uri
         self.backlog_mins = backlog_mins
         self.topics = topics
+        self.coalesce_ms = coalesce_ms
+        self.flusher = None
+        # The currently listening client connections and their queues
+        self.clients = {}
+        # The client queues grouped by their LogFilter
+        self.groups = {}
+        # The sequence number of the last message received
+        self.head = 0
+        # The backlog.. Should be a Redis Server with timeout.
+        self.backlog = RingBacklog(backlog_size, backlog_bytes, backlog_mins * 60)
+        self.undecodable = Undecodable()
         self.setup()
 
     def setup(self):
         """
-        Setup the subscriber connection on first use.
+        Listen to the shared subscriber for the uri. The backlog must see every
+        record so we listen from the start, not when the first client joins.
         """
-        app_log.info("Connecting to publisher: %s", self.uri)
-        ctxt = zmq.Context()
-        subscriber = ctxt.socket(zmq.SUB)
-        subscriber.connect(self.uri)
-        if self.topics:
-            for topic in self.topics:
-                subscriber.setsockopt(zmq.SUBSCRIBE, topic)
-        else:
-            subscriber.setsockopt(zmq.SUBSCRIBE, '')
-        self.stream = ZMQStream(subscriber)
-        self.stream.on_recv(self.on_recv_sub)
+        subscribers.subscribe(self.uri, self.on_recv_sub, self.topics)
+        self.flusher = PeriodicCallback(self.flush, self.coalesce_ms)
+        self.flusher.start()
+
+    def entry(self, msg):
+        """
+        Return the LogEntry for a message, formatted and encoded once, or None
+        if it is not a record or cannot be decoded.
+        """
+        if isinstance(msg, RawEntry):
+            msg = msg.frames
+        kind = logwire.splitTopic(msg[0])[0]
+        try:
+            if kind == 'MESSAGE':
+                return LogEntry(logging.INFO, msg[1], '', proto.json_encode(msg[-1]))
+            elif kind == 'LOGRECORD':
+                record = logwire.decodeRecord(msg)
+                return LogEntry(
+                    record.levelno, record.name, getattr(record, 'source', ''),
+                    proto.json_encode(formatter.format(record)),
+                )
+        except DECODE_ERRORS, exc:
+            self.undecodable.drop(msg, exc)
 
     def on_recv_sub(self, msg):
         """
         Called when a new message comes in from the ZMQ socket.
         """
         app_log.debug('Got a subscriber message.')
+        # Metrics are kept by the metricshandler, not the log
+        if logwire.splitTopic(msg[0])[0] == 'METRIC':
+            return
+        # Every record and message has its qualname or topic frame
+        if len(msg) < 2:
+            self.undecodable.drop(msg, 'missing frames')
+            return
         now = time.time()
-        if msg[0] == 'MESSAGE':
-            text = msg[1]
-        elif msg[0] == 'LOGRECORD':
-            qualname = msg[1]
-            record = pickle.loads(msg[2])
-        self.__backlog.append(record)
-        print str(record)
-        # Send out the new message
-        for conn in self.clients:
-            conn.broadcast(self.clients, formatter.format(record))
-            break
+        self.head += 1
+        # The qualname frame tells us if the record is worth decoding
+        name = msg[1]
+        groups = [
+            (logfilter, queues) for logfilter, queues in self.groups.iteritems()
+            if logfilter.wantsName(name)
+        ]
+        if groups:
+            entry = self.entry(msg)
+            if entry is None:
+                return
+            # Queue the new message for the next flush
+            for logfilter, queues in groups:
+                if logfilter.matches(entry):
+                    for queue in queues.itervalues():
+                        queue.put(entry.payload, self.head)
+        else:
+            entry = RawEntry(name, msg)
+        self.backlog.append(entry, now)
         # Now trim the backlog
-        for idx, oRec in enumerate(self.__backlog):
-            if (now - oRec.created) < self.backlog_mins:
-                break
-        if idx:
-            self.__backlog = self.__backlog[idx:]
+        self.backlog.trim(now)
 
-    def add(self, client):
+    def flush(self):
         """
-        Add a new client connection.
+        Send each client the messages queued since the last flush.
         """
-        self.clients.add(client)
+        for queue in self.clients.values():
+            queue.flush()
+
+    def add(self, client, logfilter=None):
+        """
+        Add a new client connection, sent only the records the filter matches.
+        """
+        queue = self.clients[client] = ClientQueue(client, logfilter)
+        self.groups.setdefault(queue.filter, {})[client] = queue
 
     def remove(self, client):
         """
         Remove a client connection.
         """
-        self.clients.remove(client)
+        queue = self.clients.pop(client, None)
+        if queue is None:
+            return
+        group = self.groups.get(queue.filter, {})
+        group.pop(client, None)
+        if not group:
+            self.groups.pop(queue.filter, None)
+
+    def stats(self):
+        """
+        Return the queue of each client and how far it lags behind.
+        """
+        return [
+            dict(queue.stats(self.head), ip=getattr(client, 'ip', None))
+            for client, queue in self.clients.items()
+        ]
+
+    def send_backlog(self, client, since=None, logfilter=None):
+        """
+        Send the backlog, which is messages recieved in the last X minutes, or
+        those received since the given time.
+
+        The entries are taken now and decoded and sent a page at a time by the
+        client's flushes, see ClientQueue.
+        """
+        if client not in self.clients:
+            self.add(client, logfilter)
+        queue = self.clients[client]
+        queue.replay(self.payloads(list(self.backlog.since(since)), queue.filter))
+        queue.flush()
 
-    def send_backlog(self, client):
+    def payloads(self, entries, logfilter):
         """
-        Send the backlog, which is messages recieved in the last X minutes.
+        Yield the payloads of the entries the filter matches.
         """
-        for msg in self.__backlog:
-            client.send(formatter.format(msg))
+        for entry in entries:
+            if isinstance(entry, RawEntry):
+                if not logfilter.wantsName(entry.name):
+                    continue
+                entry = self.entry(entry)
+                if entry is None:
+                    continue
+            if logfilter.matches(entry):
+                yield entry.payload
+
+
+class ArchiveSubscriber(object):
+    """
+    Write every record published on the uri to the SegmentStore.
+
+    Appends are buffered and flushed to disk every flush_ms, a query flushes
+    first so it always sees the latest records.
+    """
+    def __init__(self, uri, store, flush_ms=1000, topics=None):
+        self.uri = uri
+        self.topics = topics
+        self.store = store
+        self.flush_ms = flush_ms
+        self.undecodable = Undecodable()
+        self.setup()
+
+    def setup(self):
+        app_log.info("Archiving records from %s in %s", self.uri, self.store.directory)
+        subscribers.subscribe(self.uri, self.on_recv_sub, self.topics)
+        self.flusher = PeriodicCallback(self.store.flush, self.flush_ms)
+        self.flusher.start()
+
+    def on_recv_sub(self, msg):
+        """
+        Archive the record as the line a jLog client would see.
+        """
+        kind = logwire.splitTopic(msg[0])[0]
+        if kind == 'MESSAGE' and len(msg) > 1:
+            self.store.append(logging.INFO, msg[1], '', msg[-1])
+        elif kind == 'LOGRECORD':
+            try:
+                record = logwire.decodeRecord(msg)
+                text = formatter.format(record)
+            except DECODE_ERRORS, exc:
+                self.undecodable.drop(msg, exc)
+                return
+            self.store.append(
+                record.levelno, record.name, getattr(record, 'source', ''), text,
+            )
 
 
 class LoggingConnection(SockJSConnection):
@@ -137,16 +618,27 @@ class LoggingConnection(SockJSConnection):
         Called when a web client connects.
         """
         app_log.info("New client has joined: %s", info.ip)
+        self.ip = info.ip
+        try:
+            logfilter = LogFilter.fromInfo(info)
+            since = info.get_argument('since')
+            since = since and float(since)
+        except ValueError, exc:
+            # sockjs ignores what on_open returns, so tell the client and close
+            app_log.warn("Rejecting client %s: %s", info.ip, exc)
+            self.send('Rejected: %s' % exc)
+            self.session.close(3000, str(exc))
+            return
         # Adding this client to the socket means new messages are pushed
-        self.session.server.zmq_subscriber.add(self)
+        self.session.server.zmq_subscriber.add(self, logfilter)
         # Send the backlog on connection
-        self.session.server.zmq_subscriber.send_backlog(self)
+        self.session.server.zmq_subscriber.send_backlog(self, since, logfilter)
 
     def on_close(self):
         """
         Called when a web client disconnects.
         """
-        app_log.info("Client has left: %s", info.ip)
+        app_log.info("Client has left: %s", self.ip)
         self.session.server.zmq_subscriber.remove(self)
 
 
@@ -161,14 +653,85 @@ class IndexHandler(web.RequestHandler):
         self.render('jLog.html')
 
 
+class ClientsHandler(web.RequestHandler):
+    """
+    Report the queue depth and lag of each connected jLog client as JSON.
+    """
+    def initialize(self, subscriber):
+        self.subscriber = subscriber
+
+    def get(self):
+        self.write({
+            'head': self.subscriber.head,
+            'undecodable': self.subscriber.undecodable.count,
+            'clients': self.subscriber.stats(),
+        })
+
+
+class QueryHandler(web.RequestHandler):
+    """
+    Stream the archived records matching the query, one line per record.
+    """
+    # Bytes written between flushes to the client.
+    chunk_size = 64 * 1024
+    # Records scanned between returns to the IOLoop.
+    scan_size = 1000
+
+    def initialize(self, store):
+        self.store = store
+
+    @gen.coroutine
+    def get(self):
+        try:
+            logfilter = LogFilter(
+                self.get_argument('qualname', None),
+                self.get_argument('source', None),
+                self.get_argument('level', None),
+            )
+            since = self.get_argument('since', None)
+            since = since and float(since)
+            until = self.get_argument('until', None)
+            until = until and float(until)
+        except ValueError, exc:
+            raise web.HTTPError(400, str(exc))
+        self.set_header('Content-Type', 'text/plain; charset=UTF-8')
+        pending = 0
+        for record in self.store.query(
+                since, until, logfilter.qualname, logfilter.source, logfilter.levelno,
+                self.scan_size):
+            if record is None:
+                # Let the relay and the websockets run however little matches
+                yield gen.moment
+                continue
+            line = record[-1].encode('utf-8') + '\n'
+            self.write(line)
+            pending += len(line)
+            if pending >= self.chunk_size:
+                pending = 0
+                yield self.flush()
+
+
 def getHandlers():
     """
     Return a list of the handlers for the jLog target.
     """
     import socket
     ip = socket.gethostbyname(socket.gethostname())
-    uri = 'tcp://%s:13002' % ip
+    uri = endpoints.connectUri('pub', ip)
+    # The backlog and archive keep every record unless told otherwise, and
+    # what they subscribe to the producers cannot skip
+    topics = [topic.strip() for topic in options.jlog_topics.split(',') if topic.strip()]
     server = SockJSRouter(LoggingConnection, '/jLog')
-    server.zmq_subscriber = ZMQSubscriber(uri=uri)
-    return [(r'/jLog', IndexHandler),] + server.urls
+    server.zmq_subscriber = ZMQSubscriber(uri=uri, topics=topics or None)
+    urls = [
+        (r'/jLog', IndexHandler),
+        (r'/jLog/clients', ClientsHandler, {'subscriber': server.zmq_subscriber}),
+    ]
+    if options.jlog_archive:
+        store = logarchive.SegmentStore(
+            options.jlog_archive, retention=options.jlog_archive_hours * 3600,
+        )
+        server.archive_subscriber = ArchiveSubscriber(uri, store, topics=topics or None)
+        urls.append((r'/jLog/query', QueryHandler, {'store': store}))
+    return urls + server.urls
 
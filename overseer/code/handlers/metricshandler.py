@@ -0,0 +1,174 @@
+"""
+This module contains the handlers for the metrics sent through jLog.
+
+Processes send their counters, gauges and histograms with a
+metrics.Aggregator and the broadcaster publishes them as METRIC messages. The
+MetricsSubscriber keeps the samples of the last 15 minutes for each metric and
+source, and the rolling 1, 5 and 15 minute windows are served as JSON at:
+
+    /metrics?name=services.&source=10.0.0.1&window=300
+
+All the parameters are optional: name is a prefix of the metric names and
+source a substring of the node they came from.
+
+For each window:
+
+    - counter: count, sum and rate (sum per second)
+    - gauge: last, min and max
+    - histogram: count, sum, mean, min, max, p50, p90 and p99, the percentiles
+      being the upper bound of the bucket they fall in, see logwire.bucketBound.
+"""
+
+from tornado import web
+from tornado.log import app_log
+import collections
+import struct
+import time
+
+import endpoints
+import logwire
+import subscribers
+
+
+WINDOWS = (60, 300, 900)
+
+# Local metrics, and those forwarded from the nodes with their Node-<ip>
+# prefix, so the subscription leaves the producers free to skip log records.
+TOPICS = ['METRIC:', 'Node-']
+
+PERCENTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+
+
+def summarise(kind, samples, window):
+    """
+    Return the summary of the samples of a metric over the window seconds.
+    """
+    count = sum(sample.count for sample in samples)
+    summary = {'count': count}
+    if not samples:
+        return summary
+    low = min(sample.low for sample in samples)
+    high = max(sample.high for sample in samples)
+    if kind == logwire.COUNTER:
+        total = sum(sample.value for sample in samples)
+        summary.update({'sum': total, 'rate': total / float(window)})
+    elif kind == logwire.GAUGE:
+        summary.update({'last': samples[-1].value, 'min': low, 'max': high})
+    else:
+        total = sum(sample.value for sample in samples)
+        buckets = collections.Counter()
+        for sample in samples:
+            buckets.update(sample.buckets)
+        summary.update({
+            'sum': total, 'mean': count and total / count or 0.0,
+            'min': low, 'max': high,
+        })
+        ordered = sorted(buckets.items())
+        for label, fraction in PERCENTILES:
+            rank, seen = fraction * count, 0
+            for index, bucket in ordered:
+                seen += bucket
+                if seen >= rank:
+                    summary[label] = min(logwire.bucketBound(index), high)
+                    break
+    return summary
+
+
+class MetricsSubscriber(object):
+    """
+    Keep the METRIC samples published in the last max(WINDOWS) seconds.
+    """
+    def __init__(self, uri):
+        self.uri = uri
+        # (name, source) -> deque of MetricSample, oldest first
+        self.samples = {}
+        self.received = 0
+        self.dropped = 0
+        subscribers.subscribe(uri, self.on_recv_sub, TOPICS)
+
+    def on_recv_sub(self, msg):
+        if logwire.splitTopic(msg[0])[0] != 'METRIC':
+            return
+        try:
+            sample = logwire.decodeMetric(msg)
+        except (ValueError, IndexError, struct.error), exc:
+            app_log.warn("Dropping a metric we cannot decode: %s", exc)
+            self.dropped += 1
+            return
+        self.received += 1
+        # Fall back to the node prefix of a forwarding broadcaster
+        key = (sample.name, sample.source or logwire.splitNode(msg[0]) or '')
+        samples = self.samples.get(key)
+        if samples is None or samples[-1].kind != sample.kind:
+            samples = self.samples[key] = collections.deque()
+        samples.append(sample)
+        self.expire(samples, time.time())
+
+    def expire(self, samples, now):
+        horizon = now - max(WINDOWS)
+        while samples and samples[0].timestamp < horizon:
+            samples.popleft()
+
+    def query(self, prefix='', source='', windows=WINDOWS):
+        """
+        Return the summary of each metric and source over the windows.
+        """
+        now = time.time()
+        result = []
+        for (name, origin), samples in sorted(self.samples.items()):
+            if not name.startswith(prefix) or source not in origin:
+                continue
+            self.expire(samples, now)
+            if not samples:
+                del self.samples[(name, origin)]
+                continue
+            kind = samples[-1].kind
+            result.append({
+                'name': name,
+                'source': origin,
+                'kind': {'c': 'counter', 'g': 'gauge', 'h': 'histogram'}[kind],
+                'windows': dict(
+                    (str(window), summarise(kind, [
+                        sample for sample in samples if sample.timestamp >= now - window
+                    ], window))
+                    for window in windows
+                ),
+            })
+        return result
+
+
+class MetricsHandler(web.RequestHandler):
+    """
+    Serve the rolling windows of the metrics as JSON.
+    """
+    def initialize(self, subscriber):
+        self.subscriber = subscriber
+
+    def get(self):
+        windows = WINDOWS
+        if self.get_argument('window', None):
+            try:
+                windows = [int(self.get_argument('window'))]
+            except ValueError:
+                raise web.HTTPError(400, 'window must be a number of seconds')
+            if not 0 < windows[0] <= max(WINDOWS):
+                raise web.HTTPError(400, 'window must be 1 to %d seconds' % max(WINDOWS))
+        self.write({
+            'received': self.subscriber.received,
+            'dropped': self.subscriber.dropped,
+            'metrics': self.subscriber.query(
+                self.get_argument('name', ''), self.get_argument('source', ''), windows,
+            ),
+        })
+
+
+def getHandlers():
+    """
+    Return a list of the handlers for the metrics.
+    """
+    import socket
+    ip = socket.gethostbyname(socket.gethostname())
+    subscriber = MetricsSubscriber(endpoints.connectUri('pub', ip))
+    return [
+        (r'/metrics', MetricsHandler, {'subscriber': subscriber}),
+    ]
@@ -8,90 +8,331 @@ Notation:
 
 """
 
-from tornado import web
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from tornado import gen, locks, web
+from tornado.ioloop import IOLoop
 from tornado.log import app_log, gen_log
 import boto3
 from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.types import TypeSerializer
+from botocore import exceptions
+import base64
+import collections
+import decimal
+import functools
+import inspect
 import json
 import requests
 import os
+import sys
+import threading
+import time
 import docker
 from mx import DateTime
 
+import metrics
+
 
 class JSONEncoder(json.JSONEncoder):
     def default(self, o):
-        if isinstance(o, ObjectId):
-            return str(o)
+        # DynamoDB numbers, eg. ExpiresAt
+        if isinstance(o, decimal.Decimal):
+            return int(o) if o % 1 == 0 else float(o)
         return json.JSONEncoder.default(self, o)
 
 
+def encodeCursor(key):
+    """
+    Return the LastEvaluatedKey of a page as the cursor of the next page, or
+    None if it was the last.
+    """
+    if not key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(key, sort_keys=True))
+
+
+def decodeCursor(cursor):
+    """
+    Return the ExclusiveStartKey of the page from its cursor.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor.')
+    if not isinstance(key, dict):
+        raise ValueError('Invalid cursor.')
+    return key
+
+
+def now():
+    return DateTime.now().Format('%Y-%m-%d %H:%M:%S')
+
+
+def registration(data, instanceId, date=None):
+    """
+    Return the item registering the service described by data.
+    """
+    date = date or now()
+    data = dict(data)
+    data['Status'] = [{'Status': 'starting', 'Date': date, 'Message': 'Registration.'},]
+    data['CreatedOn'] = date
+    data['LastStatusChangedOn'] = date
+    data['CurrentStatus'] = 'starting'
+    data['InstanceId'] = instanceId
+    return data
+
+
+def statusChange(status, message, date=None):
+    """
+    Return the updateService arguments changing the status of a service.
+    """
+    data = {'Status': status, 'Message': message, 'Date': date or now(),}
+    return {
+        'CurrentStatus': status,
+        'LastStatusChangedOn': data['Date'],
+        'Status': [data,],
+    }
+
+
+def mergeStatus(data, change):
+    """
+    Apply the status change to a registration or an earlier change.
+    """
+    data['Status'] = data['Status'] + change['Status']
+    data['CurrentStatus'] = change['CurrentStatus']
+    data['LastStatusChangedOn'] = change['LastStatusChangedOn']
+
+
+class Pending(object):
+    """
+    A query being loaded into the QueryCache, which other callers wait for.
+    """
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = self.error = None
+
+
+class QueryCache(object):
+    """
+    A thread safe LRU of up to size query results, each kept for ttl seconds.
+
+    Callers asking for a key that is being loaded wait for that load rather
+    than making the same request. invalidate() empties the cache and stops
+    the loads under way from storing what may now be stale.
+    """
+    def __init__(self, size=1024, ttl=5):
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.hits = self.misses = self.coalesced = 0
+        self.evictions = self.invalidations = 0
+
+    def get(self, key, load):
+        """
+        Return the cached value of the key, calling load() on a miss.
+        """
+        if self.ttl <= 0 or self.size <= 0:
+            return load()
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] > time.time():
+                self.entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            pending = self.pending.get(key)
+            loading = pending is None
+            if loading:
+                self.misses += 1
+                pending = self.pending[key] = Pending()
+                generation = self.generation
+            else:
+                self.coalesced += 1
+        if not loading:
+            pending.event.wait()
+            if pending.error:
+                raise pending.error[0], pending.error[1], pending.error[2]
+            return pending.value
+        try:
+            pending.value = load()
+        except BaseException:
+            pending.error = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                if self.pending.get(key) is pending:
+                    del self.pending[key]
+                if pending.error is None and generation == self.generation:
+                    self.entries[key] = (time.time() + self.ttl, pending.value)
+                    while len(self.entries) > self.size:
+                        self.entries.popitem(last=False)
+                        self.evictions += 1
+            pending.event.set()
+        return pending.value
+
+    def invalidate(self):
+        """
+        Forget everything, including the loads under way.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.pending.clear()
+            self.generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+def cached(method):
+    """
+    Serve the AWSAPI query from its cache, keyed by the name of the query and
+    its arguments.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        callargs = inspect.getcallargs(method, self, *args, **kwargs)
+        del callargs['self']
+        key = (method.__name__,) + tuple(sorted(callargs.items()))
+        return self.cache.get(key, lambda: method(self, *args, **kwargs))
+    return wrapper
+
+
+def invalidates(method):
+    """
+    Invalidate the cache of the AWSAPI once the write has been made.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.cache.invalidate()
+    return wrapper
+
+
 class AWSAPI(object):
     """
     A wrapper for accessing AWS.
+
+    The results of the queries are cached for cache_ttl seconds, up to
+    cache_size of them, and any write through the AWSAPI invalidates them,
+    see QueryCache.
+
+    The queries are answered from an index rather than a scan of the table,
+    but for listing the services in every status, status='all', which scans:
+
+        - TasksByInstanceStatus: the tasks on an instance, by status.
+        - TasksByServiceName: the tasks running a service, by status.
+        - TasksByStatus: the tasks in a status, on any instance.
+        - TasksByHostname: the task with a hostname, by status.
+        - ActiveTasks: a sparse index of the tasks that are not terminated,
+          only they have the Active attribute.
+
+    Terminated tasks are given an ExpiresAt of __Retention__ seconds later,
+    the TTL attribute of the table, so DynamoDB removes them.
+
+    A table created by an earlier overseer is brought up to date once, before
+    the overseers are upgraded, with main.py --migrate, see migrate().
     """
     __TableName__ = 'Services'
+    __Retention__ = 7 * 24 * 3600
+    __Indexes__ = (
+        # Index for services running on an EC2 Instance
+        ('TasksByInstanceStatus', 'InstanceId', 'CurrentStatus'),
+        # Index to search for running services by name
+        ('TasksByServiceName', 'ServiceName', 'CurrentStatus'),
+        # Index for services in a status anywhere in the cluster
+        ('TasksByStatus', 'CurrentStatus', 'TaskId'),
+        # Index to find a task by its hostname
+        ('TasksByHostname', 'Hostname', 'CurrentStatus'),
+        # Sparse index of the tasks not yet terminated
+        ('ActiveTasks', 'Active', 'TaskId'),
+    )
     aws_identity_doc_url = 'http://169.254.169.254/latest/dynamic/instance-identity/'
 
-    def __init__(self, apiKeyId=None, secret=None, endpoint=None, region=None):
+    def __init__(self, apiKeyId=None, secret=None, endpoint=None, region=None,
+            cache_size=1024, cache_ttl=5):
         self.__apiKey = apiKeyId or os.environ.get('AWS_ACCESS_KEY_ID')
         self.__secret = secret or os.environ.get('AWS_SECRET_ACCESS_KEY')
         self.__endpoint = endpoint or os.environ.get('AWS_DYNAMODB_ENDPOINT')
         self.__region = region or os.environ.get('AWS_REGION')
-        self.__session = None
-        self.__dbc = None
-        self.__dbr = None
+        # Boto3 sessions and resources are not thread safe so each thread of
+        # the AsyncAWSAPI pool has its own, see AsyncAWSAPI.
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
         self.__identity_doc = self.__docker_info = {}
-        self.__table = None
+        self.__tableExists = False
+        self.cache = QueryCache(cache_size, cache_ttl)
         self.setup()
 
     @property
     def session(self):
-        if not self.__session:
+        if getattr(self.__local, 'session', None) is None:
             app_log.info("Starting new Boto3.Session")
-            self.__session = boto3.session.Session(
+            self.__local.session = boto3.session.Session(
                 aws_access_key_id=self.__apiKey,
                 aws_secret_access_key=self.__secret,
                 region_name=self.region,
             )
-        return self.__session
+        return self.__local.session
 
     @property
     def dbc(self):
         """
         The DynamoDB Low-Level client.
         """
-        if not self.__dbc:
+        if getattr(self.__local, 'dbc', None) is None:
             if self.__endpoint:
                 app_log.info("Using DynamoDb endpoint: %s" % self.__endpoint)
-            self.__dbc = self.session.client('dynamodb', endpoint_url=self.__endpoint)
-        return self.__dbc
+            self.__local.dbc = self.session.client('dynamodb', endpoint_url=self.__endpoint)
+        return self.__local.dbc
 
     @property
     def dbr(self):
         """
         The DynamoDB Resource.
         """
-        if not self.__dbr:
+        if getattr(self.__local, 'dbr', None) is None:
             if self.__endpoint:
                 app_log.info("Using DynamoDb endpoint: %s" % self.__endpoint)
-            self.__dbr = self.session.resource('dynamodb', endpoint_url=self.__endpoint)
-        return self.__dbr
+            self.__local.dbr = self.session.resource('dynamodb', endpoint_url=self.__endpoint)
+        return self.__local.dbr
 
     @property
     def table(self):
         """
         The table used by the Overseer
         """
-        if self.__table is None:
-            response = self.dbc.list_tables()
-            app_log.info("list_tables response: %s" % response)
-            if self.__TableName__ in response['TableNames']:
-                app_log.info("Found existing table: %s" % self.__TableName__)	 
-                self.__table = self.dbr.Table(self.__TableName__)
-            else:
-                self.__table = self.create()
-        return self.__table
+        if getattr(self.__local, 'table', None) is None:
+            with self.__lock:
+                if not self.__tableExists:
+                    response = self.dbc.list_tables()
+                    app_log.info("list_tables response: %s" % response)
+                    if self.__TableName__ in response['TableNames']:
+                        app_log.info("Found existing table: %s" % self.__TableName__)
+                        missing = [index['IndexName'] for index in self.missingIndexes()]
+                        if missing:
+                            app_log.warn("%s is missing the indexes %s, run main.py --migrate" % (
+                                self.__TableName__, ', '.join(missing),
+                            ))
+                    else:
+                        self.create()
+                    self.__tableExists = True
+            self.__local.table = self.dbr.Table(self.__TableName__)
+        return self.__local.table
 
     @property
     def region(self):
@@ -127,6 +368,41 @@ class AWSAPI(object):
         self.__docker_info = client.info()
         app_log.info("Found instanceId: %s" % self.instanceId)
 
+    def globalSecondaryIndexes(self):
+        """
+        Return the definition of each of the __Indexes__.
+        """
+        indexes = []
+        for name, partitionKey, sortKey in self.__Indexes__:
+            index = {
+                'IndexName': name,
+                'KeySchema': [
+                    {'AttributeName': partitionKey, 'KeyType': 'HASH',},  # PartitionKey
+                    {'AttributeName': sortKey, 'KeyType': 'RANGE',}, # SortKey
+                ],
+                'Projection': { 'ProjectionType': 'ALL', },
+            }
+            # If there is an endpoint then we are using the dynamodb-local
+            # service that has a bug where ProvisionedThroughput is required
+            # on everything but ignored.
+            if self.__endpoint:
+                index['ProvisionedThroughput'] = {'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1,}
+            indexes.append(index)
+        return indexes
+
+    def attributeDefinitions(self, names=None):
+        """
+        Return the definitions of the key attributes of the table and the
+        indexes, or just those named.
+        """
+        keys = set(['TaskId'])
+        for index in self.__Indexes__:
+            keys.update(index[1:])
+        return [
+            {'AttributeName': name, 'AttributeType': 'S',}
+            for name in sorted(keys) if names is None or name in names
+        ]
+
     def create(self):
         """
         Create the tables for overseer.
@@ -136,56 +412,142 @@ class AWSAPI(object):
             - TaskId: is the id of the task from the cluster
             - ServiceName: is the name of the service (eg. db1)
             - CurrentStatus: is the current status of the service
+            - Hostname: is the hostname of the container
+            - Active: is set while the task is not terminated
+            - ExpiresAt: is when DynamoDB may delete a terminated task
         """
         app_log.info("Creating table: %s" % self.__TableName__)
-        GlobalSecondaryIndexes = [{
-        # Index for services running on an EC2 Instance
-            'IndexName': 'TasksByInstanceStatus',
-            'KeySchema': [
-                {'AttributeName': 'InstanceId', 'KeyType': 'HASH',},  # PartitionKey
-                {'AttributeName': 'CurrentStatus', 'KeyType': 'RANGE',}, # SortKey
-            ],
-            'Projection': { 'ProjectionType': 'ALL', },
-        },{
-        # Index to search for running services by name
-            'IndexName': 'TasksByServiceName',
-            'KeySchema': [
-                {'AttributeName': 'ServiceName', 'KeyType': 'HASH',},  # SortKey
-                {'AttributeName': 'CurrentStatus', 'KeyType': 'RANGE',}, # PartitionKey
-            ],
-            'Projection': { 'ProjectionType': 'ALL', },
-        },]
-        # If there is an endpoint then we are using the dynamodb-local service
-        # that has a bug where ProvisionedThroughput is required on everything
-        # but ignored.
         args = {}
         if self.__endpoint:
-            ProvisionedThroughput = {'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1,}
-            for index in GlobalSecondaryIndexes:
-                index['ProvisionedThroughput'] = ProvisionedThroughput
-            args['ProvisionedThroughput'] = ProvisionedThroughput
+            args['ProvisionedThroughput'] = {'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1,}
         table = self.dbr.create_table(
             TableName=self.__TableName__,
             KeySchema=[
                 {'AttributeName': 'TaskId', 'KeyType': 'HASH',},
             ],
-            AttributeDefinitions=[
-                {'AttributeName': 'TaskId', 'AttributeType': 'S',},
-                {'AttributeName': 'InstanceId', 'AttributeType': 'S',},
-                {'AttributeName': 'ServiceName', 'AttributeType': 'S',},
-                {'AttributeName': 'CurrentStatus', 'AttributeType': 'S',},
-            ],
-            GlobalSecondaryIndexes=GlobalSecondaryIndexes,
+            AttributeDefinitions=self.attributeDefinitions(),
+            GlobalSecondaryIndexes=self.globalSecondaryIndexes(),
             BillingMode='PAY_PER_REQUEST',
             **args
         )
         table.wait_until_exists()
+        self.enableTTL()
         return table
 
+    def enableTTL(self):
+        """
+        Have DynamoDB delete the tasks once their ExpiresAt has passed.
+        """
+        try:
+            response = self.dbc.describe_time_to_live(TableName=self.__TableName__)
+            if response['TimeToLiveDescription'].get('TimeToLiveStatus') in ('ENABLED', 'ENABLING'):
+                return
+            self.dbc.update_time_to_live(
+                TableName=self.__TableName__,
+                TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'ExpiresAt',},
+            )
+            app_log.info("Enabled the ExpiresAt TTL on %s" % self.__TableName__)
+        except exceptions.ClientError, exc:
+            app_log.warn("Unable to enable the TTL on %s: %s" % (self.__TableName__, exc))
+
+    def waitForIndex(self, name, delay=5, timeout=1800):
+        """
+        Wait for the index being created to become ACTIVE, raising ValueError
+        if it isn't within timeout seconds.
+        """
+        deadline = time.time() + timeout
+        while True:
+            table = self.dbc.describe_table(TableName=self.__TableName__)['Table']
+            for index in table.get('GlobalSecondaryIndexes', []):
+                if index['IndexName'] == name and index['IndexStatus'] == 'ACTIVE':
+                    return
+            if time.time() >= deadline:
+                raise ValueError("Index %s is not ACTIVE after %ds" % (name, timeout))
+            time.sleep(delay)
+
+    def missingIndexes(self):
+        """
+        Return the definitions of the indexes the table does not have.
+        """
+        table = self.dbc.describe_table(TableName=self.__TableName__)['Table']
+        existing = set(index['IndexName'] for index in table.get('GlobalSecondaryIndexes', []))
+        return [
+            index for index in self.globalSecondaryIndexes()
+            if index['IndexName'] not in existing
+        ]
+
+    def migrate(self):
+        """
+        Bring a table created by an earlier overseer up to date: create the
+        indexes it is missing, one at a time as DynamoDB requires, and enable
+        the TTL. Existing tasks are given the Active or ExpiresAt they would
+        have had.
+
+        This is run once with main.py --migrate rather than by every overseer
+        as it starts. Should another migration be creating the same index, we
+        wait for theirs instead.
+        """
+        missing = self.missingIndexes()
+        for index in missing:
+            app_log.info("Creating index %s on %s" % (index['IndexName'], self.__TableName__))
+            try:
+                self.dbc.update_table(
+                    TableName=self.__TableName__,
+                    AttributeDefinitions=self.attributeDefinitions(
+                        [key['AttributeName'] for key in index['KeySchema']]
+                    ),
+                    GlobalSecondaryIndexUpdates=[{'Create': index},],
+                )
+            except exceptions.ClientError, exc:
+                if index['IndexName'] in [each['IndexName'] for each in self.missingIndexes()]:
+                    raise
+                app_log.warn("Index %s is already being created: %s" % (index['IndexName'], exc))
+            self.waitForIndex(index['IndexName'])
+        self.enableTTL()
+        if 'ActiveTasks' in [index['IndexName'] for index in missing]:
+            self.backfill()
+
+    def backfill(self):
+        """
+        Set the Active or ExpiresAt of every task, by the one scan of the
+        table a migration needs.
+        """
+        table = self.dbr.Table(self.__TableName__)
+        args = {
+            'ProjectionExpression': '#k, #s',
+            'ExpressionAttributeNames': {'#k': 'TaskId', '#s': 'CurrentStatus',},
+        }
+        count = 0
+        while True:
+            response = table.scan(**args)
+            for item in response.get('Items', []):
+                if item.get('CurrentStatus'):
+                    table.update_item(**self.updateArgs(
+                        item['TaskId'], CurrentStatus=item['CurrentStatus'],
+                    ))
+                    count += 1
+            if 'LastEvaluatedKey' not in response:
+                break
+            args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        app_log.info("Backfilled Active and ExpiresAt on %d tasks" % count)
+
+    def lifecycle(self, status):
+        """
+        Return the attributes to set and those to remove for a task entering
+        the status, keeping it in the ActiveTasks index until it terminates
+        and then setting when it expires.
+        """
+        if status == 'terminated':
+            return {'ExpiresAt': int(time.time() + self.__Retention__)}, ['Active']
+        return {'Active': '1'}, ['ExpiresAt']
+
+    @invalidates
     def newService(self, data):
         """
         Create a new service mapping and return the new service key.
         """
+        data = dict(data)
+        data.update(self.lifecycle(data.get('CurrentStatus'))[0])
         response = self.table.put_item(Item=data, ReturnValues='ALL_OLD')
         if response['ResponseMetadata']['HTTPStatusCode'] != 200:
             raise ValueError("Failed to run newService.")
@@ -194,32 +556,63 @@ class AWSAPI(object):
             app_log.warn("newService updated an existing service.")
         app_log.info("newService.response: %s" % response)
 
-    def listServices(self, instanceId=None, status=None):
+    def servicesQuery(self, instanceId=None, status=None):
         """
-        List the current services offered by this instance.
+        Return the table operation listing the services and its arguments.
         """
-        keycond = filterexp = ''
         if instanceId:
             keycond = Key('InstanceId').eq(instanceId)
             if status and status != 'all':
                 keycond &= Key('CurrentStatus').eq(status)
-            response = self.table.query(
-                IndexName='TasksByInstanceStatus', KeyConditionExpression=keycond,
-            )
+            return self.table.query, {
+                'IndexName': 'TasksByInstanceStatus', 'KeyConditionExpression': keycond,
+            }
         elif status == 'all':
-            response = self.table.scan()
+            return self.table.scan, {}
+        elif status:
+            return self.table.query, {
+                'IndexName': 'TasksByStatus',
+                'KeyConditionExpression': Key('CurrentStatus').eq(status),
+            }
         else:
-            if status:
-                filterexp = Attr('CurrentStatus').eq(status)
-            else:
-                filterexp = Attr('CurrentStatus').ne('terminated')
-            response = self.table.scan(
-                IndexName='TasksByInstanceStatus', FilterExpression=filterexp,
-            )
-        app_log.info("listServices.response: %s" % response)
+            return self.table.query, {
+                'IndexName': 'ActiveTasks', 'KeyConditionExpression': Key('Active').eq('1'),
+            }
+
+    @cached
+    def listServices(self, instanceId=None, status=None):
+        """
+        List the current services offered by this instance, every page of
+        them.
+        """
+        operation, args = self.servicesQuery(instanceId, status)
+        items, pages = [], 0
+        while True:
+            response = operation(**args)
+            items.extend(response.get('Items', []))
+            pages += 1
+            if 'LastEvaluatedKey' not in response:
+                break
+            args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        app_log.info("listServices: %d services in %d pages" % (len(items), pages))
         # TODO: store the capacity units consumed.
-        return response.get('Items', [])
+        return items
 
+    @cached
+    def pageServices(self, instanceId=None, status=None, limit=100, cursor=None):
+        """
+        Return a page of up to limit services, starting from the cursor, and
+        the cursor of the next page, None after the last.
+        """
+        operation, args = self.servicesQuery(instanceId, status)
+        args['Limit'] = limit
+        if cursor:
+            args['ExclusiveStartKey'] = decodeCursor(cursor)
+        response = operation(**args)
+        app_log.info("pageServices: %d services" % len(response.get('Items', [])))
+        return response.get('Items', []), encodeCursor(response.get('LastEvaluatedKey'))
+
+    @cached
     def getTask(self, taskId):
         """
         Collect a specific service.
@@ -229,49 +622,47 @@ class AWSAPI(object):
         # Could probably store the CapacityUnits.
         return result.get('Item')
 
+    @cached
     def getTaskByHostname(self, hostname, instanceId=None, status='running'):
         """
         """
-        keycond = filterexp = ''
+        args = {}
+        keycond = Key('Hostname').eq(hostname)
+        if status and status != 'all':
+            keycond &= Key('CurrentStatus').eq(status)
+        elif not status:
+            args['FilterExpression'] = Attr('CurrentStatus').ne('terminated')
         if instanceId:
-            keycond = Key('InstanceId').eq(instanceId)
-            if status and status != 'all':
-                keycond &= Key('CurrentStatus').eq(status)
-            filterexp = Attr('Hostname').eq(hostname)
-            response = self.table.query(
-                IndexName='TasksByInstanceStatus', 
-                KeyConditionExpression=keycond,
-                FilterExpression=filterexp,
-            )
-        else:
-            filterexp = Attr('Hostname').eq(hostname)
-            if status:
-                filterexp &= Attr('CurrentStatus').eq(status)
-            else:
-                filterexp &= Attr('CurrentStatus').ne('terminated')
-            response = self.table.scan(
-                IndexName='TasksByInstanceStatus', FilterExpression=filterexp,
-            )
+            filterexp = Attr('InstanceId').eq(instanceId)
+            if 'FilterExpression' in args:
+                filterexp &= args['FilterExpression']
+            args['FilterExpression'] = filterexp
+        response = self.table.query(
+            IndexName='TasksByHostname', KeyConditionExpression=keycond, **args
+        )
         app_log.info("getTaskByHostname.response: %s" % response)
         # TODO: store the capacity units consumed.
         return response.get('Items', [])
 
+    @cached
     def getService(self, serviceName, instanceId=None, status='running'):
         """
         Get a list of tasks running the requested service. Optionally limit to
         the specified Instance/Node.
         """
         keycond = Key('CurrentStatus').eq(status) & Key('ServiceName').eq(serviceName)
+        args = {}
         if instanceId:
-            filterexp = Attr('InstanceId').eq(instanceId)
+            args['FilterExpression'] = Attr('InstanceId').eq(instanceId)
         response = self.table.query(
             IndexName='TasksByServiceName',
             KeyConditionExpression=keycond,
-            FilterExpression=filterexp,
+            **args
         )
         app_log.info('getService.response: %s' % response)
         return response.get('Items', [])
 
+    @invalidates
     def deleteService(self, taskId):
         """
         Remove a service.
@@ -280,6 +671,7 @@ class AWSAPI(object):
         if response['ResponseMetadata']['HTTPStatusCode'] != 200:
             raise ValueError('Service not registered.')
 
+    @invalidates
     def clean(self):
         """
         Remove all services.
@@ -292,11 +684,25 @@ class AWSAPI(object):
             for each in scan['Items']:
                 batch.delete_item(Key=each)
 
-    def updateService(self, taskId, **kwargs):
+    def updateArgs(self, taskId, **kwargs):
         """
-        Update the service.
+        Return the update_item arguments updating the service with kwargs:
+        strings are set, lists appended to and numbers added. A change of
+        CurrentStatus also sets or removes the Active and ExpiresAt
+        attributes, see lifecycle().
         """
-        exp, vals, para, attrs = [], {}, 'a', {}
+        exp, vals, para, attrs, remove = [], {}, 'a', {}, []
+        if 'CurrentStatus' in kwargs:
+            sets, removes = self.lifecycle(kwargs['CurrentStatus'])
+            for name, value in sets.iteritems():
+                exp.append('#%s = :%s' % (para, para))
+                vals[':%s' % para] = value
+                attrs['#%s' % para] = name
+                para = chr(ord(para)+1)
+            for name in removes:
+                remove.append('#%s' % para)
+                attrs['#%s' % para] = name
+                para = chr(ord(para)+1)
         for name, value in kwargs.iteritems():
             if isinstance(value, basestring):
                 exp.append('#%s = :%s' % (para, para))
@@ -310,25 +716,275 @@ class AWSAPI(object):
             vals[':%s' % para] = value
             attrs['#%s' % para] = name
             para = chr(ord(para)+1)
-        response = self.table.update_item(
+        return dict(
             Key={'TaskId': taskId},
             ConditionExpression=Attr('TaskId').eq(taskId),
-            UpdateExpression='SET ' + ', '.join(exp),
+            UpdateExpression='SET ' + ', '.join(exp) + (remove and ' REMOVE ' + ', '.join(remove) or ''),
             ExpressionAttributeValues=vals,
             ExpressionAttributeNames=attrs,
             ReturnValues='UPDATED_NEW',
         )
+
+    @invalidates
+    def updateService(self, taskId, **kwargs):
+        """
+        Update the service.
+        """
+        response = self.table.update_item(**self.updateArgs(taskId, **kwargs))
         if response['ResponseMetadata']['HTTPStatusCode'] != 200:
             raise ValueError('Service not registered.')
 
+    @invalidates
+    def writeServices(self, items, updates, chunk=25):
+        """
+        Register the items with BatchWriteItem and make the updates, a list of
+        (taskId, kwargs) for updateService, with TransactWriteItems, chunk of
+        each at a time. Return the error of each item and each update, a
+        (code, message) or None once written.
+
+        A chunk failing unexpectedly fails its own items or updates, not those
+        of the other chunks.
+        """
+        itemErrors, updateErrors = [], []
+        for method, writes, errors in (
+                (self.putChunk, items, itemErrors), (self.transactChunk, updates, updateErrors)):
+            for start in xrange(0, len(writes), chunk):
+                part = writes[start:start + chunk]
+                try:
+                    errors.extend(method(part))
+                except Exception, exc:
+                    app_log.exception("Failed to write %d services" % len(part))
+                    errors.extend([(None, str(exc))] * len(part))
+        return itemErrors, updateErrors
+
+    def putChunk(self, items):
+        """
+        Write the items, one BatchWriteItem and its retries of the unprocessed
+        items. Should DynamoDB reject the batch, eg. for one invalid item, each
+        item is written on its own to report its error.
+        """
+        try:
+            with self.table.batch_writer(overwrite_by_pkeys=['TaskId']) as batch:
+                for item in items:
+                    data = dict(item)
+                    data.update(self.lifecycle(data.get('CurrentStatus'))[0])
+                    batch.put_item(Item=data)
+        except exceptions.ClientError, exc:
+            app_log.warn("Writing %d services one at a time: %s" % (len(items), exc))
+            return [self.putItem(item) for item in items]
+        return [None] * len(items)
+
+    def putItem(self, item):
+        """
+        Write an item with PutItem, returning its error or None.
+        """
+        data = dict(item)
+        data.update(self.lifecycle(data.get('CurrentStatus'))[0])
+        try:
+            self.table.put_item(Item=data)
+        except exceptions.ClientError, exc:
+            return (exc.response['Error'].get('Code'), exc.response['Error'].get('Message'))
+        return None
+
+    def transactChunk(self, updates):
+        """
+        Make the updates in one transaction. A cancelled transaction makes
+        none of them, so those that failed, eg. for a task not registered,
+        are dropped and the rest tried again.
+        """
+        serializer = TypeSerializer()
+        errors = [None] * len(updates)
+        pending = range(len(updates))
+        while pending:
+            transaction = []
+            for index in pending:
+                taskId, kwargs = updates[index]
+                args = self.updateArgs(taskId, **kwargs)
+                transaction.append({'Update': {
+                    'TableName': self.__TableName__,
+                    'Key': {'TaskId': serializer.serialize(taskId)},
+                    'UpdateExpression': args['UpdateExpression'],
+                    'ConditionExpression': 'attribute_exists(#key)',
+                    'ExpressionAttributeNames': dict(
+                        args['ExpressionAttributeNames'], **{'#key': 'TaskId'}
+                    ),
+                    'ExpressionAttributeValues': dict(
+                        (name, serializer.serialize(value))
+                        for name, value in args['ExpressionAttributeValues'].iteritems()
+                    ),
+                }})
+            try:
+                self.dbc.transact_write_items(TransactItems=transaction)
+                return errors
+            except exceptions.ClientError, exc:
+                reasons = exc.response.get('CancellationReasons') or []
+                failed = [
+                    (index, reason) for index, reason in zip(pending, reasons)
+                    if reason.get('Code', 'None') != 'None'
+                ]
+                if not failed:
+                    error = (exc.response['Error'].get('Code'), exc.response['Error'].get('Message'))
+                    for index in pending:
+                        errors[index] = error
+                    return errors
+                for index, reason in failed:
+                    errors[index] = (reason['Code'], reason.get('Message', reason['Code']))
+                pending = [index for index in pending if errors[index] is None]
+        return errors
+
+
+class Overloaded(Exception):
+    """
+    Raised when too many AWSAPI calls are already waiting for a thread.
+    """
+
+
+class AsyncAWSAPI(object):
+    """
+    Run the AWSAPI calls on a bounded pool of threads so a slow DynamoDB round
+    trip never blocks the IOLoop, and with it every other handler and the jLog
+    websockets. Each method returns a Future of the AWSAPI method's result.
+
+    At most max_workers calls run at once and up to max_pending more wait for
+    a thread. A call that cannot get a place within queue_timeout seconds
+    raises Overloaded.
+
+    A call not finished within the timeout of its operation, see __timeouts__,
+    raises gen.TimeoutError. Its thread carries on until boto3 gives up and
+    keeps its place until then, so a DynamoDB outage fills the pool and the
+    calls after it are rejected rather than queued without bound.
+
+    Given a metrics.Aggregator, each operation's calls and milliseconds, and
+    the calls rejected and timed out, are sent to /metrics as services.*.
+    """
+    __timeouts__ = {
+        'newService': 5,
+        'updateService': 5,
+        'deleteService': 5,
+        'getTask': 5,
+        'getService': 5,
+        'getTaskByHostname': 10,
+        'listServices': 30,
+        'pageServices': 5,
+        'writeServices': 30,
+    }
+
+    def __init__(self, api, max_workers=8, max_pending=32, queue_timeout=1, timeouts=None,
+            aggregator=None):
+        self.api = api
+        self.aggregator = aggregator
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.places = locks.Semaphore(max_workers + max_pending)
+        self.queue_timeout = queue_timeout
+        self.timeouts = dict(self.__timeouts__, **(timeouts or {}))
+        self.calls = self.rejected = self.timedout = 0
+
+    @property
+    def instanceId(self):
+        return self.api.instanceId
+
+    @gen.coroutine
+    def call(self, operation, *args, **kwargs):
+        """
+        Run the AWSAPI operation on the pool.
+        """
+        try:
+            yield self.places.acquire(timedelta(seconds=self.queue_timeout))
+        except gen.TimeoutError:
+            self.rejected += 1
+            self.record('services.rejected')
+            raise Overloaded("Too many requests waiting for %s." % operation)
+        self.calls += 1
+        started = time.time()
+        future = self.executor.submit(getattr(self.api, operation), *args, **kwargs)
+        IOLoop.current().add_future(future, lambda future: self.finished(operation, started))
+        try:
+            result = yield gen.with_timeout(
+                timedelta(seconds=self.timeouts[operation]), future,
+            )
+        except gen.TimeoutError:
+            self.timedout += 1
+            self.record('services.timedout')
+            app_log.warn("%s did not finish within %ss." % (operation, self.timeouts[operation]))
+            raise
+        raise gen.Return(result)
+
+    def finished(self, operation, started):
+        """
+        Give the place of a call that has finished back to the pool.
+        """
+        self.places.release()
+        if self.aggregator:
+            self.aggregator.increment('services.%s' % operation)
+            self.aggregator.observe('services.%s.ms' % operation, (time.time() - started) * 1000)
+
+    def record(self, name):
+        if self.aggregator:
+            self.aggregator.increment(name)
+
+    def newService(self, data):
+        return self.call('newService', data)
+
+    def listServices(self, instanceId=None, status=None):
+        return self.call('listServices', instanceId=instanceId, status=status)
+
+    def pageServices(self, instanceId=None, status=None, limit=100, cursor=None):
+        return self.call(
+            'pageServices', instanceId=instanceId, status=status, limit=limit, cursor=cursor,
+        )
+
+    def getTask(self, taskId):
+        return self.call('getTask', taskId)
+
+    def getTaskByHostname(self, hostname, instanceId=None, status='running'):
+        return self.call('getTaskByHostname', hostname, instanceId=instanceId, status=status)
+
+    def getService(self, serviceName, instanceId=None, status='running'):
+        return self.call('getService', serviceName, instanceId=instanceId, status=status)
+
+    def deleteService(self, taskId):
+        return self.call('deleteService', taskId)
+
+    def updateService(self, taskId, **kwargs):
+        return self.call('updateService', taskId, **kwargs)
+
+    def writeServices(self, items, updates, chunk=25):
+        return self.call('writeServices', items, updates, chunk=chunk)
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'rejected': self.rejected,
+            'timedout': self.timedout,
+            'cache': self.api.cache.stats(),
+        }
+
 
 class AWSBase(web.RequestHandler):
     """
-    Base request handler providing the AWS API.
+    Base request handler providing the AWS API, an AsyncAWSAPI.
     """
     def initialize(self, awsapi):
         self.api = awsapi
 
+    @gen.coroutine
+    def call(self, operation, *args, **kwargs):
+        """
+        Return the result of the AWSAPI operation, failing the request with a
+        503 if the pool is overloaded or a 504 if it took too long.
+        """
+        try:
+            result = yield getattr(self.api, operation)(*args, **kwargs)
+        except Overloaded, exc:
+            raise web.HTTPError(503, reason=exc.args[0])
+        except gen.TimeoutError:
+            raise web.HTTPError(504, reason='Timed out waiting for %s.' % operation)
+        raise gen.Return(result)
+
+    def write_error(self, status_code, **kwargs):
+        response = {'metadata': {'status': status_code, 'message': self._reason,},}
+        self.finish(JSONEncoder().encode(response))
+
 
 class RegisterHandler(AWSBase):
     """
@@ -340,6 +996,7 @@ class RegisterHandler(AWSBase):
         'TaskId',
     )
 
+    @gen.coroutine
     def get(self):
         """
         Post a new service registration
@@ -356,13 +1013,7 @@ class RegisterHandler(AWSBase):
                 {'status': 400, 'message': 'Missing arguments: %s' % ', '.join(missing),}
             )
         else:
-            now = DateTime.now().Format('%Y-%m-%d %H:%M:%S')
-            data['Status'] = [{'Status': 'starting', 'Date': now, 'Message': 'Registration.'},]
-            data['CreatedOn'] = now
-            data['LastStatusChangedOn'] = now
-            data['CurrentStatus'] = 'starting'
-            data['InstanceId'] = self.api.instanceId
-            self.api.newService(data)
+            yield self.call('newService', registration(data, self.api.instanceId))
             response['metadata']['status'] = 200
         self.write(JSONEncoder().encode(response))
 
@@ -373,21 +1024,16 @@ class StatusHandler(AWSBase):
     """
     __fields__ = ('Status', 'Message',)
 
+    @gen.coroutine
     def get(self):
         response = { 'metadata': {}, }
         taskId = self.get_argument('TaskId')
         data = {}
         for field in self.__fields__:
             data[field] = self.get_argument(field)
-        data['Date'] = DateTime.now().Format('%Y-%m-%d %H:%M:%S')
-        CurrentStatus = data['Status']
-        LastStatusChangedOn = data['Date']
         try:
-            self.api.updateService(
-                taskId, 
-                CurrentStatus=CurrentStatus, 
-                LastStatusChangedOn=LastStatusChangedOn,
-                Status=[data,]
+            yield self.call(
+                'updateService', taskId, **statusChange(data['Status'], data['Message'])
             )
         except ValueError, exc:
             response['metadata'].update({'status': 500, 'message': exc.args[0],})
@@ -396,10 +1042,134 @@ class StatusHandler(AWSBase):
         self.write(JSONEncoder().encode(response))
 
 
+class BatchHandler(AWSBase):
+    """
+    Make many registrations and status changes in one request, eg. those a
+    container queued while it booted. POST a JSON body of the operations:
+
+        {"operations": [
+            {"op": "register", "ContainerId": ..., "TaskId": ..., ...},
+            {"op": "status", "TaskId": ..., "Status": ..., "Message": ...},
+        ]}
+
+    each optionally with the Date it happened. The fields are strings, numbers
+    are taken as their string like the query arguments of /services/register
+    and /services/status. The response has the result of each operation in
+    order, its status 200 once made, or 400 for an invalid one.
+
+    Registrations are written with BatchWriteItem and status changes with
+    TransactWriteItems, __chunk__ at a time. The status changes of a task are
+    merged into one update, or into its registration when that is in the same
+    request, as a transaction may only write a task once, so they share its
+    result.
+    """
+    __maxOperations__ = 500
+    __chunk__ = 25
+    # A message of None is DynamoDB's own
+    __errors__ = {
+        'ConditionalCheckFailed': (404, 'Service not registered.'),
+        'ValidationException': (400, None),
+    }
+
+    @gen.coroutine
+    def post(self):
+        try:
+            operations = json.loads(self.request.body)['operations']
+        except (ValueError, KeyError, TypeError):
+            raise web.HTTPError(400, reason='Expected a JSON object of operations.')
+        if not isinstance(operations, list) or len(operations) > self.__maxOperations__:
+            raise web.HTTPError(
+                400, reason='Expected a list of up to %d operations.' % self.__maxOperations__,
+            )
+        results = [None] * len(operations)
+        # The registrations and the updates of each task, and the operations
+        # each one is the result of.
+        items, updates, writes = collections.OrderedDict(), collections.OrderedDict(), {}
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                results[index] = {'status': 400, 'message': 'Expected an object.'}
+                continue
+            if operation.get('op') == 'register':
+                fields = RegisterHandler.__fields__
+            elif operation.get('op') == 'status':
+                fields = ('TaskId',) + StatusHandler.__fields__
+            else:
+                results[index] = {'status': 400, 'message': 'Unknown op: %s' % operation.get('op')}
+                continue
+            data, missing, invalid = {}, [], []
+            for field in fields + ('Date',):
+                value = operation.get(field)
+                if isinstance(value, basestring) or (
+                        isinstance(value, (int, long, float)) and not isinstance(value, bool)):
+                    data[field] = unicode(value)
+                elif value is not None:
+                    invalid.append(field)
+                elif field != 'Date':
+                    missing.append(field)
+            if missing or invalid:
+                results[index] = {'status': 400, 'message': '; '.join(
+                    '%s: %s' % (label, ', '.join(names)) for label, names in (
+                        ('Missing arguments', missing), ('Expected a string', invalid))
+                    if names
+                )}
+                continue
+            taskId = data['TaskId']
+            date = data.pop('Date', None)
+            if operation['op'] == 'register':
+                items[taskId] = registration(data, self.api.instanceId, date)
+                writes.setdefault(('item', taskId), []).append(index)
+                continue
+            change = statusChange(data['Status'], data['Message'], date)
+            if taskId in items:
+                mergeStatus(items[taskId], change)
+                writes[('item', taskId)].append(index)
+            elif taskId in updates:
+                mergeStatus(updates[taskId], change)
+                writes[('update', taskId)].append(index)
+            else:
+                updates[taskId] = change
+                writes[('update', taskId)] = [index]
+        if items or updates:
+            itemErrors, updateErrors = yield self.call(
+                'writeServices', items.values(), updates.items(), self.__chunk__,
+            )
+            for kind, taskIds, errors in (
+                    ('item', items.keys(), itemErrors), ('update', updates.keys(), updateErrors)):
+                for taskId, error in zip(taskIds, errors):
+                    if error is None:
+                        result = {'status': 200}
+                    else:
+                        status, message = self.__errors__.get(error[0], (500, None))
+                        result = {'status': status, 'message': message or error[1]}
+                    for index in writes[(kind, taskId)]:
+                        results[index] = result
+        response = {
+            'metadata': {'status': 200,},
+            'results': results,
+            'count': sum(1 for result in results if result['status'] == 200),
+        }
+        self.write(JSONEncoder().encode(response))
+
+
 class ServicesListHandler(AWSBase):
     """
     Get a list of registered services.
+        - status: only services in this status, all or by default those not
+          terminated.
+        - InstanceId: only services on this Instance, this for our own.
+        - limit: return a page of up to limit services and the cursor of the
+          next page, null after the last.
+        - cursor: the page to return, the cursor of the previous page.
+        - stream: send every service, from the cursor on, as a chunked JSON
+          response fetched a page of limit services at a time.
+
+    An error part way through a stream closes the connection, leaving the
+    JSON incomplete.
     """
+    __pageSize__ = 100
+    __maxLimit__ = 1000
+
+    @gen.coroutine
     def get(self):
         """
         Return a list of existing services.
@@ -408,13 +1178,57 @@ class ServicesListHandler(AWSBase):
         instanceId = self.get_argument('InstanceId', None)
         if instanceId == 'this':
             instanceId = self.api.instanceId
-        services = self.api.listServices(instanceId=instanceId, status=status)
-        response = {
-            'metadata': {'status': 200,},
-            'services': services,
-        }
+        cursor = self.get_argument('cursor', None)
+        try:
+            limit = self.get_argument('limit', None)
+            limit = limit is not None and int(limit)
+            if cursor:
+                decodeCursor(cursor)
+        except ValueError:
+            raise web.HTTPError(400, reason='Invalid limit or cursor.')
+        # No limit at all is every service, a limit of 0 is a mistake
+        if limit is not False and not 1 <= limit <= self.__maxLimit__:
+            raise web.HTTPError(400, reason='The limit must be 1 to %d.' % self.__maxLimit__)
+        if self.get_argument('stream', 'false').lower() in ('1', 'true', 'yes'):
+            yield self.stream(instanceId, status, limit or self.__pageSize__, cursor)
+            return
+        if limit or cursor:
+            services, cursor = yield self.call(
+                'pageServices', instanceId, status, limit or self.__pageSize__, cursor,
+            )
+            response = {
+                'metadata': {'status': 200,},
+                'services': services,
+                'cursor': cursor,
+            }
+        else:
+            services = yield self.call('listServices', instanceId=instanceId, status=status)
+            response = {
+                'metadata': {'status': 200,},
+                'services': services,
+            }
         self.write(JSONEncoder().encode(response))
 
+    @gen.coroutine
+    def stream(self, instanceId, status, limit, cursor):
+        """
+        Write the services a page at a time, flushing each so only the one
+        page is ever held.
+        """
+        encoder = JSONEncoder()
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write('{"metadata": {"status": 200}, "services": [')
+        count = 0
+        while True:
+            services, cursor = yield self.call('pageServices', instanceId, status, limit, cursor)
+            for service in services:
+                self.write((count and ', ' or '') + encoder.encode(service))
+                count += 1
+            yield self.flush()
+            if cursor is None:
+                break
+        self.write('], "count": %d}' % count)
+
 
 class ServicesHandler(AWSBase):
     """
@@ -433,10 +1247,11 @@ class GetServiceHandler(AWSBase):
         - ServiceName: the name of the service wanted.
         - InstanceId: limit to tasks running the service on these Instances.
     """
+    @gen.coroutine
     def get(self):
         serviceName = self.get_argument('ServiceName')
         instanceId = self.get_argument('InstanceId', self.api.instanceId)
-        services = self.api.getService(serviceName, instanceId)
+        services = yield self.call('getService', serviceName, instanceId)
         response = {
             'metadata': {'status': 200,},
             'services': services,
@@ -449,10 +1264,11 @@ class GetTaskByHostHandler(AWSBase):
     """
     Request a specific task based on its hostname.
     """
+    @gen.coroutine
     def get(self):
         hostname = self.get_argument('Hostname')
         instanceId = self.get_argument('InstanceId', self.api.instanceId)
-        tasks = self.api.getTaskByHostname(serviceName, instanceId)
+        tasks = yield self.call('getTaskByHostname', hostname, instanceId)
         response = {
             'metadata': {'status': 200,},
             'tasks': tasks,
@@ -461,6 +1277,19 @@ class GetTaskByHostHandler(AWSBase):
         self.write(JSONEncoder().encode(response))
 
 
+class StatsHandler(AWSBase):
+    """
+    Report the calls made, rejected and timed out by the AsyncAWSAPI and how
+    well the query cache is doing.
+    """
+    def get(self):
+        response = {
+            'metadata': {'status': 200,},
+            'stats': self.api.stats(),
+        }
+        self.write(JSONEncoder().encode(response))
+
+
 class ShutdownHandler(AWSBase):
     """
     Shutdown all running containers on this Node/Instance.
@@ -484,14 +1313,16 @@ def getHandlers():
     """
     Return the handlers provided by this module.
     """
-    awsapi = AWSAPI()
+    awsapi = AsyncAWSAPI(AWSAPI(), aggregator=metrics.Aggregator('auto'))
     return [
         (r'/services', ServicesHandler, dict(awsapi=awsapi)),
         (r'/services/register', RegisterHandler, dict(awsapi=awsapi)),
         (r'/services/status', StatusHandler, dict(awsapi=awsapi)),
+        (r'/services/batch', BatchHandler, dict(awsapi=awsapi)),
         (r'/services/list', ServicesListHandler, dict(awsapi=awsapi)),
         (r'/services/get', GetServiceHandler, dict(awsapi=awsapi)),
         (r'/services/tasks', GetTaskByHostHandler, dict(awsapi=awsapi)),
+        (r'/services/stats', StatsHandler, dict(awsapi=awsapi)),
         (r'/services/shutdown', ShutdownHandler),
     ]
 
@@ -21,62 +21,73 @@ Connections:
 
 import zmq
 from tornado import web
-from sockjs.tornado import SockJSRouter, SockJSConnection
+from tornado.ioloop import PeriodicCallback
+from sockjs.tornado import SockJSRouter, SockJSConnection, proto
 from zmq.eventloop.zmqstream import ZMQStream
 
+from jLog import ClientQueue
+import subscribers
 
 
 class ZMQSubscriber(object):
     """
-    This class represents a subscriber socket connecting to a ZMQ Service.
-    """
-    clients = set()
-    stream = None
+    This class represents a subscriber to a ZMQ Service, listening through the
+    shared subscriber for the url while it has clients.
 
-    def __init__(self, url, topics=None):
+    Each client has a bounded ClientQueue flushed every coalesce_ms, so a
+    stalled client skips messages rather than growing its session.
+    """
+    def __init__(self, url, topics=None, coalesce_ms=100):
         self.url = url
         self.topics = topics
+        self.coalesce_ms = coalesce_ms
+        self.flusher = None
+        # The connected clients and their queues
+        self.clients = {}
+        # The sequence number of the last message received
+        self.head = 0
 
     def setup(self):
         """
-        Setup the subscriber connection on first use.
+        Listen for messages when the first client joins.
         """
-        print "Connecting to publisher: %s" % self.url
-        ctxt = zmq.Context()
-        subscriber = ctxt.socket(zmq.SUB)
-        subscriber.connect(self.url)
-        if self.topics:
-            for topic in self.topics:
-                subscriber.setsockopt(zmq.SUBSCRIBE, topic)
-        else:
-            subscriber.setsockopt(zmq.SUBSCRIBE, '')
-        self.stream = ZMQStream(subscriber)
-        self.stream.on_recv(self.on_recv_sub)
+        subscribers.subscribe(self.url, self.on_recv_sub, self.topics)
+        self.flusher = PeriodicCallback(self.flush, self.coalesce_ms)
+        self.flusher.start()
 
     def add(self, client):
         """
         Add a new participant, setup on first access.
         """
-        if self.stream is None:
+        if not self.clients:
             self.setup()
-        self.clients.add(client)
+        self.clients[client] = ClientQueue(client)
 
     def remove(self, client):
         """
-        Remove a participant, possibly disconnect when empty.
+        Remove a participant, stop listening when the last one leaves.
         """
-        self.clients.remove(client)
+        if self.clients.pop(client, None) is None:
+            return
         if len(self.clients) == 0:
-            print "Possibly close connection."
+            subscribers.unsubscribe(self.url, self.on_recv_sub, self.topics)
+            self.flusher.stop()
 
     def on_recv_sub(self, message):
         """
-        Send the message to all clients connected.
+        Queue the message for all clients connected.
+        """
+        self.head += 1
+        payload = proto.json_encode(message)
+        for queue in self.clients.itervalues():
+            queue.put(payload, self.head)
+
+    def flush(self):
+        """
+        Send each client the messages queued since the last flush.
         """
-        print "Got a message:", message
-        for conn in self.clients:
-            conn.broadcast(self.clients, message)
-            break
+        for queue in self.clients.values():
+            queue.flush()
 
 
 class LoggerConnection(SockJSConnection):
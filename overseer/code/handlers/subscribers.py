@@ -0,0 +1,140 @@
+"""
+The ZMQ subscriber sockets shared by the SockJS routers.
+
+Every router wanting messages from an upstream publisher listens through the
+one SharedSubscriber for its uri and topics, so there is a single SUB socket
+per upstream in the one process wide zmq.Context.instance().
+
+A SharedSubscriber connects when its first listener subscribes and closes its
+socket idle_timeout seconds after the last listener leaves, unless another
+listener arrives in the meantime. Compressed batches published by the
+upstream are unpacked here so the listeners only ever see single messages.
+
+    > subscribers.subscribe('tcp://127.0.0.1:13002', self.on_recv_sub)
+    > subscribers.unsubscribe('tcp://127.0.0.1:13002', self.on_recv_sub)
+"""
+
+import zlib
+
+import zmq
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
+from zmq.eventloop.zmqstream import ZMQStream
+
+import logwire
+
+
+class SharedSubscriber(object):
+    """
+    One SUB socket and the callbacks listening to it.
+    """
+    def __init__(self, registry, uri, topics, idle_timeout=30):
+        self.registry = registry
+        self.uri = uri
+        self.topics = topics
+        self.idle_timeout = idle_timeout
+        self.listeners = []
+        self.stream = None
+        self.idle = None
+
+    @property
+    def key(self):
+        return (self.uri, self.topics)
+
+    def connect(self):
+        """
+        Open the socket on first use.
+        """
+        app_log.info("Connecting to publisher: %s %s", self.uri, list(self.topics))
+        subscriber = zmq.Context.instance().socket(zmq.SUB)
+        subscriber.connect(self.uri)
+        for topic in self.topics:
+            subscriber.setsockopt(zmq.SUBSCRIBE, topic)
+        self.stream = ZMQStream(subscriber)
+        self.stream.on_recv(self.on_recv_sub)
+
+    def close(self):
+        """
+        Close the socket and forget the subscriber.
+        """
+        self.idle = None
+        if self.listeners:
+            return
+        if self.stream is not None:
+            app_log.info("Disconnecting from idle publisher: %s", self.uri)
+            self.stream.close(linger=0)
+            self.stream = None
+        self.registry.discard(self)
+
+    def add(self, callback):
+        """
+        Add a listener, connecting if this is the first.
+        """
+        if self.idle is not None:
+            IOLoop.current().remove_timeout(self.idle)
+            self.idle = None
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+        if self.stream is None:
+            self.connect()
+
+    def remove(self, callback):
+        """
+        Remove a listener, closing after idle_timeout if it was the last.
+        """
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+        if not self.listeners and self.idle is None:
+            self.idle = IOLoop.current().call_later(self.idle_timeout, self.close)
+
+    def on_recv_sub(self, msg):
+        """
+        Pass the message to every listener. Batches, which a broadcaster in
+        proxy mode publishes as they are, are unpacked and passed on a message
+        at a time.
+        """
+        messages = [msg]
+        if msg[0] == 'BATCH':
+            try:
+                messages = logwire.decodeBatch(msg)[1]
+            except (ValueError, zlib.error), exc:
+                app_log.warn("Dropping a batch we cannot decode: %s", exc)
+                return
+        # A listener raising out of the stream's callback would stop the
+        # socket for every listener, so carry on with the next one
+        for message in messages:
+            for callback in list(self.listeners):
+                try:
+                    callback(message)
+                except Exception:
+                    app_log.exception("A listener failed on a message from %s", self.uri)
+
+
+class SubscriberRegistry(object):
+    """
+    The SharedSubscriber of each (uri, topics).
+    """
+    def __init__(self, idle_timeout=30):
+        self.idle_timeout = idle_timeout
+        self.subscribers = {}
+
+    def get(self, uri, topics=None):
+        key = (uri, tuple(sorted(set(topics or ['']))))
+        if key not in self.subscribers:
+            self.subscribers[key] = SharedSubscriber(self, uri, key[1], self.idle_timeout)
+        return self.subscribers[key]
+
+    def discard(self, subscriber):
+        if self.subscribers.get(subscriber.key) is subscriber:
+            del self.subscribers[subscriber.key]
+
+    def subscribe(self, uri, callback, topics=None):
+        self.get(uri, topics).add(callback)
+
+    def unsubscribe(self, uri, callback, topics=None):
+        self.get(uri, topics).remove(callback)
+
+
+registry = SubscriberRegistry()
+subscribe = registry.subscribe
+unsubscribe = registry.unsubscribe
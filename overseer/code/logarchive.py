@@ -0,0 +1,267 @@
+"""
+A local archive of the jLog stream kept in append-only segment files.
+
+The archive directory holds one segment per segment_secs (an hour by default)
+named by its start time, eg. 201805011300.seg, with two companions:
+
+    - 201805011300.idx
+      The sparse time index, the (time, offset) of every index_every'th record
+      so a query can seek close to its start time.
+
+    - 201805011300.meta
+      The JSON summary of the segment: its time range and the qualnames,
+      sources and levels in it, so a query can skip whole segments.
+
+Each record in a segment is its arrival time (d), levelno (H) and the lengths
+of its qualname (H), source (H) and formatted text (I), followed by their utf-8
+bytes. The arrival time never goes backwards so the segments and index are in
+time order. Queries read the segments through mmap so files are never loaded
+whole.
+"""
+
+import bisect
+import calendar
+import json
+import mmap
+import os
+import struct
+import time
+
+
+class Segment(object):
+    """
+    The files of one time partition of the archive.
+    """
+    __record__ = struct.Struct('!dHHHI')
+    __index__ = struct.Struct('!dQ')
+    __sets__ = ('qualnames', 'sources', 'levels')
+
+    def __init__(self, directory, start):
+        self.start = start
+        self.name = time.strftime('%Y%m%d%H%M', time.gmtime(start))
+        base = os.path.join(directory, self.name)
+        self.path = base + '.seg'
+        self.index_path = base + '.idx'
+        self.meta_path = base + '.meta'
+        # The qualnames, sources and levels are sets here, lists in the file
+        self.meta = {
+            'start': start, 'first': None, 'last': None,
+            'qualnames': set(), 'sources': set(), 'levels': set(),
+        }
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as fh:
+                self.meta = json.load(fh)
+            for key in self.__sets__:
+                self.meta[key] = set(self.meta[key])
+
+    def saveMeta(self):
+        """
+        Write the summary, replacing the file so readers never see half of it.
+        """
+        meta = dict(self.meta)
+        for key in self.__sets__:
+            meta[key] = sorted(meta[key])
+        with open(self.meta_path + '.tmp', 'w') as fh:
+            json.dump(meta, fh)
+        os.rename(self.meta_path + '.tmp', self.meta_path)
+
+    def overlaps(self, since, until):
+        """
+        Return True if the segment may hold records between since and until.
+        """
+        if self.meta['first'] is None:
+            return False
+        return (since is None or self.meta['last'] >= since) and \
+            (until is None or self.meta['first'] <= until)
+
+    def mayMatch(self, qualname=None, source=None, levelno=0):
+        """
+        Return True if the summary says the segment may hold matching records.
+        """
+        if qualname and not any(
+                name.startswith(qualname) for name in self.meta['qualnames']):
+            return False
+        if source and source not in self.meta['sources']:
+            return False
+        if levelno and not any(level >= levelno for level in self.meta['levels']):
+            return False
+        return True
+
+    def seek(self, since):
+        """
+        Return the offset of the last indexed record before since.
+        """
+        if since is None or not os.path.exists(self.index_path):
+            return 0
+        with open(self.index_path, 'rb') as fh:
+            data = fh.read()
+        size = self.__index__.size
+        entries = [
+            self.__index__.unpack_from(data, offset)
+            for offset in xrange(0, len(data) - len(data) % size, size)
+        ]
+        position = bisect.bisect_left([entry[0] for entry in entries], since)
+        if position == 0:
+            return 0
+        return entries[position - 1][1]
+
+    def read(self, since=None, until=None, qualname=None, source=None, levelno=0,
+            progress=0):
+        """
+        Yield the matching (time, levelno, qualname, source, text) records, and
+        None after every progress records scanned if given.
+        """
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return
+        header = self.__record__
+        with open(self.path, 'rb') as fh:
+            data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                offset = self.seek(since)
+                end = len(data)
+                scanned = 0
+                while offset + header.size <= end:
+                    scanned += 1
+                    if progress and scanned % progress == 0:
+                        yield None
+                    created, level, nlen, slen, tlen = header.unpack_from(data, offset)
+                    start = offset + header.size
+                    offset = start + nlen + slen + tlen
+                    if offset > end:
+                        break
+                    if since is not None and created < since:
+                        continue
+                    if until is not None and created > until:
+                        break
+                    if level < levelno:
+                        continue
+                    name = data[start:start + nlen]
+                    if qualname and not name.startswith(qualname):
+                        continue
+                    src = data[start + nlen:start + nlen + slen]
+                    if source and src != source:
+                        continue
+                    yield (
+                        created, level, name, src,
+                        data[start + nlen + slen:offset].decode('utf-8', 'replace'),
+                    )
+            finally:
+                data.close()
+
+
+class SegmentStore(object):
+    """
+    Append records to the current segment and query across all of them.
+
+    Segments older than retention seconds are deleted when a new segment is
+    started.
+    """
+    def __init__(self, directory, segment_secs=3600, index_every=256,
+            retention=7 * 24 * 3600):
+        self.directory = directory
+        self.segment_secs = segment_secs
+        self.index_every = index_every
+        self.retention = retention
+        self.current = None
+        self.fh = self.index_fh = None
+        self.count = 0
+        self.last = 0.0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def segments(self):
+        """
+        Return the segments in the archive, oldest first.
+        """
+        segments = []
+        for filename in sorted(os.listdir(self.directory)):
+            if filename.endswith('.seg'):
+                start = calendar.timegm(time.strptime(filename[:-4], '%Y%m%d%H%M'))
+                if self.current and self.current.name == filename[:-4]:
+                    segments.append(self.current)
+                else:
+                    segments.append(Segment(self.directory, start))
+        return segments
+
+    def rotate(self, now):
+        """
+        Close the current segment and start the one for now.
+        """
+        self.close()
+        start = now - now % self.segment_secs
+        self.current = Segment(self.directory, start)
+        self.fh = open(self.current.path, 'ab')
+        self.index_fh = open(self.current.index_path, 'ab')
+        self.count = 0
+        self.prune(now)
+
+    def prune(self, now):
+        """
+        Delete the segments past the retention period.
+        """
+        for segment in self.segments():
+            if segment is not self.current and \
+                    segment.start + self.segment_secs < now - self.retention:
+                for path in (segment.path, segment.index_path, segment.meta_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def append(self, levelno, name, source, text, now=None):
+        """
+        Append a record to the current segment.
+        """
+        now = self.last = max(now or time.time(), self.last)
+        if self.current is None or now >= self.current.start + self.segment_secs:
+            self.rotate(now)
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        name, source = str(name), str(source)
+        if self.count % self.index_every == 0:
+            self.index_fh.write(Segment.__index__.pack(now, self.fh.tell()))
+        self.fh.write(Segment.__record__.pack(
+            now, levelno, len(name), len(source), len(text),
+        ) + name + source + text)
+        self.count += 1
+        meta = self.current.meta
+        if meta['first'] is None:
+            meta['first'] = now
+        meta['last'] = now
+        meta['qualnames'].add(name)
+        meta['sources'].add(source)
+        meta['levels'].add(levelno)
+
+    def flush(self):
+        """
+        Make what has been appended visible to queries.
+        """
+        if self.fh:
+            self.fh.flush()
+            self.index_fh.flush()
+            self.current.saveMeta()
+
+    def close(self):
+        if self.fh:
+            self.flush()
+            self.fh.close()
+            self.index_fh.close()
+            self.fh = self.index_fh = None
+
+    def query(self, since=None, until=None, qualname=None, source=None, levelno=0,
+            progress=0):
+        """
+        Yield the matching (time, levelno, qualname, source, text) records in
+        time order.
+
+        Given progress, None is yielded after every progress records scanned
+        and after every segment, so a caller on the IOLoop can let it run in
+        between however few records match.
+        """
+        self.flush()
+        for segment in self.segments():
+            if segment.overlaps(since, until) and \
+                    segment.mayMatch(qualname, source, levelno):
+                for record in segment.read(
+                        since, until, qualname, source, levelno, progress):
+                    yield record
+            if progress:
+                yield None
@@ -8,40 +8,434 @@ the log record.
 We do this instead of a PUB/SUB socket since we want all logging to go to a
 local service before being published. The jLog service runs on each node, so
 you can subscriber to the local nodes jLog to get only logs for that node.
+
+Use the QueuedPUSHHandler where logging must never block the caller, eg. the
+Tornado IOLoop of the overseer. The records are queued and sent by a thread.
+
+Records that cannot be sent go to a bounded Backlog which can spill to a file
+on local disk and is replayed periodically once the socket is writable again.
+
+Given the interest endpoint of the broadcaster the handlers skip serializing
+and sending records nobody is subscribed to, see Interest. An overseer's jLog
+subscribes to everything unless its --jlog_topics says otherwise, so records
+are only skipped by the broadcasters it is attached to when they do.
 """
 
+import collections
 import logging
+import os
+import random
+import struct
+import threading
+import time
+import traceback
 
 import zmq
-import cPickle as pickle
 import socket
 
+import endpoints
+import logwire
+
 
 myip = socket.gethostbyname(socket.gethostname())
 
 
+class Backlog(object):
+    """
+    The messages that could not be sent, oldest first.
+
+    Up to size messages are held in memory. Once that is full new messages are
+    appended to the spill file, if there is one, otherwise the oldest message
+    is dropped. The spill file is read back in as the memory drains and is
+    truncated once it is empty. Messages left in the spill file are replayed
+    on the next start.
+
+    A message is stored in the spill file as the frame count (I) followed by
+    each frame as its length (I) and bytes. A message torn by a crash while
+    it was written is truncated away on the next start.
+    """
+    __length__ = struct.Struct('!I')
+
+    def __init__(self, size=10000, spill_path=None):
+        self.size = size
+        self.spill_path = spill_path
+        self.messages = collections.deque()
+        # Messages and bytes in the spill file not yet read back
+        self.spilled = 0
+        self.spill_offset = 0
+        self.bytes_spilled = 0
+        self.dropped = 0
+        if spill_path and os.path.exists(spill_path):
+            self.spilled = self.countSpill()
+
+    def __len__(self):
+        return len(self.messages) + self.spilled
+
+    def stats(self):
+        """
+        Return the backlog depth and spill counters.
+        """
+        return {
+            'backlog': len(self),
+            'backlog_memory': len(self.messages),
+            'backlog_spilled': self.spilled,
+            'backlog_bytes_spilled': self.bytes_spilled,
+            'backlog_dropped': self.dropped,
+        }
+
+    def append(self, frames):
+        """
+        Add a message to the end of the backlog.
+        """
+        # Once spilling, keep spilling until the file is read back so the
+        # messages stay in order.
+        if len(self.messages) < self.size and not self.spilled:
+            self.messages.append(frames)
+        elif self.spill_path:
+            self.spill(frames)
+        else:
+            self.messages.popleft()
+            self.messages.append(frames)
+            self.dropped += 1
+
+    def spill(self, frames):
+        """
+        Append the message to the spill file.
+        """
+        data = [self.__length__.pack(len(frames))]
+        for frame in frames:
+            data.append(self.__length__.pack(len(frame)))
+            data.append(frame)
+        data = ''.join(data)
+        with open(self.spill_path, 'ab') as fh:
+            fh.write(data)
+        self.spilled += 1
+        self.bytes_spilled += len(data)
+
+    def readMessage(self, fh):
+        """
+        Read the next message from the spill file, None at the end or at a
+        message cut short.
+        """
+        size = self.__length__.size
+        header = fh.read(size)
+        if len(header) < size:
+            return None
+        frames = []
+        for _ in xrange(self.__length__.unpack(header)[0]):
+            header = fh.read(size)
+            if len(header) < size:
+                return None
+            length = self.__length__.unpack(header)[0]
+            frame = fh.read(length)
+            if len(frame) < length:
+                return None
+            frames.append(frame)
+        return frames
+
+    def countSpill(self):
+        """
+        Count the messages left in the spill file from a previous run, and
+        truncate it after the last whole one.
+        """
+        count = end = 0
+        with open(self.spill_path, 'r+b') as fh:
+            while self.readMessage(fh) is not None:
+                count += 1
+                end = fh.tell()
+            fh.seek(0, os.SEEK_END)
+            if fh.tell() > end:
+                print "Truncating %d bytes of a torn message from %s" % (
+                    fh.tell() - end, self.spill_path,
+                )
+                fh.truncate(end)
+        return count
+
+    def unspill(self):
+        """
+        Read the spill file back into memory.
+        """
+        with open(self.spill_path, 'rb') as fh:
+            fh.seek(self.spill_offset)
+            while self.spilled and len(self.messages) < self.size:
+                frames = self.readMessage(fh)
+                if frames is None:
+                    self.spilled = 0
+                    break
+                self.messages.append(frames)
+                self.spilled -= 1
+            self.spill_offset = fh.tell()
+        if not self.spilled:
+            open(self.spill_path, 'wb').close()
+            self.spill_offset = 0
+
+    def replay(self, send):
+        """
+        Send the backlog in order with send(frames) until it fails. Returns
+        True when the backlog is empty.
+        """
+        while self.messages or self.spilled:
+            if not self.messages:
+                self.unspill()
+                continue
+            if not send(self.messages[0]):
+                return False
+            self.messages.popleft()
+        return True
+
+
+class TokenBucket(object):
+    """
+    Allow rate records a second on average and bursts of up to burst. A rate
+    of 0 allows nothing.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        if burst is None:
+            burst = rate and max(rate, 1) or 0
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.last = time.time()
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class RecordLimiter(object):
+    """
+    Rate limit and sample records by logger and level.
+
+    The limits map a rule to the records a second allowed, or a (rate, burst)
+    tuple, and the sampling maps a rule to the fraction of records kept. A
+    rule is a logger name, applying to it and its children, optionally with a
+    level, eg.
+
+        limits = {'tornado.access': 100, 'tornado.access:DEBUG': 0}
+        sampling = {'tornado.access:INFO': 0.1}
+
+    The most specific rule matching a record applies and the loggers under a
+    rule share its bucket. The records suppressed are counted and every
+    summary_interval seconds summaries() returns a record for each logger and
+    level saying how many were suppressed, so the volume is still visible.
+    """
+    def __init__(self, limits=None, sampling=None, summary_interval=60):
+        self.limits = {}
+        for rule, limit in (limits or {}).items():
+            if not isinstance(limit, (tuple, list)):
+                limit = (limit,)
+            self.limits[rule] = TokenBucket(*limit)
+        self.sampling = dict(sampling or {})
+        self.summary_interval = summary_interval
+        self.suppressed = collections.defaultdict(lambda: [0, 0])
+        self.limited = self.sampled = 0
+        self.last_summary = time.time()
+        self.lock = threading.Lock()
+        self.random = random.Random()
+
+    @staticmethod
+    def rules(record):
+        """
+        Yield the rules that could match the record, most specific first.
+        """
+        name = record.name
+        while True:
+            yield '%s:%s' % (name, record.levelname)
+            yield name
+            if not name:
+                break
+            name = name.rpartition('.')[0]
+
+    def match(self, table, record):
+        for rule in self.rules(record):
+            if rule in table:
+                return table[rule]
+        return None
+
+    def allow(self, record):
+        """
+        Return True if the record is within its rate and sampled.
+        """
+        if getattr(record, 'suppressed_summary', False):
+            return True
+        reason = None
+        with self.lock:
+            bucket = self.match(self.limits, record)
+            if bucket is not None and not bucket.take(time.time()):
+                reason = 0
+            else:
+                fraction = self.match(self.sampling, record)
+                if fraction is not None and self.random.random() >= fraction:
+                    reason = 1
+            if reason is None:
+                return True
+            self.suppressed[(record.name, record.levelno)][reason] += 1
+            if reason:
+                self.sampled += 1
+            else:
+                self.limited += 1
+        return False
+
+    def summaries(self, now=None):
+        """
+        Return the summary records if the interval has passed.
+        """
+        now = now or time.time()
+        with self.lock:
+            if now - self.last_summary < self.summary_interval or not self.suppressed:
+                return []
+            elapsed = now - self.last_summary
+            suppressed, self.suppressed = self.suppressed, collections.defaultdict(lambda: [0, 0])
+            self.last_summary = now
+        records = []
+        for (name, levelno), (limited, sampled) in sorted(suppressed.items()):
+            record = logging.LogRecord(
+                name, levelno, __file__, 0,
+                'Suppressed %d %s records in the last %ds (%d rate limited, %d sampled out)',
+                (limited + sampled, logging.getLevelName(levelno), elapsed, limited, sampled),
+                None,
+            )
+            record.suppressed_summary = True
+            records.append(record)
+        return records
+
+
+class Interest(object):
+    """
+    The topics subscribed to at the broadcaster, asked for on its interest
+    endpoint every interval seconds.
+
+    Until the broadcaster answers, or if it stops answering, every record is
+    wanted so nothing is lost by asking.
+    """
+    def __init__(self, context, uri, interval=5):
+        self.context = context
+        self.uri = uri
+        self.interval = interval
+        self.socket = None
+        self.topics = None
+        self.wanted = {}
+        self.answered = self.next_request = 0
+        self.skipped = 0
+
+    def connect(self):
+        """
+        Connect on first use, never queue requests the broadcaster can't take.
+        """
+        self.socket = self.context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.IMMEDIATE, 1)
+        self.socket.setsockopt(zmq.SNDHWM, 1)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(endpoints.resolve(self.uri, 'interest', myip))
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def refresh(self, now=None):
+        """
+        Read any answers and ask again if the interval has passed.
+        """
+        now = now or time.time()
+        if self.socket is None:
+            self.connect()
+        while self.socket.poll(0):
+            reply = self.socket.recv_multipart()
+            if reply[0] == 'SUBSCRIPTIONS':
+                self.topics = reply[1:]
+                self.wanted = {}
+                self.answered = now
+        # If the broadcaster stops answering, go back to sending everything.
+        if self.topics is not None and now - self.answered > 3 * self.interval:
+            self.topics = None
+        if now >= self.next_request:
+            self.next_request = now + self.interval
+            try:
+                self.socket.send('SUBSCRIPTIONS', zmq.NOBLOCK)
+            except zmq.Again:
+                pass
+
+    def isWanted(self, name):
+        """
+        Return True if the records of the logger are subscribed to.
+        """
+        self.refresh()
+        if self.topics is None:
+            return True
+        wanted = self.wanted.get(name)
+        if wanted is None:
+            wanted = self.wanted[name] = logwire.isWanted(self.topics, 'LOGRECORD', name)
+        if not wanted:
+            self.skipped += 1
+        return wanted
+
+
 class PUSHHandler(logging.Handler):
     """
     A LogHandler that pushes log records to a local jLog service. The service
     runs on each node on port 13001.
 
+    The uri may be a comma separated list of endpoints, eg. the shards of a
+    sharded broadcaster, and the records are spread across them. The uri
+    'auto' connects over the fastest transport to the local broadcaster, see
+    endpoints.connectUri.
+
+    The serializer names the logwire serializer for the records, pickle by
+    default for subscribers that only understand pickled records.
+
+    Records that fail to send are kept in a Backlog of backlog_size records,
+    spilling to spill_path if given, which is replayed every replay_interval
+    seconds once the socket is writable.
+
+    Given the interest_uri of the broadcaster, records for loggers nobody is
+    subscribed to are skipped.
+
+    Noisy loggers can be rate limited and sampled at the source with the
+    limits and sampling rules, and the records suppressed are summarised every
+    summary_interval seconds, see RecordLimiter.
+
     Identity: Node-W.X.Y.Z
     """
-    def __init__(self, uri=None, socket=None, context=None):
+    def __init__(self, uri=None, socket=None, context=None, serializer='pickle',
+            backlog_size=10000, spill_path=None, replay_interval=5, interest_uri=None,
+            limits=None, sampling=None, summary_interval=60):
         print "uri: %s" % uri
         logging.Handler.__init__(self)
         self.uri = uri
+        if isinstance(uri, basestring):
+            self.uris = [each.strip() for each in uri.split(',') if each.strip()]
+        else:
+            self.uris = list(uri or [])
         self.identity = "Node-%s" % myip
+        self.serializer = logwire.getSerializer(serializer)
         if isinstance(socket, zmq.Socket):
             self.socket = socket
             self.context = socket.context
             self.termContext = False
+        elif context is None and 'auto' in self.uris:
+            # The broadcaster may be in this process on an inproc endpoint
+            self.socket = None
+            self.termContext = False
+            self.context = zmq.Context.instance()
         else:
             self.socket = None
             self.termContext = context is None
             self.context = context or zmq.Context()
-        self.backlog = []
+        self.backlog = Backlog(backlog_size, spill_path)
+        self.replay_interval = replay_interval
+        self.replay_timer = None
+        self.interest = interest_uri and Interest(self.context, interest_uri)
+        self.limiter = None
+        if limits or sampling:
+            self.limiter = RecordLimiter(limits, sampling, summary_interval)
         self.retry_limit = 10
+        # How long to keep trying to deliver queued messages on close.
+        self.linger = 1000
 
     def connect(self):
         """
@@ -51,55 +445,127 @@ class PUSHHandler(logging.Handler):
             self.socket = self.context.socket(zmq.PUSH)
             self.socket.identity = self.identity
             print "closed flag", self.socket.closed
-        print "Connecting to %s" % self.uri
-        self.socket.connect(self.uri)
+            # Only queue for shards we are connected to so one being down
+            # doesn't hold every nth record.
+            if len(self.uris) > 1:
+                self.socket.setsockopt(zmq.IMMEDIATE, 1)
+        for uri in self.uris:
+            uri = endpoints.resolve(uri, 'pull', myip)
+            print "Connecting to %s" % uri
+            self.socket.connect(uri)
         print "...connected", self.socket.closed
 
     def close(self):
         """
         Tidy up on close.
         """
+        if self.replay_timer:
+            self.replay_timer.cancel()
+        if self.interest:
+            self.interest.close()
         if self.socket and not self.socket.closed:
             self.sendBacklog()
-            self.socket.close()
+            self.socket.close(linger=self.linger)
             self.socket = None
         if self.termContext:
             self.context.term()
         logging.Handler.close(self)
 
+    def stats(self):
+        """
+        Return the backlog metrics and the records skipped for lack of interest.
+        """
+        stats = self.backlog.stats()
+        stats['skipped'] = self.interest and self.interest.skipped or 0
+        stats['rate_limited'] = self.limiter and self.limiter.limited or 0
+        stats['sampled_out'] = self.limiter and self.limiter.sampled or 0
+        return stats
+
+    def isWanted(self, record):
+        """
+        Return True if the record should be sent.
+        """
+        if self.interest and not self.interest.isWanted(record.name):
+            return False
+        return not self.limiter or self.limiter.allow(record)
+
+    def emitSummaries(self):
+        """
+        Emit the summaries of the records suppressed if they are due.
+        """
+        if self.limiter:
+            for record in self.limiter.summaries():
+                self.emit(record)
+
     def handleError(self, record):
         """
         Handle an error during logging.
         """
-        self.backlog.append(record)
+        self.backlog.append(self.makeFrames(record))
+        self.scheduleReplay()
 
     def sendBacklog(self):
         """
-        Attempt to send the backlog.
+        Attempt to send the backlog, returns True when it has all been sent.
         """
-        while self.backlog:
-            record = self.backlog.pop(0)
-            if not seld.send(record):
-                self.backlog.insert(0, record)
-                break
+        if self.socket is None:
+            return False
+        return self.backlog.replay(self.sendFrames)
+
+    def scheduleReplay(self):
+        """
+        Start the timer replaying the backlog if it isn't running.
+        """
+        if self.replay_timer is None and self.replay_interval:
+            self.replay_timer = threading.Timer(self.replay_interval, self.replay)
+            self.replay_timer.daemon = True
+            self.replay_timer.start()
+
+    def replay(self):
+        """
+        Called by the replay timer, send the backlog once the socket is
+        writable again. The handler lock keeps emit off the socket meanwhile.
+        """
+        self.acquire()
+        try:
+            self.replay_timer = None
+            if self.socket is None or self.socket.closed:
+                return
+            if self.socket.poll(0, zmq.POLLOUT) and self.sendBacklog():
+                return
+            self.scheduleReplay()
+        finally:
+            self.release()
 
     def makePickle(self, record):
         """
-        Pickles the LogRecord.
+        Serialize the LogRecord.
         """
-        return pickle.dumps(record, 1)
+        return self.serializer.dumps(record)
 
-    def send(self, record):
+    def makeFrames(self, record):
         """
-        Send the record, try a couple of times.
+        Return the message frames for the record.
 
-        Note the format is (type, qualname, recordpickle).
+        Note the format is (type:qualname, qualname, [header,] recordpickle),
+        see logwire.encodeRecord.
 
         This allows us to filter the records without having to unpickle the
         record itself.
         """
         record.source = self.identity
-        params = ['LOGRECORD', record.name, self.makePickle(record)]
+        return logwire.encodeRecord(record, self.serializer)
+
+    def send(self, record):
+        """
+        Send the record, try a couple of times.
+        """
+        return self.sendFrames(self.makeFrames(record))
+
+    def sendFrames(self, params):
+        """
+        Send the message frames, try a couple of times.
+        """
         tried = 0
         while tried < self.retry_limit:
             tried += 1
@@ -114,10 +580,13 @@ class PUSHHandler(logging.Handler):
         """
         Emit a record.
 
-        We pickle the whole record and send it via the PUSH socket. If the 
+        We serialize the record and send it via the PUSH socket. If the 
         socket buffer is full or fails due to connection then store the record
         in the backlog and we will try again later.
         """
+        self.emitSummaries()
+        if not self.isWanted(record):
+            return
         if self.socket is None:
             self.connect()
         # If connection fails socket will be None still
@@ -125,3 +594,207 @@ class PUSHHandler(logging.Handler):
             self.handleError(record)
 
 
+class QueuedPUSHHandler(PUSHHandler):
+    """
+    A PUSHHandler where emit only queues the record and a sender thread sends
+    the queue in batches, so logging never waits on the socket.
+
+    The queue holds at most queue_size records, when it is full the overflow
+    policy decides what happens to a new record:
+
+        - drop-oldest: the oldest queued record is dropped to make room.
+        - drop-newest: the new record is dropped.
+        - block: wait up to block_timeout seconds for room, then drop the new
+          record.
+
+    The sent and dropped counters, and the errors the sender survived, are
+    available from stats().
+
+    Given a logwire batch codec, eg. zlib or zdict, each batch is sent as one
+    compressed BATCH message rather than a message per record.
+    """
+    OVERFLOW_POLICIES = ('drop-oldest', 'drop-newest', 'block')
+
+    def __init__(self, uri=None, socket=None, context=None, serializer='pickle',
+            queue_size=10000, overflow='drop-oldest', block_timeout=0.1,
+            batch_size=100, flush_interval=0.5, backlog_size=10000, spill_path=None,
+            replay_interval=5, interest_uri=None, codec=None, limits=None,
+            sampling=None, summary_interval=60):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: %s" % overflow)
+        PUSHHandler.__init__(
+            self, uri, socket, context, serializer, backlog_size, spill_path,
+            replay_interval, interest_uri, limits, sampling, summary_interval,
+        )
+        self.next_replay = 0
+        self.queue = collections.deque()
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.codec = codec and logwire.newCodec(codec)
+        self.sent = self.dropped = self.errors = 0
+        self.stopping = False
+        self.condition = threading.Condition()
+        self.sender = threading.Thread(target=self.run, name='QueuedPUSHHandler')
+        self.sender.daemon = True
+        self.sender.start()
+
+    def stats(self):
+        """
+        Return the queue depth, the sent and dropped counters and the backlog
+        metrics.
+        """
+        stats = PUSHHandler.stats(self)
+        stats.update({
+            'queued': len(self.queue),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'errors': self.errors,
+        })
+        return stats
+
+    def scheduleReplay(self):
+        """
+        The sender thread replays the backlog, see run().
+        """
+        if not self.next_replay:
+            self.next_replay = time.time() + self.replay_interval
+
+    def prepare(self, record):
+        """
+        Merge the args into the message and format any exception now, as the
+        record is sent later and from another thread.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        """
+        Queue the record for the sender thread, which also sends the
+        summaries, see takeSummaries().
+        """
+        if not self.isWanted(record):
+            return
+        try:
+            record = self.prepare(record)
+        except Exception:
+            # Bad args for the message, report it the way the stdlib handlers
+            # do rather than backlog a record nobody can format
+            logging.Handler.handleError(self, record)
+            return
+        with self.condition:
+            if len(self.queue) >= self.queue_size:
+                if self.overflow == 'drop-oldest':
+                    self.queue.popleft()
+                    self.dropped += 1
+                elif self.overflow == 'block':
+                    deadline = time.time() + self.block_timeout
+                    while len(self.queue) >= self.queue_size:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                if len(self.queue) >= self.queue_size:
+                    self.dropped += 1
+                    return
+            self.queue.append(record)
+            if len(self.queue) >= self.batch_size:
+                self.condition.notify_all()
+
+    def nextBatch(self):
+        """
+        Wait for a batch of records, or the flush interval, and take them off
+        the queue.
+        """
+        with self.condition:
+            if len(self.queue) < self.batch_size and not self.stopping:
+                self.condition.wait(self.flush_interval)
+            count = min(self.batch_size, len(self.queue))
+            batch = [self.queue.popleft() for _ in xrange(count)]
+            # Wake anyone blocked waiting for room
+            self.condition.notify_all()
+        return batch
+
+    def takeSummaries(self):
+        """
+        Return the summaries of the records suppressed if they are due.
+
+        The sender thread sends them with the next batch rather than through
+        emit, which checks the interest socket of the logging threads and, with
+        the block policy, would wait on the queue only the sender empties.
+        """
+        if not self.limiter:
+            return []
+        return [self.prepare(record) for record in self.limiter.summaries()]
+
+    def run(self):
+        """
+        The sender thread, this is the only thread using the socket.
+        """
+        while not self.stopping or self.queue:
+            batch = self.nextBatch()
+            # An error must not end the thread, the queue would only fill up
+            try:
+                self.sendQueued(batch)
+            except Exception:
+                self.errors += 1
+                print "QueuedPUSHHandler failed to send %d records:" % len(batch)
+                traceback.print_exc()
+
+    def sendQueued(self, batch):
+        """
+        Send a batch taken off the queue, with the summaries and backlog that
+        are due.
+        """
+        # Summarise the records suppressed even when logging goes quiet
+        if not self.stopping:
+            batch.extend(self.takeSummaries())
+        if self.next_replay and time.time() >= self.next_replay:
+            self.next_replay = 0
+            if not self.sendBacklog():
+                self.scheduleReplay()
+        if not batch:
+            return
+        if self.socket is None:
+            self.connect()
+        if self.codec:
+            self.sendBatch(batch)
+            return
+        for record in batch:
+            # If connection fails socket will be None still
+            if self.socket is None or not self.send(record):
+                self.handleError(record)
+            else:
+                self.sent += 1
+
+    def sendBatch(self, batch):
+        """
+        Send the records as one compressed batch, the records go to the backlog
+        one by one if it cannot be sent.
+        """
+        frames = logwire.encodeBatch(
+            '', [self.makeFrames(record) for record in batch], self.codec,
+        )
+        if self.socket is not None and self.sendFrames(frames):
+            self.sent += len(batch)
+            return
+        for record in batch:
+            self.handleError(record)
+
+    def close(self):
+        """
+        Send what is queued and stop the sender before closing the socket.
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.sender.is_alive() and self.sender is not threading.current_thread():
+            self.sender.join()
+        PUSHHandler.close(self)
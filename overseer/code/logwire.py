@@ -0,0 +1,557 @@
+"""
+The wire format of log records sent through the jLog service.
+
+A record is sent by the PUSHHandler as (LOGRECORD, qualname, header, payload)
+where the header names the serializer used for the payload. The original
+format, (LOGRECORD, qualname, pickle), has no header and is still what the
+pickle serializer sends so older subscribers keep working.
+
+Serializers:
+
+    - pickle
+      The whole LogRecord pickled with protocol 1. Only unpickle records from
+      producers you trust.
+
+    - jlb1
+      A compact binary encoding of only the fields the formatters use: created,
+      name, levelno, msg, source and exc_text.
+
+The broadcaster publishes the type and topic together in the first frame, eg.
+LOGRECORD:tornado.access, so subscribers can subscribe to a qualname prefix and
+the publisher filters for them. The proxy mode publishes the type alone.
+
+A broadcaster forwarding to an aggregator upstream sends the messages it relays
+in compressed batches, (BATCH, node, codec, payload), see encodeBatch. The
+aggregator publishes them with the node they came from as a prefix, eg.
+Node-10.0.0.1/LOGRECORD:tornado.access, so a subscriber can tail one node.
+Producers may send batches too, with an empty node, see QueuedPUSHHandler.
+
+Metrics are sent as (METRIC, name, m1, payload), one message for each metric
+aggregated over a flush interval by a metrics.Aggregator, see encodeMetric.
+
+Batch codecs:
+
+    - none
+      Uncompressed.
+
+    - zlib
+      Each batch compressed on its own.
+
+    - zdict
+      zlib primed with a dictionary of earlier records of the batch's topic,
+      which compresses small batches of repetitive lines much better. The
+      dictionary is sent in-band when it changes and every resend batches.
+
+    - lz4
+      Each batch compressed with lz4 if the lz4 package is installed. Faster
+      than zlib but a lower ratio.
+"""
+
+import cPickle as pickle
+import collections
+import logging
+import math
+import os
+import struct
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+class PickleSerializer(object):
+    """
+    Pickle the whole LogRecord.
+    """
+    header = 'pickle'
+
+    def dumps(self, record):
+        return pickle.dumps(record, 1)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class BinarySerializer(object):
+    """
+    Encode the formatted fields of a LogRecord as:
+
+        version (B), levelno (H), created (d), then the lengths of name (H),
+        msg (I), source (H) and exc_text (I) followed by their utf-8 bytes.
+
+    The msg is the record message with its args merged in so the args never
+    need to be serialized, and exc_info is formatted into exc_text.
+    """
+    header = 'jlb1'
+    version = 1
+    __struct__ = struct.Struct('!BHdHIHI')
+    __exc_formatter__ = logging.Formatter()
+    # The attributes of a blank LogRecord, copied rather than running the
+    # LogRecord constructor for every record decoded.
+    __template__ = dict(
+        logging.makeLogRecord({}).__dict__, args=None, exc_info=None, exc_text=None,
+    )
+
+    @staticmethod
+    def _encode(value):
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return str(value)
+
+    def dumps(self, record):
+        exc_text = record.exc_text
+        if not exc_text and record.exc_info:
+            exc_text = self.__exc_formatter__.formatException(record.exc_info)
+        fields = [
+            self._encode(record.name),
+            self._encode(record.getMessage()),
+            self._encode(getattr(record, 'source', None)),
+            self._encode(exc_text),
+        ]
+        return self.__struct__.pack(
+            self.version, record.levelno, record.created, *map(len, fields)
+        ) + ''.join(fields)
+
+    def loads(self, data):
+        version, levelno, created, nlen, mlen, slen, elen = \
+            self.__struct__.unpack_from(data)
+        if version != self.version:
+            raise ValueError("Unsupported jlb version: %d" % version)
+        offset = self.__struct__.size
+        name = data[offset:offset + nlen]
+        offset += nlen
+        msg = data[offset:offset + mlen]
+        offset += mlen
+        source = data[offset:offset + slen]
+        offset += slen
+        exc_text = data[offset:offset + elen] or None
+        record = logging.LogRecord.__new__(logging.LogRecord)
+        record.__dict__ = dict(
+            self.__template__,
+            name=name,
+            msg=msg,
+            levelno=levelno,
+            levelname=logging.getLevelName(levelno),
+            created=created,
+            msecs=(created - long(created)) * 1000,
+            source=source,
+            exc_text=exc_text,
+        )
+        return record
+
+
+SERIALIZERS = {
+    PickleSerializer.header: PickleSerializer(),
+    BinarySerializer.header: BinarySerializer(),
+}
+
+
+def getSerializer(name):
+    """
+    Return the serializer registered under the header name.
+    """
+    try:
+        return SERIALIZERS[name]
+    except KeyError:
+        raise ValueError("Unknown log record serializer: %s" % name)
+
+
+def makeTopic(kind, topic):
+    """
+    Return the first frame published for a message of the type and topic.
+    """
+    return '%s:%s' % (kind, topic)
+
+
+def splitTopic(frame):
+    """
+    Return the (type, topic) from the first frame of a published message.
+    """
+    kind, _, topic = frame.partition(':')
+    return kind.rpartition('/')[2], topic
+
+
+def addNode(node, frame):
+    """
+    Return the first frame of a published message prefixed with the node.
+    """
+    return '%s/%s' % (node, frame)
+
+
+def splitNode(frame):
+    """
+    Return the node prefixing the first frame of a published message, or ''.
+    """
+    return frame.partition(':')[0].rpartition('/')[0]
+
+
+def isWanted(subscriptions, kind, topic):
+    """
+    Return True if any of the subscriptions would receive the message.
+    """
+    frame = makeTopic(kind, topic)
+    for prefix in subscriptions:
+        if frame.startswith(prefix):
+            return True
+    return False
+
+
+def encodeRecord(record, serializer):
+    """
+    Return the frames sending the record with the serializer.
+
+    The first frame is already the topic it is published with, eg.
+    LOGRECORD:tornado.access, so a broadcaster in proxy mode publishes it as
+    the other modes do.
+    """
+    payload = serializer.dumps(record)
+    topic = makeTopic('LOGRECORD', record.name)
+    if serializer.header == PickleSerializer.header:
+        return [topic, record.name, payload]
+    return [topic, record.name, serializer.header, payload]
+
+
+def decodeRecord(frames):
+    """
+    Return the LogRecord from a (LOGRECORD, qualname, [header,] payload)
+    message, detecting the serializer from the header frame.
+
+    Raises ValueError for a message that is not a record we can decode.
+    """
+    if len(frames) < 3:
+        raise ValueError("A log record has 3 or 4 frames, not %d" % len(frames))
+    if len(frames) > 3:
+        serializer = getSerializer(frames[2])
+    else:
+        serializer = SERIALIZERS[PickleSerializer.header]
+    try:
+        return serializer.loads(frames[-1])
+    except ValueError:
+        raise
+    # Unpickling garbage can raise most anything
+    except Exception, exc:
+        raise ValueError("Cannot decode a %s record: %s" % (serializer.header, exc))
+
+
+COUNTER, GAUGE, HISTOGRAM = 'c', 'g', 'h'
+
+
+class MetricSample(collections.namedtuple(
+        'MetricSample', 'name kind timestamp count value low high buckets source')):
+    """
+    A metric aggregated over one flush interval.
+
+        - counter: count increments adding up to value.
+        - gauge: count readings, the last being value.
+        - histogram: count observations adding up to value, with the count
+          in each bucket, see histogramBucket.
+
+    The low and high are the smallest and largest reading or observation.
+    """
+    __slots__ = ()
+
+
+# The histogram buckets are a quarter of a power of two wide, about 19%.
+BUCKETS_PER_OCTAVE = 4
+# The bucket of the values of 0 and below.
+ZERO_BUCKET = -32768
+
+METRIC_HEADER = 'm1'
+METRIC_STRUCT = struct.Struct('!cdIdddH')
+METRIC_BUCKET = struct.Struct('!hI')
+
+
+def histogramBucket(value):
+    """
+    Return the index of the histogram bucket the value falls in.
+    """
+    if value <= 0:
+        return ZERO_BUCKET
+    return int(math.floor(math.log(value, 2) * BUCKETS_PER_OCTAVE))
+
+
+def bucketBound(index):
+    """
+    Return the upper bound of the histogram bucket.
+    """
+    if index == ZERO_BUCKET:
+        return 0.0
+    return 2 ** (float(index + 1) / BUCKETS_PER_OCTAVE)
+
+
+def encodeMetric(sample):
+    """
+    Return the frames sending the MetricSample. The payload is its kind (c),
+    timestamp (d), count (I), value, low and high (d), the number of buckets
+    (H) then the index (h) and count (I) of each, followed by the source.
+    """
+    buckets = sorted((sample.buckets or {}).items())
+    payload = METRIC_STRUCT.pack(
+        sample.kind, sample.timestamp, sample.count, sample.value,
+        sample.low, sample.high, len(buckets),
+    ) + ''.join(METRIC_BUCKET.pack(index, count) for index, count in buckets)
+    source = sample.source or ''
+    if isinstance(source, unicode):
+        source = source.encode('utf-8')
+    return [makeTopic('METRIC', sample.name), sample.name, METRIC_HEADER, payload + source]
+
+
+def decodeMetric(frames):
+    """
+    Return the MetricSample from a (METRIC, name, m1, payload) message.
+    """
+    if frames[2] != METRIC_HEADER:
+        raise ValueError("Unsupported metric format: %s" % frames[2])
+    data = frames[3]
+    kind, timestamp, count, value, low, high, nbuckets = METRIC_STRUCT.unpack_from(data)
+    offset = METRIC_STRUCT.size
+    buckets = {}
+    for _ in xrange(nbuckets):
+        index, bucket = METRIC_BUCKET.unpack_from(data, offset)
+        buckets[index] = bucket
+        offset += METRIC_BUCKET.size
+    return MetricSample(
+        frames[1], kind, timestamp, count, value, low, high, buckets, data[offset:],
+    )
+
+
+class ZlibCodec(object):
+    """
+    Compress a batch with zlib.
+    """
+    header = 'zlib'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data, topic=''):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class PlainCodec(object):
+    """
+    Send a batch uncompressed.
+    """
+    header = 'none'
+
+    def compress(self, data, topic=''):
+        return data
+
+    def decompress(self, data):
+        return data
+
+
+class LZ4Codec(object):
+    """
+    Compress a batch with lz4.
+    """
+    header = 'lz4'
+
+    def compress(self, data, topic=''):
+        return lz4.frame.compress(data)
+
+    def decompress(self, data):
+        return lz4.frame.decompress(data)
+
+
+class DictionaryCodec(object):
+    """
+    Compress a batch with zlib primed with a dictionary for its topic.
+
+    The zlib in python 2 takes no preset dictionary so we emulate one: the
+    dictionary is compressed and sync flushed, leaving a compressor whose
+    window holds it, and each batch is compressed with a copy of it. The
+    receiver primes a decompressor with the same compressed dictionary.
+
+    The dictionary of a topic is the last dict_size bytes of a batch of it,
+    retrained every retrain batches. The first batch of a topic is sent
+    without one. A new dictionary is sent with each of the first warmup
+    batches using it, so a receiver missing a few of them, eg. dropped at the
+    HWM of a forwarder, is not left without it, and then every resend
+    batches. The payload is:
+
+        encoder id (8s), length of the topic (H), dictionary version (I),
+        length of the compressed dictionary (I) or 0 when not included,
+        then the topic, the compressed dictionary and the batch.
+
+    Receivers key the dictionaries by encoder id and topic so one aggregator
+    can take batches from many encoders, keeping the max_decoders used last.
+    A batch whose dictionary was evicted fails until the encoder resends it.
+    """
+    header = 'zdict'
+    __struct__ = struct.Struct('!8sHII')
+
+    def __init__(self, level=6, dict_size=16 * 1024, retrain=1000, resend=100,
+            warmup=10, max_decoders=256):
+        self.level = level
+        self.dict_size = dict_size
+        self.retrain = retrain
+        self.resend = resend
+        self.warmup = warmup
+        self.id = os.urandom(8)
+        # topic: [version, compressed dictionary, primed compressor, batches]
+        self.encoders = {}
+        # (encoder id, topic): (version, primed decompressor), least recently
+        # used first
+        self.decoders = collections.OrderedDict()
+        self.max_decoders = max_decoders
+
+    def prime(self, dictionary):
+        """
+        Return the compressed dictionary and the compressor primed with it.
+        """
+        compressor = zlib.compressobj(self.level)
+        compressed = compressor.compress(dictionary) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return compressed, compressor
+
+    def compress(self, data, topic=''):
+        state = self.encoders.get(topic)
+        if state is None:
+            state = self.encoders[topic] = [0, '', None, 0]
+        version, compressed, primed, batches = state
+        if primed is None:
+            body = zlib.compress(data, self.level)
+        else:
+            compressor = primed.copy()
+            body = compressor.compress(data) + compressor.flush()
+        include = version and (batches < self.warmup or batches % self.resend == 0)
+        payload = self.__struct__.pack(
+            self.id, len(topic), version, include and len(compressed) or 0,
+        ) + topic + (include and compressed or '') + body
+        state[3] += 1
+        # Train the next dictionary on this batch
+        if primed is None or state[3] % self.retrain == 0:
+            compressed, primed = self.prime(data[-self.dict_size:])
+            self.encoders[topic] = [version + 1, compressed, primed, 0]
+        return payload
+
+    def decompress(self, data):
+        encoder, tlen, version, dlen = self.__struct__.unpack_from(data)
+        offset = self.__struct__.size
+        topic = data[offset:offset + tlen]
+        offset += tlen
+        key = (encoder, topic)
+        # Only prime a dictionary we don't have, it is resent during warmup
+        if dlen and self.decoders.get(key, (None, None))[0] != version:
+            primed = zlib.decompressobj()
+            primed.decompress(data[offset:offset + dlen])
+            self.decoders.pop(key, None)
+            self.decoders[key] = (version, primed)
+            while len(self.decoders) > self.max_decoders:
+                self.decoders.popitem(last=False)
+        offset += dlen
+        if not version:
+            return zlib.decompress(data[offset:])
+        known, primed = self.decoders.get(key, (None, None))
+        if known is not None:
+            # Move it to the most recently used end
+            self.decoders[key] = self.decoders.pop(key)
+        if known != version:
+            raise ValueError("Missing dictionary %d for %r" % (version, topic))
+        decompressor = primed.copy()
+        return decompressor.decompress(data[offset:]) + decompressor.flush()
+
+
+CODECS = {
+    ZlibCodec.header: ZlibCodec(),
+    PlainCodec.header: PlainCodec(),
+    DictionaryCodec.header: DictionaryCodec(),
+}
+if lz4 is not None:
+    CODECS[LZ4Codec.header] = LZ4Codec()
+
+
+def getCodec(name):
+    """
+    Return the batch codec registered under the header name, this is shared
+    by everything decoding batches in the process.
+    """
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError("Unknown batch codec: %s" % name)
+
+
+def newCodec(name):
+    """
+    Return a codec of its own for something encoding batches, as some codecs
+    keep the state of what they have sent.
+    """
+    return getCodec(name).__class__()
+
+
+FRAME_COUNT = struct.Struct('!H')
+FRAME_LENGTH = struct.Struct('!I')
+
+
+def packBatch(messages):
+    """
+    Return the messages as one string, each the number of its frames (H) then
+    the length (I) and bytes of each frame.
+    """
+    parts = []
+    for frames in messages:
+        parts.append(FRAME_COUNT.pack(len(frames)))
+        for frame in frames:
+            parts.append(FRAME_LENGTH.pack(len(frame)))
+            parts.append(frame)
+    return ''.join(parts)
+
+
+def unpackBatch(data):
+    """
+    Return the list of messages packed by packBatch.
+    """
+    messages = []
+    offset, end = 0, len(data)
+    while offset < end:
+        count, = FRAME_COUNT.unpack_from(data, offset)
+        offset += FRAME_COUNT.size
+        frames = []
+        for _ in xrange(count):
+            length, = FRAME_LENGTH.unpack_from(data, offset)
+            offset += FRAME_LENGTH.size
+            frames.append(data[offset:offset + length])
+            offset += length
+        messages.append(frames)
+    return messages
+
+
+def batchTopic(messages):
+    """
+    Return the most common topic of the messages.
+    """
+    topics = collections.Counter(frames[1] for frames in messages if len(frames) > 1)
+    return topics and topics.most_common(1)[0][0] or ''
+
+
+def encodeBatch(node, messages, codec):
+    """
+    Return the frames forwarding the messages from the node upstream.
+    """
+    return [
+        'BATCH', node, codec.header,
+        codec.compress(packBatch(messages), batchTopic(messages)),
+    ]
+
+
+def decodeBatch(frames):
+    """
+    Return the (node, messages) from a (BATCH, node, codec, payload) message.
+    Raises ValueError if the message is malformed.
+    """
+    if len(frames) != 4:
+        raise ValueError("A batch has 4 frames, not %d" % len(frames))
+    codec = getCodec(frames[2])
+    try:
+        return frames[1], unpackBatch(codec.decompress(frames[3]))
+    # lz4 raises RuntimeError for a corrupt frame
+    except (struct.error, IndexError, RuntimeError), exc:
+        raise ValueError("Truncated batch: %s" % exc)
@@ -33,13 +33,24 @@ from tornado.options import define, options, parse_command_line
 define('port', default=3000, help='port to listen on.')
 define('debug', default=False, type=bool, help='Turns on debug logging.')
 define('reload', default=False, type=bool, help='Reload application when files change.')
+define('relay', default=False, type=bool, help='Run the jLog broadcaster on our IOLoop.')
+define('relay_upstream', default=None, help='Forward the relayed logs to this broadcaster.')
+define('migrate', default=False, type=bool, help='Bring the services table up to date and exit.')
 
+import broadcaster
 import handlers
 
 
 def main():
     parse_command_line()
+    if options.migrate:
+        app_log.info("Migrating the services table.")
+        handlers.services.AWSAPI().migrate()
+        return
     app_log.info("Starting Overseer Application.")
+    if options.relay:
+        # Before the handlers so jLog connects to the relay over inproc
+        broadcaster.StreamRelay(upstream=options.relay_upstream).start()
     app = Application(
         handlers.getHandlers(),
         debug=options.debug,
@@ -0,0 +1,183 @@
+"""
+Send counters, gauges and histograms to the jLog broadcaster.
+
+The Aggregator adds up what is recorded between flushes and every
+flush_interval seconds sends one METRIC message per metric, so a counter
+incremented on every request costs a dict lookup, not a message:
+
+    > aggregator = metrics.Aggregator('auto')
+    > aggregator.increment('services.get')
+    > aggregator.gauge('services.registered', 12)
+    > aggregator.observe('services.get.ms', 3.2)
+
+The messages go to the PULL socket of the broadcaster like the log records and
+are published as METRIC:<name>, see logwire.encodeMetric. The overseer keeps
+rolling windows of them at /metrics, see handlers.metricshandler.
+
+Metrics are best effort: if the broadcaster is not keeping up they are dropped
+and counted rather than queued.
+
+The overseer sends the calls and milliseconds of its service registry's
+DynamoDB operations this way, see handlers.services.AsyncAWSAPI.
+"""
+
+import socket
+import threading
+import time
+
+import zmq
+
+import endpoints
+import logwire
+
+
+myip = socket.gethostbyname(socket.gethostname())
+
+
+class Metric(object):
+    """
+    What has been recorded for a metric since the last flush.
+    """
+    __slots__ = ('kind', 'count', 'value', 'low', 'high', 'buckets')
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.count = 0
+        self.value = 0.0
+        self.low = None
+        self.high = None
+        self.buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        if self.kind == logwire.GAUGE:
+            self.value = value
+        else:
+            self.value += value
+        if self.low is None or value < self.low:
+            self.low = value
+        if self.high is None or value > self.high:
+            self.high = value
+        if self.kind == logwire.HISTOGRAM:
+            index = logwire.histogramBucket(value)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def sample(self, name, timestamp, source):
+        return logwire.MetricSample(
+            name, self.kind, timestamp, self.count, self.value,
+            self.low or 0.0, self.high or 0.0, self.buckets, source,
+        )
+
+
+class Aggregator(object):
+    """
+    Pre-aggregate metrics in this process and send them every flush_interval
+    seconds from a thread.
+
+    The uri 'auto' connects over the fastest transport to the local
+    broadcaster, see endpoints.connectUri.
+    """
+    def __init__(self, uri='auto', context=None, flush_interval=10, source=None, hwm=1000):
+        self.uri = endpoints.resolve(uri, 'pull', myip)
+        # The broadcaster may be in this process on an inproc endpoint
+        self.context = context or zmq.Context.instance()
+        self.flush_interval = flush_interval
+        self.source = source or "Node-%s" % myip
+        self.hwm = hwm
+        self.socket = None
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.dropped = 0
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='metrics-aggregator')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self, kind, name, value):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None or metric.kind != kind:
+                metric = self.metrics[name] = Metric(kind)
+            metric.add(value)
+
+    def increment(self, name, value=1):
+        """
+        Add the value to the counter.
+        """
+        self.record(logwire.COUNTER, name, value)
+
+    def gauge(self, name, value):
+        """
+        Set the gauge to the value.
+        """
+        self.record(logwire.GAUGE, name, value)
+
+    def observe(self, name, value):
+        """
+        Add the value, eg. a duration, to the histogram.
+        """
+        self.record(logwire.HISTOGRAM, name, value)
+
+    def timer(self, name):
+        """
+        Return a context manager observing the milliseconds its block takes.
+        """
+        return Timer(self, name)
+
+    def connect(self):
+        self.socket = self.context.socket(zmq.PUSH)
+        self.socket.setsockopt(zmq.SNDHWM, self.hwm)
+        self.socket.connect(self.uri)
+
+    def flush(self):
+        """
+        Send what has been recorded since the last flush.
+        """
+        with self.lock:
+            metrics, self.metrics = self.metrics, {}
+        if not metrics:
+            return
+        if self.socket is None:
+            self.connect()
+        now = time.time()
+        for name, metric in metrics.iteritems():
+            try:
+                self.socket.send_multipart(
+                    logwire.encodeMetric(metric.sample(name, now, self.source)),
+                    zmq.NOBLOCK,
+                )
+                self.sent += 1
+            except zmq.Again:
+                self.dropped += 1
+
+    def run(self):
+        while not self.closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """
+        Stop the thread and send what is left.
+        """
+        self.closed.set()
+        self.thread.join()
+        self.flush()
+        if self.socket is not None:
+            self.socket.close(linger=1000)
+            self.socket = None
+
+    def stats(self):
+        return {'sent': self.sent, 'dropped': self.dropped}
+
+
+class Timer(object):
+    def __init__(self, aggregator, name):
+        self.aggregator = aggregator
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.aggregator.observe(self.name, (time.time() - self.started) * 1000)
@@ -5,8 +5,13 @@ if [ "x$AWS_EXECUTION_ENV" != "x" ]; then
     echo "AWS_DEFAULT_REGION=$region" >> /etc/environment
 fi
 
-python /opt/overseer/broadcaster.py &
-python /opt/overseer/main.py --reload &
+# The overseer runs the jLog broadcaster on its own IOLoop, forwarding this
+# node's logs to the cluster's aggregating broadcaster if we have one
+relay_args="--relay"
+if [ "x$JLOG_UPSTREAM" != "x" ]; then
+    relay_args="$relay_args --relay_upstream=$JLOG_UPSTREAM"
+fi
+python /opt/overseer/main.py --reload $relay_args &
 
 term_handler() {
     echo "Interupted by TERM" 